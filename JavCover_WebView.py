@@ -16,13 +16,24 @@ rename_dir = os.path.join(base_path, "rename")
 if rename_dir not in sys.path:
     sys.path.insert(0, rename_dir)
 
-try:
-    import rename_movies
-    import manual_fix
-except ImportError as e:
-    print(f"Error importing modules: {e}")
-    rename_movies = None
-    manual_fix = None
+# Jobs run on the local worker service (one queue shared with the CLI and drag scripts).
+# worker_service itself is light; the pipeline modules are loaded by load_pipeline()
+# in the background once the window is up (see webview.start below).
+import worker_service
+import cover_preview
+
+# The cover preview is pushed to the page at most this often; only the newest cover is sent
+PREVIEW_INTERVAL = 0.5
+
+def load_pipeline(api):
+    api.connect_service()
+    if isinstance(api._service, worker_service.WorkerService):
+        # Hosting the service here: warm up the pipeline before the first file is dropped
+        try:
+            import rename_movies
+            rename_movies.preload()
+        except ImportError as e:
+            print(f"Error importing modules: {e}")
 
 # --- API ---
 class Api:
@@ -30,9 +41,60 @@ class Api:
         self._window = None
         self.cover_save_path = ""
         self.default_cover_path = self._get_default_cover_path()
+        self._service = None
+        self._service_ready = threading.Event()
+        # Jobs submitted from this window that have not finished yet (oldest first)
+        self._jobs = []
+        self._jobs_lock = threading.Lock()
+        self._preview_path = None
+        self._preview_event = threading.Event()
 
     def set_window(self, window):
         self._window = window
+        threading.Thread(target=self._preview_loop, daemon=True).start()
+
+    # --- Cover preview ---
+    def show_cover(self, path):
+        """Request a preview of `path` (None clears it). Called for every cover; sent throttled."""
+        self._preview_path = path
+        self._preview_event.set()
+
+    def append_log(self, message):
+        """Add text to the log pane."""
+        safe_msg = message.replace("\\", "\\\\").replace("'", "\\'").replace("\n", "\\n").replace("\r", "")
+        if self._window:
+            try:
+                self._window.evaluate_js(f"window.append_log('{safe_msg}')")
+            except Exception:
+                pass
+
+    def _preview_loop(self):
+        shown = None
+        while True:
+            self._preview_event.wait()
+            self._preview_event.clear()
+            path = self._preview_path
+            if path != shown:
+                # A small JPEG as a data URL instead of the full-size file (see cover_preview)
+                url = cover_preview.data_url(path) if path else None
+                try:
+                    self._window.evaluate_js(f"window.set_cover({json.dumps(url or '')})")
+                    shown = path
+                except Exception:
+                    pass
+            time.sleep(PREVIEW_INTERVAL)
+
+    def connect_service(self):
+        """Use the worker service if one is running, otherwise host it in this process."""
+        try:
+            self._service = worker_service.connect()
+            if self._service:
+                print("Connected to the running worker service.")
+            else:
+                self._service = worker_service.WorkerService().start()
+                self._service.serve_http()
+        finally:
+            self._service_ready.set()
 
     def _get_default_cover_path(self):
         if getattr(sys, 'frozen', False):
@@ -55,6 +117,7 @@ class Api:
         if self._window: self._window.toggle_fullscreen()
 
     def close(self):
+        if isinstance(self._service, worker_service.WorkerService): self._service.stop()
         if self._window: self._window.destroy()
     
     def select_folder(self):
@@ -68,49 +131,90 @@ class Api:
         if not self._window: return
         result = self._window.create_file_dialog(webview.FileDialog.OPEN, allow_multiple=True, file_types=('Video Files (*.mp4;*.mkv;*.avi)', 'All files (*.*)'))
         if result:
-            threading.Thread(target=self._run_worker, args=(result, True), daemon=True).start()
+            threading.Thread(target=self._submit, args=("rename", result), daemon=True).start()
 
     def start_manual(self):
         if not self._window: return
         result = self._window.create_file_dialog(webview.FileDialog.OPEN, allow_multiple=True, file_types=('Video Files (*.mp4;*.mkv;*.avi)', 'All files (*.*)'))
         if result:
-            threading.Thread(target=self._run_worker, args=(result, False), daemon=True).start()
+            threading.Thread(target=self._submit, args=("manual", result), daemon=True).start()
 
-    def _run_worker(self, files, is_javcover):
-        total = len(files)
-        
-        # Reset UI
-        self._window.evaluate_js("window.reset_ui()")
-        time.sleep(0.1)
-
-        for i, f in enumerate(files):
-            filename = os.path.basename(f)
-            parent = os.path.dirname(f)
-            
-            # Update Total Progress
-            self._window.evaluate_js(f"window.update_progress({i}, {total}, 'Processing {filename}', 0)")
-            
-            def progress_cb(idx_ignored, pct, msg):
-                # Escape msg for JS
-                safe_msg = msg.replace("'", "\\'").replace("\n", " ")
-                self._window.evaluate_js(f"window.update_progress({i}, {total}, '{safe_msg}', {pct})")
+    # --- Job control (pause/cancel take effect between stages; ffmpeg and downloads are aborted) ---
+    def pause_job(self):
+        job_id = self._running_job()
+        if job_id and self._service.pause(job_id):
+            self._window.evaluate_js("window.set_job_state('paused')")
 
-            try:
-                if is_javcover and rename_movies:
-                    rename_movies.process_directory(
-                        parent, False, target_file=filename,
-                        progress_callback=progress_cb,
-                        custom_cover_dir=self.cover_save_path
-                    )
-                elif not is_javcover and manual_fix:
-                    # Manual Fix Wrapper
-                    def man_cb(pct, msg):
-                        progress_cb(0, pct, msg)
-                    manual_fix.process_file(f, progress_callback=man_cb)
-            except Exception as e:
-                print(f"Error: {e}")
-
-        self._window.evaluate_js(f"window.update_progress({total}, {total}, 'All Done.', 100)")
+    def resume_job(self):
+        job_id = self._running_job()
+        if job_id and self._service.resume(job_id):
+            self._window.evaluate_js("window.set_job_state('running')")
+
+    def cancel_job(self):
+        """Cancel the running job and everything queued behind it from this window."""
+        with self._jobs_lock:
+            jobs = list(self._jobs)
+        for job_id in reversed(jobs):
+            self._service.cancel(job_id)
+        if jobs: self._window.evaluate_js("window.set_job_state('cancelling')")
+
+    def _running_job(self):
+        if not self._service_ready.is_set(): return None
+        with self._jobs_lock:
+            return self._jobs[0] if self._jobs else None
+
+    def _submit(self, kind, files):
+        """Queue a job (clicks during a running job queue up behind it) and mirror its progress."""
+        self._service_ready.wait()
+        options = {"cover_dir": self.cover_save_path} if kind == "rename" else {}
+        job_id = self._service.submit(kind, list(files), **options)
+        with self._jobs_lock:
+            self._jobs.append(job_id)
+        try:
+            self._follow(job_id)
+        finally:
+            with self._jobs_lock:
+                self._jobs.remove(job_id)
+
+    def _follow(self, job_id):
+        started = False
+        # A service in another process (e.g. started by a drag script) prints to its own
+        # console or worker.log: mirror the job's output and cover here instead
+        remote = not isinstance(self._service, worker_service.WorkerService)
+        since, cover = 0, None
+        while True:
+            job = self._service.status(job_id, since=since if remote else None)
+            if not job: return
+            if job["state"] == "queued":
+                time.sleep(0.5)
+                continue
+            if not started:
+                # Reset UI
+                self._window.evaluate_js("window.reset_ui()")
+                self._window.evaluate_js("window.set_job_state('running')")
+                self.show_cover(None)
+                started = True
+            if remote:
+                for line in job.get("log", []): self.append_log(line + "\n")
+                since = job.get("log_next", since)
+            if job.get("cover") and job["cover"] != cover:
+                cover = job["cover"]
+                self.show_cover(cover)
+            current = job["current"]
+            if job["state"] != "running":
+                if job["state"] == "failed":
+                    msg = f"Failed: {job.get('error') or 'unknown error'}"
+                else:
+                    msg = "Cancelled." if job["state"] == "cancelled" else "All Done."
+                safe_msg = msg.replace("\\", "\\\\").replace("'", "\\'").replace("\n", " ")
+                self._window.evaluate_js(f"window.update_progress({job['completed']}, {job['total']}, '{safe_msg}', 100)")
+                self._window.evaluate_js("window.set_job_state('idle')")
+                return
+            # Escape msg for JS
+            msg = f"Paused: {current['msg']}" if job.get("paused") else current["msg"]
+            safe_msg = msg.replace("\\", "\\\\").replace("'", "\\'").replace("\n", " ")
+            self._window.evaluate_js(f"window.update_progress({current['index']}, {job['total']}, '{safe_msg}', {current['pct']})")
+            time.sleep(0.2)
 
 
 # --- LOGGER ---
@@ -125,22 +229,11 @@ class BridgeLogger:
         
         # Intercept Cover Path
         if message.startswith("[COVER_PATH]"):
-            path = message.replace("[COVER_PATH]", "").strip()
-            js_path = path.replace(os.sep, '/')
-            if self.api._window:
-                try:
-                    self.api._window.evaluate_js(f"window.set_cover('{js_path}')")
-                except Exception:
-                    pass
+            self.api.show_cover(message.replace("[COVER_PATH]", "").strip())
             return
 
         # Send to Log Area
-        safe_msg = message.replace("\\", "\\\\").replace("'", "\\'").replace("\n", "\\n").replace("\r", "")
-        if self.api._window:
-            try:
-                self.api._window.evaluate_js(f"window.append_log('{safe_msg}')")
-            except Exception:
-                pass
+        self.api.append_log(message)
         
         # Also print to console for debug (only if console exists)
         if self._orig_stdout:
@@ -184,4 +277,4 @@ if __name__ == '__main__':
     api.set_window(window)
     
     # Enable EasyDrag to drag the window by title bar (defined in CSS with -webkit-app-region: drag)
-    webview.start(debug=False, gui="edgechromium")
+    webview.start(load_pipeline, api, debug=False, gui="edgechromium")
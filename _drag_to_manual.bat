@@ -2,12 +2,9 @@
 chcp 65001 > nul
 cd /d "%~dp0"
 
-:loop
 if "%~1"=="" goto done
-echo Processing: "%~1"
-python "%~dp0rename\manual_fix.py" "%~1"
-shift
-goto loop
+rem Queue everything on the local worker service (started if needed); unresolved files are listed at the end
+python "%~dp0rename\worker_service.py" submit manual %* --wait
 
 :done
 echo.
@@ -11,7 +11,7 @@ a = Analysis(
         (os.path.join(SPECPATH, '..', 'icon.ico'), '.'),
         (os.path.join(PROJ_DIR, 'gui'), 'gui'),
     ],
-    hiddenimports=['rename_movies', 'manual_fix', 'cloudscraper', 'mutagen', 'PIL', 'webview', 'clr_loader', 'pythonnet'],
+    hiddenimports=['rename_movies', 'manual_fix', 'watch_folder', 'library_scan', 'cover_index', 'mp4_boxes', 'run_report', 'app_paths', 'batch_journal', 'code_parser', 'rename_plan', 'io_scheduler', 'mp4_tags', 'mp4_faststart', 'mp4_verify', 'mkv_tags', 'library_audit', 'library_catalog', 'worker_service', 'job_control', 'cover_preview', 'label_patterns', 'http_client', 'prefetch', 'work_leases', 'metadata_cache', 'metrics', 'cloudscraper', 'mutagen', 'PIL', 'webview', 'clr_loader', 'pythonnet'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -38,16 +38,13 @@ window.append_log = function (text) {
     log.scrollTop = log.scrollHeight;
 };
 
-window.set_cover = function (path) {
+// src: data URL of a small preview made by Python (cover_preview), '' to clear
+window.set_cover = function (src) {
     const img = gel('coverImg');
     const ph = gel('coverPlaceholder');
 
-    if (path && path.trim() !== "") {
-        // Force refresh if same path (cache bust unlikely needed for local file but safe)
-        // Note: pywebview might need special handling for local files depending on config.
-        // Usually, absolute paths work if scheme is supported, or we use base64.
-        // We will try setting src directly.
-        img.src = path + "?t=" + new Date().getTime();
+    if (src) {
+        img.src = src;
         img.style.display = 'block';
         ph.style.display = 'none';
     } else {
@@ -69,6 +66,23 @@ window.reset_ui = function () {
     window.set_cover('');
 };
 
+// Job state from Python: 'running' | 'paused' | 'cancelling' | 'idle'
+let jobState = 'idle';
+
+window.set_job_state = function (state) {
+    jobState = state;
+    const active = state === 'running' || state === 'paused';
+    gel('btnPause').classList.toggle('disabled', !active);
+    gel('btnCancel').classList.toggle('disabled', !active);
+    gel('lblPause').innerText = state === 'paused' ? 'Resume' : 'Pause';
+    if (state === 'cancelling') gel('statusL').innerText = 'Cancelling...';
+};
+
+window.toggle_pause = function () {
+    if (jobState === 'paused') pywebview.api.resume_job();
+    else if (jobState === 'running') pywebview.api.pause_job();
+};
+
 // --- INIT ---
 window.addEventListener('pywebviewready', function () {
     console.log('PyWebview Ready');
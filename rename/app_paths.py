@@ -0,0 +1,24 @@
+"""
+Locations for state that has to survive between runs (journals, caches).
+
+Default: <label>/.javcover when running from source, <exe dir>/.javcover for
+the frozen GUI (sys._MEIPASS is a temp dir that is deleted on exit).
+Override with the JAVCOVER_DATA_DIR environment variable.
+"""
+
+import os
+import sys
+
+
+def data_dir(*parts):
+    """Return (and create) a directory under the data root."""
+    base = os.environ.get("JAVCOVER_DATA_DIR")
+    if not base:
+        if getattr(sys, 'frozen', False):
+            base = os.path.join(os.path.dirname(sys.executable), ".javcover")
+        else:
+            label_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            base = os.path.join(label_dir, ".javcover")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,311 @@
+"""
+Write-ahead journal for batch runs.
+
+Every file operation that can leave the disk in an intermediate state
+(rename, ffmpeg faststart/repair with temp + backup files, cover embedding)
+first appends an "intent" record, optionally a "swap" record once the temp
+file is complete, and finally "done"/"failed". Records are JSON lines,
+flushed and fsync'd before the operation continues.
+
+On startup `recover()` replays journals left behind by dead processes and
+rolls each unfinished step back to a consistent state (restore `.bak`,
+remove half-written temp files, or promote a finished temp file).
+`--resume` reopens the newest unfinished journal of the same kind and skips
+files it already completed.
+"""
+
+import os
+import json
+import time
+import socket
+import shutil
+import threading
+
+from app_paths import data_dir
+import work_leases
+
+KEEP_FINISHED_JOURNALS = 20
+# Temp files younger than this may still be written by a live ffmpeg
+STALE_TEMP_SECONDS = 600
+
+# Suffixes our tools append to the video path for temp files / backups
+TEMP_SUFFIXES = (".faststart.mp4", ".repaired.mp4", ".temp.mp4", ".tags.tmp")
+BACKUP_SUFFIXES = (".bak", ".corrupt.bak")
+# Never deleted: an in-place faststart is finished from it (see mp4_faststart)
+INPLACE_SIDECAR_SUFFIX = ".faststart.moov"
+
+
+def _journal_dir():
+    return data_dir("journal")
+
+
+def _pid_alive(pid, host):
+    if host != socket.gethostname(): return True  # Can't tell; assume alive
+    if pid == os.getpid(): return True
+    if os.name == 'nt':
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        handle = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle: return False
+        exit_code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _owner_alive(header, records):
+    """Is the process that last wrote to this journal still running?"""
+    pid = header["pid"]
+    for rec in records:
+        pid = rec.get("pid", pid)
+    return _pid_alive(pid, header.get("host"))
+
+
+def _read_journal(path):
+    header, records, ended = None, [], False
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                if "batch" in rec: header = rec
+                elif rec.get("end"): ended = True
+                else: records.append(rec)
+    except OSError:
+        pass
+    return header, records, ended
+
+
+class NullJournal:
+    """Stand-in used when no journal is active."""
+    path = None
+
+    def record(self, *args, **kwargs): pass
+    def file_done(self, *args, **kwargs): pass
+    def is_done(self, path): return False
+    def close(self): pass
+
+
+NULL = NullJournal()
+
+
+class BatchJournal:
+    def __init__(self, path, header, records=()):
+        self.path = path
+        self.header = header
+        self._lock = threading.Lock()
+        self._done = set()
+        for rec in records:
+            if rec.get("step") == "file" and rec.get("state") == "done":
+                self._done.add(os.path.normcase(rec["file"]))
+                if rec.get("final"): self._done.add(os.path.normcase(rec["final"]))
+        self._f = open(path, 'a', encoding='utf-8')
+
+    @classmethod
+    def open(cls, kind, resume=False, **args):
+        """Start a new batch journal, or with resume=True continue the newest unfinished one of `kind`."""
+        if resume:
+            for path in sorted(_list_journals(), reverse=True):
+                header, records, ended = _read_journal(path)
+                if header and header.get("kind") == kind and not ended:
+                    journal = cls(path, header, records)
+                    journal._write({"resumed": time.time(), "pid": os.getpid()})
+                    print(f"[Journal] Resuming batch {header['batch']} ({len(journal._done)} file(s) already done)")
+                    return journal
+            print("[Journal] No unfinished batch to resume; starting a new one.")
+
+        batch_id = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        header = {"batch": batch_id, "kind": kind, "pid": os.getpid(),
+                  "host": socket.gethostname(), "started": time.time(), "args": args}
+        journal = cls(os.path.join(_journal_dir(), f"{batch_id}.jsonl"), header)
+        journal._write(header)
+        return journal
+
+    def _write(self, rec):
+        with self._lock:
+            self._f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def record(self, path, step, state, **info):
+        """Append a step record. state: intent / swap / done / failed."""
+        self._write({"ts": time.time(), "pid": os.getpid(), "file": os.path.abspath(path),
+                     "step": step, "state": state, **info})
+
+    def file_done(self, path, final=None):
+        """Mark every step for `path` as complete (skipped on --resume)."""
+        self.record(path, "file", "done", final=os.path.abspath(final) if final else None)
+        with self._lock:
+            self._done.add(os.path.normcase(os.path.abspath(path)))
+            if final: self._done.add(os.path.normcase(os.path.abspath(final)))
+
+    def is_done(self, path):
+        with self._lock:
+            return os.path.normcase(os.path.abspath(path)) in self._done
+
+    def close(self):
+        """Mark the batch finished."""
+        if self._f.closed: return
+        self._write({"end": True, "ts": time.time()})
+        self._f.close()
+
+
+def _list_journals():
+    directory = _journal_dir()
+    return [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".jsonl")]
+
+
+def _unfinished_steps(records):
+    """Last record per (file, step) whose state is not 'done'."""
+    last = {}
+    for rec in records:
+        if rec.get("step") == "file": continue
+        last[(rec["file"], rec["step"])] = rec
+    return [rec for rec in last.values() if rec.get("state") != "done"]
+
+
+def _recover_step(rec):
+    target = rec["file"]
+    temp, backup = rec.get("temp"), rec.get("backup")
+    has = lambda p: bool(p) and os.path.exists(p)
+    state = rec.get("state")
+
+    if rec["step"] == "rename":
+        if not has(target) and has(rec.get("new")):
+            print(f"  [Recover] Rename had completed: {os.path.basename(rec['new'])}")
+        return
+
+    if rec.get("inplace"):
+        # In-place faststart (mp4_faststart): always rolled forward from the moov sidecar
+        if has(rec["inplace"]) and has(target):
+            from mp4_faststart import resume
+            resume(target, rec["inplace"])
+        return
+
+    if rec.get("tail_offset") is not None:
+        # In-place tag rewrite (mp4_tags): the sidecar holds the complete new tail
+        if has(temp) and has(target):
+            from mp4_tags import finish_copy_back
+            finish_copy_back(temp, target, rec["tail_offset"], rec.get("truncate"))
+            print(f"  [Recover] Finished interrupted tag write for {os.path.basename(target)}")
+        if has(temp): os.remove(temp)
+        return
+
+    if not has(target):
+        if has(backup):
+            shutil.move(backup, target)
+            print(f"  [Recover] Restored original from {os.path.basename(backup)}")
+        elif state == "swap" and has(temp):
+            # Temp file was complete; the original had already been removed
+            shutil.move(temp, target)
+            print(f"  [Recover] Finished interrupted swap for {os.path.basename(target)}")
+            return
+        else:
+            print(f"  [Recover] WARNING: {target} is missing and no backup exists")
+            return
+    elif has(backup) and state == "swap" and not has(temp) and not rec.get("keep_backup"):
+        # Swap completed, only the backup cleanup was lost
+        os.remove(backup)
+        print(f"  [Recover] Removed leftover backup {os.path.basename(backup)}")
+
+    if has(temp):
+        os.remove(temp)
+        print(f"  [Recover] Removed partial temp file {os.path.basename(temp)}")
+
+
+def recover():
+    """Roll back unfinished steps of journals whose process is gone. Call once at startup."""
+    try:
+        journals = _list_journals()
+    except OSError:
+        return
+    finished = []
+    for path in journals:
+        header, records, ended = _read_journal(path)
+        if not header: continue
+        if ended:
+            finished.append(path)
+            continue
+        if _owner_alive(header, records): continue
+        steps = _unfinished_steps(records)
+        if not steps: continue
+        print(f"[Journal] Recovering interrupted batch {header['batch']} ({len(steps)} unfinished step(s))")
+        for rec in steps:
+            try:
+                _recover_step(rec)
+            except OSError as e:
+                print(f"  [Recover] Could not recover {rec['file']}: {e}")
+            # Make the rollback itself durable so it is not replayed
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({**rec, "state": "done", "recovered": True}, ensure_ascii=False) + "\n")
+
+    for path in sorted(finished)[:-KEEP_FINISHED_JOURNALS]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _live_paths():
+    """Files referenced by journals of processes that are still running."""
+    live = set()
+    try:
+        journals = _list_journals()
+    except OSError:
+        return live
+    for path in journals:
+        header, records, ended = _read_journal(path)
+        if not header or ended: continue
+        if _owner_alive(header, records):
+            live.update(os.path.normcase(r["file"]) for r in records if "file" in r)
+    return live
+
+
+def sweep_temp_files(directory):
+    """
+    Clean up temp/backup files left in `directory` by runs that had no journal
+    (or whose journal was lost). Only unambiguous cases are touched:
+    stale temp next to an intact original -> delete; backup without original -> restore.
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    live = None
+    now = time.time()
+    for name in names:
+        path = os.path.join(directory, name)
+        base = None
+        for suffix in TEMP_SUFFIXES:
+            if name.endswith(suffix): base, kind = path[:-len(suffix)], "temp"
+        for suffix in BACKUP_SUFFIXES:
+            if name.endswith(suffix): base, kind = path[:-len(suffix)], "backup"
+        if name.endswith(INPLACE_SIDECAR_SUFFIX): base, kind = path[:-len(INPLACE_SIDECAR_SUFFIX)], "inplace"
+        if not base or not base.lower().endswith((".mp4", ".mkv")): continue
+
+        if live is None: live = _live_paths()
+        if os.path.normcase(base) in live: continue
+        # Being worked on by another machine (distributed mode; its journal is not ours to see)
+        if os.path.exists(work_leases.lease_path(base)): continue
+        try:
+            if kind == "temp" and os.path.exists(base):
+                if now - os.path.getmtime(path) < STALE_TEMP_SECONDS: continue
+                os.remove(path)
+                print(f"  [Cleanup] Removed orphaned temp file: {name}")
+            elif kind == "backup" and not os.path.exists(base):
+                shutil.move(path, base)
+                print(f"  [Cleanup] Restored {os.path.basename(base)} from orphaned backup")
+            elif kind == "inplace" and os.path.exists(base):
+                from mp4_faststart import resume
+                resume(base, path)
+        except (OSError, ValueError) as e:
+            print(f"  [Cleanup] Could not clean {name}: {e}")
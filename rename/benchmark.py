@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the rename pipeline.
+
+Usage:
+    python benchmark.py parse [--count 1000000]
+    python benchmark.py embed [--video-mb 256] [--cover-mb 2]
+    python benchmark.py startup [--budget-ms 150]
+"""
+
+import os
+import sys
+import time
+import random
+import struct
+import argparse
+import tempfile
+import subprocess
+
+import code_parser
+
+if sys.stdout is not None:
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+    except AttributeError:
+        pass
+
+_LABELS = ["ABW", "IPTD", "SSNI", "WANZ", "MIDV", "DV", "STARS", "JUL", "PRED", "ipx"]
+_SUFFIXES = ["", "-C", "-UC", "-U", " 无码-lada", "-C 无码-lada", ".restored", "-cd2",
+             "-00.01.02.003-00.05.06.007", "-cut-merged-1700000000"]
+
+
+def synthetic_filenames(count, seed=0):
+    """Deterministic mix of the filename shapes seen in real downloads."""
+    rng = random.Random(seed)
+    names = []
+    for _ in range(count):
+        kind = rng.random()
+        num = rng.randint(1, 999)
+        suffix = rng.choice(_SUFFIXES)
+        if kind < 0.05:
+            name = f"FC2-PPV-{rng.randint(1000000, 4999999)}{suffix}"
+        elif kind < 0.35:
+            name = f"{rng.choice(_LABELS).lower()}{num:05d}{suffix}"
+        elif kind < 0.50:
+            name = f"uploader{rng.randint(1, 99)}@{rng.choice(_LABELS)}-{num:03d}{suffix}"
+        elif kind < 0.55:
+            name = f"random clip {num}"
+        else:
+            name = f"{rng.choice(_LABELS)}-{num:03d}{suffix}"
+        names.append(name + ".mp4")
+    return names
+
+
+def bench_parse(count):
+    names = synthetic_filenames(count)
+    parse = code_parser.parse_filename
+    start = time.perf_counter()
+    parsed = 0
+    for name in names:
+        if parse(name)[0]: parsed += 1
+    elapsed = time.perf_counter() - start
+    print(f"parse_filename: {count:,} names in {elapsed:.2f}s "
+          f"({count / elapsed:,.0f}/s, {elapsed / count * 1e6:.2f} us/name, {parsed:,} with code)")
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes (None if unknown)."""
+    if os.name == 'nt':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb): return None
+        return counters.PeakWorkingSetSize
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _box(name, payload):
+    return struct.pack('>I4s', 8 + len(payload), name) + payload
+
+
+def write_synthetic_mp4(path, video_bytes, layout="front", chunks=1000):
+    """
+    Minimal MP4 with one track whose stco points at `chunks` markers inside mdat.
+    layout: "front" (moov before mdat) or "end" (moov after mdat).
+    """
+    chunk_size = video_bytes // chunks
+    ftyp = _box(b"ftyp", b"isom" + struct.pack('>I', 512) + b"isommp41")
+    mvhd = _box(b"mvhd", bytes(12) + struct.pack('>II', 1000, 60000) + bytes(80))
+    mdhd = _box(b"mdhd", bytes(12) + struct.pack('>II', 1000, 60000) + bytes(4))
+    hdlr = _box(b"hdlr", bytes(8) + b"vide" + bytes(13))
+
+    def moov_for(mdat_payload_offset):
+        offsets = [mdat_payload_offset + i * chunk_size for i in range(chunks)]
+        stco = _box(b"stco", bytes(4) + struct.pack(f'>I{chunks}I', chunks, *offsets))
+        stbl = _box(b"stbl", stco)
+        minf = _box(b"minf", stbl)
+        trak = _box(b"trak", _box(b"mdia", mdhd + hdlr + minf))
+        return _box(b"moov", mvhd + trak)
+
+    moov_size = len(moov_for(0))
+    mdat_offset = len(ftyp) + (moov_size if layout == "front" else 0)
+    moov = moov_for(mdat_offset + 8)
+    with open(path, 'wb') as f:
+        f.write(ftyp)
+        if layout == "front": f.write(moov)
+        f.write(struct.pack('>I4s', 8 + chunk_size * chunks, b"mdat"))
+        block = bytearray(chunk_size)
+        for i in range(chunks):
+            block[:8] = struct.pack('>Q', i)  # marker checked by verify_synthetic_mp4
+            f.write(block)
+        if layout == "end": f.write(moov)
+
+
+def verify_synthetic_mp4(path):
+    """True if every stco entry still points at its chunk marker."""
+    import mp4_tags
+    from mp4_boxes import iter_boxes
+    with open(path, 'rb') as f:
+        size = f.seek(0, 2)
+        stbl = next(b for b in iter_boxes(f, 0, size) if b[0] == 'moov')
+        for name in ('trak', 'mdia', 'minf', 'stbl', 'stco'):
+            stbl = mp4_tags._child(f, stbl, name)
+        f.seek(stbl[1] + 12)
+        count = struct.unpack('>I', f.read(4))[0]
+        offsets = struct.unpack(f'>{count}I', f.read(4 * count))
+        for i, offset in enumerate(offsets):
+            f.seek(offset)
+            if struct.unpack('>Q', f.read(8))[0] != i: return False
+    return True
+
+
+def _embed_once(engine, video_path, cover_path):
+    """Child process body: one embed, then print peak RSS as JSON-ish fields."""
+    import run_report
+    baseline = peak_rss()
+    start = time.perf_counter()
+    if engine == "stream":
+        import mp4_tags
+        mp4_tags.write_items(video_path, [mp4_tags.cover_item(cover_path)])
+    else:
+        from mutagen.mp4 import MP4, MP4Cover
+        video = MP4(video_path)
+        with open(cover_path, 'rb') as f:
+            video["covr"] = [MP4Cover(f.read(), imageformat=MP4Cover.FORMAT_JPEG)]
+        video.save()
+    elapsed = time.perf_counter() - start
+    print(f"{elapsed:.3f} {baseline or 0} {peak_rss() or 0} {run_report.get('tags.rewritten_bytes')}")
+
+
+def bench_embed(video_mb, cover_mb, engines):
+    """Embed a cover into synthetic videos (both moov layouts), each run in a fresh process."""
+    import run_report
+    work = tempfile.mkdtemp(prefix="javcover-bench-")
+    cover_path = os.path.join(work, "cover.jpg")
+    with open(cover_path, 'wb') as f:
+        f.write(b"\xff\xd8\xff\xe0" + os.urandom(cover_mb * 1024 * 1024))
+    print(f"Synthetic video {video_mb} MB, cover {cover_mb} MB")
+    try:
+        for layout in ("end", "front"):
+            for engine in engines:
+                for attempt in ("first embed", "re-embed"):
+                    video_path = os.path.join(work, f"{layout}-{engine}.mp4")
+                    if attempt == "first embed":
+                        write_synthetic_mp4(video_path, video_mb * 1024 * 1024, layout)
+                    result = subprocess.run([sys.executable, os.path.abspath(__file__), "_embed-child",
+                                             engine, video_path, cover_path],
+                                            capture_output=True, text=True)
+                    if result.returncode != 0:
+                        print(f"  {layout:5} {engine:7} {attempt:11}: failed: "
+                              f"{result.stderr.strip().splitlines()[-1:]}")
+                        break
+                    elapsed, baseline, peak, rewritten = result.stdout.split()[-4:]
+                    ok = "ok" if verify_synthetic_mp4(video_path) else "OFFSETS BROKEN"
+                    print(f"  {layout:5} {engine:7} {attempt:11}: {float(elapsed):6.2f}s  "
+                          f"peak RSS {run_report.format_bytes(int(peak))} "
+                          f"(+{run_report.format_bytes(int(peak) - int(baseline))})  "
+                          f"rewritten {run_report.format_bytes(int(rewritten))}  {ok}")
+    finally:
+        for name in os.listdir(work): os.remove(os.path.join(work, name))
+        os.rmdir(work)
+
+
+# Entry-point modules and the dependencies they must not import at load time
+STARTUP_MODULES = ("rename_movies", "manual_fix", "rename_plan", "watch_folder", "worker_service")
+LAZY_DEPENDENCIES = ("requests", "cloudscraper", "PIL", "mutagen", "webview")
+STARTUP_BUDGET_MS = 150
+
+
+def import_profile(module):
+    """[(name, self_us, cumulative_us)] from `python -X importtime -c "import <module>"`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"): continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            rows.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+        except (IndexError, ValueError):
+            continue  # column header
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return rows
+
+
+def bench_startup(budget_ms):
+    """Import cost of each entry point (warm .pyc). Returns False if one is over budget or imports a lazy dependency."""
+    ok = True
+    for module in STARTUP_MODULES:
+        import_profile(module)  # warm the .pyc cache
+        try:
+            rows = import_profile(module)
+        except RuntimeError as e:
+            print(f"  {module:14} failed: {e}")
+            ok = False
+            continue
+        total_ms = next(cum for name, _, cum in rows if name == module) / 1000
+        eager = sorted({name.split('.')[0] for name, _, _ in rows} & set(LAZY_DEPENDENCIES))
+        heaviest = sorted(rows, key=lambda row: row[1], reverse=True)[:3]
+        status = "EAGER IMPORTS" if eager else "OVER BUDGET" if total_ms > budget_ms else "ok"
+        print(f"  {module:14} {total_ms:7.1f} ms  [{status}]  heaviest: "
+              + ", ".join(f"{name} {self_us / 1000:.1f}ms" for name, self_us, _ in heaviest)
+              + (f"  eager: {', '.join(eager)}" if eager else ""))
+        ok = ok and status == "ok"
+    return ok
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "_embed-child":
+        _embed_once(*sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description="Rename pipeline micro-benchmarks.")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p_parse = sub.add_parser("parse", help="Throughput of code_parser.parse_filename")
+    p_parse.add_argument("--count", type=int, default=1_000_000)
+    p_embed = sub.add_parser("embed", help="Time and peak RSS of cover embedding (streaming vs mutagen)")
+    p_embed.add_argument("--video-mb", type=int, default=256)
+    p_embed.add_argument("--cover-mb", type=int, default=2)
+    p_embed.add_argument("--engine", choices=["stream", "mutagen"], action="append",
+                         help="Engines to compare (default: both)")
+    p_startup = sub.add_parser("startup", help="Import time of the entry points (python -X importtime)")
+    p_startup.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    args = parser.parse_args()
+
+    if args.bench == "parse":
+        bench_parse(args.count)
+    elif args.bench == "embed":
+        bench_embed(args.video_mb, args.cover_mb, args.engine or ["stream", "mutagen"])
+    elif args.bench == "startup":
+        print(f"Startup import time (budget {args.budget_ms:.0f} ms per entry point):")
+        if not bench_startup(args.budget_ms): sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
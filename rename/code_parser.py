@@ -0,0 +1,101 @@
+"""
+Filename -> (code, suffix, is_fc2) parsing shared by every entry point.
+
+All patterns are compiled once at import. Prefix padding and suffix
+detection are table-driven: add a row to PAD_RULES / SUFFIX_RULES instead
+of another elif.
+
+    >>> parse_filename("abc@iptd00764-C.mp4")
+    ('IPTD-764', '-C', False)
+    >>> parse_filename("FC2-PPV-3482842.mp4")
+    ('FC2-PPV-3482842', '', True)
+"""
+
+import os
+import re
+
+# Uploader prefix: "user@ABW-009.mp4"
+_UPLOADER_RE = re.compile(r'^[^@]+@')
+# FC2 / FC2PPV / FC2-PPV / FC2_PPV followed by the numeric id
+_FC2_RE = re.compile(r'FC2[-_ ]?(?:PPV[-_ ]?)?(\d+)', re.IGNORECASE)
+# ABW-009 (hyphenated: digits kept as written)
+_HYPHEN_RE = re.compile(r'^([A-Z]+)-(\d+)', re.IGNORECASE)
+# iptd00764 / WANZ00684 (no hyphen: zero padding normalized via PAD_RULES)
+_COMPACT_RE = re.compile(r'^([A-Z]+)(\d+)', re.IGNORECASE)
+
+# Noise removed from the remainder before suffix detection
+_RESTORED_RE = re.compile(r'\.?RESTOR(ED?)?($|[^A-Z])', re.IGNORECASE)
+_STRIP_RES = (
+    re.compile(r'-\d{2}\.\d{2}\.\d{2}\.\d{3}-\d{2}\.\d{2}\.\d{2}\.\d{3}'),  # LosslessCut segment timestamps
+    re.compile(r'-cut-merged-\d+'),                                      # LosslessCut merge output
+    re.compile(r'\.restored.*', re.IGNORECASE),                          # restoration tool output
+)
+_GENERIC_SUFFIX_RE = re.compile(r'(-[0-9A-Z]+)$', re.IGNORECASE)
+
+# Digits for compact codes, by label. Anything not listed uses DEFAULT_PAD.
+DEFAULT_PAD = 3
+PAD_RULES = {
+    "DV": 4,
+}
+
+# Evaluated in order against the upper-cased remainder; first match wins.
+# (test, needle, suffix)
+SUFFIX_RULES = (
+    ("restored", None, " 无码-lada"),       # .restored output without an explicit 无码 tag
+    ("contains", "无码-LADA-C", " 无码-lada-C"),
+    ("contains", "-C 无码-LADA", "-C 无码-lada"),
+    ("contains", "-C无码-LADA", "-C 无码-lada"),
+    ("contains", "无码-LADA", " 无码-lada"),
+    ("endswith", "-UC", " 无码-lada-C"),
+    ("endswith", "-U", " 无码-lada"),
+    ("endswith", "-C", "-C"),
+)
+
+
+def clean_name(filename):
+    """Strip the "uploader@" prefix."""
+    return _UPLOADER_RE.sub('', filename, count=1)
+
+
+def detect_suffix(rest):
+    """Map the part of the name after the code to the canonical suffix."""
+    if not rest: return ""
+    has_restored = _RESTORED_RE.search(rest) is not None
+    for pattern in _STRIP_RES:
+        rest = pattern.sub('', rest)
+    rest_upper = rest.upper()
+
+    for test, needle, suffix in SUFFIX_RULES:
+        if test == "restored":
+            if has_restored and "无码" not in rest_upper: return suffix
+        elif test == "contains":
+            if needle in rest_upper: return suffix
+        elif rest_upper.endswith(needle):
+            return suffix
+
+    match = _GENERIC_SUFFIX_RE.search(rest)
+    return match.group(1).upper() if match else ""
+
+
+def parse_filename(name):
+    """
+    Returns (code, suffix, is_fc2); code is None when no code can be found.
+    Codes are canonical: "ABW-009", "IPTD-764", "DV-0123", "FC2-PPV-3482842".
+    """
+    cleaned = clean_name(name)
+    stem = os.path.splitext(cleaned)[0]
+
+    match = _FC2_RE.search(stem)
+    if match:
+        return f"FC2-PPV-{match.group(1)}", detect_suffix(stem[match.end():]), True
+
+    match = _HYPHEN_RE.match(stem)
+    if match:
+        code = f"{match.group(1).upper()}-{match.group(2)}"
+    else:
+        match = _COMPACT_RE.match(stem)
+        if not match: return None, "", False
+        prefix = match.group(1).upper()
+        code = f"{prefix}-{int(match.group(2)):0{PAD_RULES.get(prefix, DEFAULT_PAD)}d}"
+
+    return code, detect_suffix(stem[match.end():]), False
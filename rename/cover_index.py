@@ -0,0 +1,149 @@
+"""
+Cover folder index.
+
+The cover folder can hold tens of thousands of JPEGs named "<CODE> <title>.jpg".
+Instead of listing it for every lookup, it is listed once per run and indexed:
+  - exact:  normalized code at the start of the filename -> filenames
+  - fuzzy:  normalized code appearing anywhere in the filename -> filenames
+  - trie:   label prefix (e.g. "IPT") -> filenames, for "related covers" hints
+
+The filename list is persisted to `.cover_index.json` inside the cover folder
+and reused as long as the folder's mtime is unchanged (adding/removing a
+cover changes the directory mtime, editing the index file does not).
+"""
+
+import os
+import re
+import json
+import threading
+
+INDEX_FILENAME = ".cover_index.json"
+INDEX_VERSION = 1
+
+# FC2 / FC2PPV / FC2-PPV all map to FC2-<num>; other codes to LABEL-<num without padding>
+_CODE_RE = re.compile(r'(FC2[-_]?(?:PPV)?|[A-Z]+)[-_]?0*(\d+)')
+
+
+def normalize_code(code):
+    """Normalize a code or filename prefix: 'abw-009' -> 'ABW-9', 'FC2-PPV-123' -> 'FC2-123'."""
+    match = _CODE_RE.match(code.upper())
+    if not match: return None
+    return _key(match)
+
+
+def _key(match):
+    label = match.group(1)
+    if label.startswith("FC2"): label = "FC2"
+    return f"{label}-{match.group(2) or '0'}"
+
+
+class CoverIndex:
+    def __init__(self, cover_dir):
+        self.cover_dir = cover_dir
+        self._lock = threading.Lock()
+        self._exact = {}
+        self._fuzzy = {}
+        self._trie = {}
+        self._names = []
+        self._load()
+
+    # --- Build / persist ---
+    def _index_path(self):
+        return os.path.join(self.cover_dir, INDEX_FILENAME)
+
+    def _dir_mtime(self):
+        try:
+            return os.stat(self.cover_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        mtime = self._dir_mtime()
+        if mtime is None: return
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION and data.get("mtime") == mtime:
+                for name in data["files"]: self._add(name)
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+        self.rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            self._exact, self._fuzzy, self._trie, self._names = {}, {}, {}, []
+            try:
+                with os.scandir(self.cover_dir) as it:
+                    names = sorted(e.name for e in it if e.name.lower().endswith('.jpg'))
+            except OSError:
+                return
+            for name in names: self._add(name)
+            self._save()
+
+    def _save(self):
+        path = self._index_path()
+        try:
+            # Create the file first: creating it bumps the folder mtime, rewriting it later does not
+            if not os.path.exists(path): open(path, 'w').close()
+            payload = {"version": INDEX_VERSION, "mtime": self._dir_mtime(), "files": self._names}
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+        except OSError:
+            pass
+
+    def _add(self, name):
+        self._names.append(name)
+        upper = name.upper()
+        match = _CODE_RE.match(upper)
+        if match:
+            self._exact.setdefault(_key(match), []).append(name)
+            node = self._trie
+            for ch in match.group(1):
+                node = node.setdefault(ch, {})
+            node.setdefault("$", []).append(name)
+        for match in _CODE_RE.finditer(upper):
+            self._fuzzy.setdefault(_key(match), []).append(name)
+
+    def add(self, name):
+        """Register a cover just written to the folder and persist the index."""
+        with self._lock:
+            if name in self._exact.get(normalize_code(name), ()): return
+            self._add(name)
+            self._save()
+
+    # --- Lookups ---
+    def find(self, code):
+        """Path of the best cover for `code` (exact prefix match first, then fuzzy), or None."""
+        key = normalize_code(code)
+        if not key: return None
+        names = self._exact.get(key) or self._fuzzy.get(key)
+        if not names: return None
+        return os.path.join(self.cover_dir, names[0])
+
+    def related(self, prefix, limit=5):
+        """Up to `limit` cover filenames whose label starts with `prefix`."""
+        node = self._trie
+        for ch in prefix.upper():
+            node = node.get(ch)
+            if node is None: return []
+        result, stack = [], [node]
+        while stack and len(result) < limit:
+            node = stack.pop()
+            result.extend(node.get("$", ()))
+            stack.extend(child for ch, child in sorted(node.items(), reverse=True) if ch != "$")
+        return result[:limit]
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_cover_index(cover_dir):
+    """Shared per-folder index, built (or loaded from disk) on first use in this process."""
+    key = os.path.abspath(cover_dir)
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(key)
+        if index is None:
+            index = _INDEXES[key] = CoverIndex(key)
+        return index
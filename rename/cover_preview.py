@@ -0,0 +1,97 @@
+"""
+Small previews of saved covers for the GUI.
+
+The GUI panel is 200x284 CSS px, but the saved covers are full-size quality-95
+JPEGs. Handing the WebView the file itself means a full decode for every file
+of a batch; instead the cover stage keeps a PREVIEW_SIZE JPEG in memory (made
+from the image it already has decoded) and the GUI shows it as a data URL.
+
+    remember(save_path, cropped_img)    # cover stage, image already decoded
+    data_url(cover_path)                # GUI: cached, or made from the file on demand
+
+Pillow is imported on first use; without it small covers are sent as they are
+and larger ones get no preview.
+"""
+
+import os
+import io
+import base64
+import threading
+from collections import OrderedDict
+
+# 2x the GUI cover panel, so the preview stays sharp on HiDPI screens
+PREVIEW_SIZE = (400, 568)
+PREVIEW_QUALITY = 80
+MAX_CACHED = 64
+# Without Pillow, covers up to this size are sent unscaled
+RAW_LIMIT = 512 * 1024
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return os.path.normcase(os.path.abspath(path)), st.st_size, st.st_mtime
+
+
+def _store(key, data):
+    with _lock:
+        _cache[key] = data
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED:
+            _cache.popitem(last=False)
+
+
+def _encode(img):
+    thumb = img.copy() if img.mode == "RGB" else img.convert("RGB")
+    thumb.thumbnail(PREVIEW_SIZE)
+    buf = io.BytesIO()
+    thumb.save(buf, format="JPEG", quality=PREVIEW_QUALITY)
+    return buf.getvalue()
+
+
+def remember(path, img):
+    """Store the preview of the cover just saved at `path`, from its decoded PIL image."""
+    key = _key(path)
+    if key is None: return
+    try:
+        _store(key, _encode(img))
+    except Exception as e:
+        print(f"    [Cover] Preview failed: {e}")
+
+
+def preview_bytes(path):
+    """JPEG bytes of the preview of `path` (None if there is none)."""
+    key = _key(path)
+    if key is None: return None
+    with _lock:
+        data = _cache.get(key)
+    if data is not None: return data
+
+    try:
+        from PIL import Image
+    except ImportError:
+        if key[1] > RAW_LIMIT: return None
+        with open(path, 'rb') as f:
+            data = f.read()
+    else:
+        try:
+            with Image.open(path) as img:
+                # JPEG: let the decoder scale down by 1/2..1/8 instead of decoding full size
+                img.draft("RGB", PREVIEW_SIZE)
+                data = _encode(img)
+        except Exception:
+            return None
+    _store(key, data)
+    return data
+
+
+def data_url(path):
+    data = preview_bytes(path)
+    if data is None: return None
+    mime = "image/png" if data[:8] == b"\x89PNG\r\n\x1a\n" else "image/jpeg"
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
@@ -1,110 +1,266 @@
 #!/usr/bin/env python
 """
-Simple faststart script - uses FFmpeg to move moov atom to beginning.
+Simple faststart script - moves the moov atom to the beginning.
+Files are rewritten in place when their layout allows it (see mp4_faststart:
+no second copy of the video needed); otherwise, or with --ffmpeg, FFmpeg
+writes a new copy that is swapped in.
 Usage:
     python faststart.py "filename.mp4"
+    python faststart.py "a.mp4" "D:\\Videos\\*.mp4" "E:\\More"   # Many files/globs/folders
     python faststart.py                 # Process all MP4 in parent dir
+
+Files on different physical volumes are processed in parallel; files on the
+same volume run --jobs-per-volume at a time (default 1) so a HDD/NAS is not
+thrashed by several concurrent remuxes.
 """
 
 import os
 import sys
-import subprocess
+import glob
+import argparse
 import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-sys.stdout.reconfigure(encoding='utf-8')
-sys.stderr.reconfigure(encoding='utf-8')
+from mp4_boxes import is_faststart
+from mp4_tags import UnsupportedLayout
+import mp4_faststart
+import mp4_verify
+import run_report
+import batch_journal
+import io_scheduler
+import job_control
+import work_leases
+import metrics
+from io_scheduler import io_slot, temp_path_for
 
-def faststart(video_path):
-    """Run FFmpeg faststart on a single file."""
+@metrics.timed("faststart")
+def faststart(video_path, journal=None, in_place=True):
+    """Run faststart on a single file (in place if possible, else FFmpeg)."""
     print(f"\nProcessing: {os.path.basename(video_path)}")
     
     if not os.path.exists(video_path):
         print(f"  [Error] File not found")
         return False
     
-    temp_path = video_path + ".temp.mp4"
+    file_size = os.path.getsize(video_path)
+    if is_faststart(video_path):
+        print(f"  [Skip] moov already before mdat")
+        run_report.add("faststart.skipped")
+        run_report.add("faststart.avoided_bytes", file_size)
+        return True
+    
+    journal = journal or batch_journal.NULL
+    if in_place:
+        try:
+            mp4_faststart.faststart_inplace(video_path, journal=journal)
+            print(f"  [Success] Done (in place)!")
+            journal.file_done(video_path)
+            return True
+        except UnsupportedLayout as e:
+            print(f"  [In-place] Not possible ({e}), using FFmpeg")
+        except OSError as e:
+            print(f"  [Error] {e}")
+            return False
+
+    temp_path = temp_path_for(video_path, ".temp.mp4")
+    journal.record(video_path, "faststart", "intent", temp=temp_path)
     
-    try:
-        # Run FFmpeg
-        print(f"  [FFmpeg] Running faststart...")
-        result = subprocess.run(
-            [
-                "ffmpeg", "-y", "-hide_banner", "-loglevel", "warning",
-                "-i", video_path,
-                "-c", "copy",
-                "-movflags", "+faststart",
-                temp_path
-            ],
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            errors='replace'
-        )
+    # One heavy rewrite per volume at a time (see io_scheduler)
+    with io_slot(video_path):
+        try:
+            # Run FFmpeg
+            print(f"  [FFmpeg] Running faststart...")
+            result = job_control.run_process(
+                [
+                    "ffmpeg", "-y", "-hide_banner", "-loglevel", "warning",
+                    "-i", video_path,
+                    "-c", "copy",
+                    "-movflags", "+faststart",
+                    temp_path
+                ],
+                text=True,
+                encoding='utf-8',
+                errors='replace'
+            )
         
-        if result.stderr:
-            print(f"  [FFmpeg] {result.stderr.strip()}")
+            if result.stderr:
+                print(f"  [FFmpeg] {result.stderr.strip()}")
         
-        if result.returncode != 0:
-            print(f"  [Error] FFmpeg failed")
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            return False
+            if result.returncode != 0:
+                print(f"  [Error] FFmpeg failed")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                journal.record(video_path, "faststart", "failed", temp=temp_path)
+                return False
         
-        # Check temp file
-        if not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
-            print(f"  [Error] Temp file empty or missing")
-            return False
+            # Check temp file
+            if not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
+                print(f"  [Error] Temp file empty or missing")
+                journal.record(video_path, "faststart", "failed", temp=temp_path)
+                return False
+            problems = mp4_verify.verify(temp_path, source=video_path)
+            if problems:
+                print(f"  [Error] Output failed verification: {'; '.join(problems)}")
+                os.remove(temp_path)
+                journal.record(video_path, "faststart", "failed", temp=temp_path)
+                return False
         
-        # Replace original with temp
-        print(f"  [Replace] Swapping files...")
-        time.sleep(1)  # Let Windows release any handles
+            # Replace original with temp
+            print(f"  [Replace] Swapping files...")
+            journal.record(video_path, "faststart", "swap", temp=temp_path)
+            time.sleep(1)  # Let Windows release any handles
         
-        # Try multiple times in case of file lock
-        for attempt in range(5):
-            try:
-                os.remove(video_path)
-                shutil.move(temp_path, video_path)
-                print(f"  [Success] Done!")
-                return True
-            except PermissionError:
-                print(f"  [Wait] File locked, retrying in {(attempt+1)*2}s...")
-                time.sleep((attempt+1) * 2)
+            # Try multiple times in case of file lock
+            for attempt in range(5):
+                try:
+                    os.remove(video_path)
+                    shutil.move(temp_path, video_path)
+                    print(f"  [Success] Done!")
+                    run_report.add("faststart.rewritten")
+                    run_report.add("faststart.rewritten_bytes", file_size)
+                    journal.record(video_path, "faststart", "done")
+                    journal.file_done(video_path)
+                    return True
+                except PermissionError:
+                    print(f"  [Wait] File locked, retrying in {(attempt+1)*2}s...")
+                    time.sleep((attempt+1) * 2)
         
-        print(f"  [Error] Could not replace file (locked)")
-        print(f"  [Info] Temp file saved as: {temp_path}")
-        return False
+            print(f"  [Error] Could not replace file (locked)")
+            print(f"  [Info] Temp file saved as: {temp_path}")
+            journal.record(video_path, "faststart", "failed", temp=temp_path)
+            return False
         
-    except FileNotFoundError:
-        print("  [Error] FFmpeg not found! Install FFmpeg first.")
-        return False
-    except Exception as e:
-        print(f"  [Error] {e}")
-        if os.path.exists(temp_path):
-            try:
+        except job_control.Cancelled:
+            if os.path.exists(temp_path):
                 os.remove(temp_path)
-            except:
-                pass
-        return False
+            journal.record(video_path, "faststart", "failed", temp=temp_path)
+            print(f"  [Cancelled]")
+            raise
+        except FileNotFoundError:
+            print("  [Error] FFmpeg not found! Install FFmpeg first.")
+            journal.record(video_path, "faststart", "failed", temp=temp_path)
+            return False
+        except Exception as e:
+            print(f"  [Error] {e}")
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except:
+                    pass
+            journal.record(video_path, "faststart", "failed", temp=temp_path)
+            return False
+
+
+def run_per_volume(paths, func, jobs_per_volume=1, max_workers=None):
+    """
+    Run func(path) for every path through a thread pool.
+    The heavy part of each job takes an io_scheduler slot, so at most
+    `jobs_per_volume` rewrites run concurrently on the same volume while
+    different volumes (and the light parts of each job) run in parallel.
+    Returns {path: result}; exceptions are reported and stored as False.
+    """
+    io_scheduler.configure(default_limit=jobs_per_volume)
+    if max_workers is None:
+        volumes = {io_scheduler.volume_id(p) for p in paths}
+        # A few extra threads so cover lookups etc. overlap with running rewrites
+        max_workers = max(1, len(volumes) * max(1, jobs_per_volume) * 2)
+
+    def job(path):
+        try:
+            return func(path)
+        except Exception as e:
+            print(f"  [Error] {os.path.basename(path)}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(job, paths))
+    return dict(zip(paths, results))
+
+
+def expand_paths(args, base_dir=None, extensions=(".mp4",)):
+    """
+    Expand CLI arguments (files, globs, folders) into a de-duplicated list of video paths.
+    Relative paths that don't exist are also tried relative to `base_dir`.
+    """
+    found = []
+    for arg in args:
+        candidates = [arg]
+        if base_dir and not os.path.isabs(arg) and not glob.glob(arg):
+            candidates.append(os.path.join(base_dir, arg))
+        for candidate in candidates:
+            matches = glob.glob(candidate) if glob.has_magic(candidate) else [candidate]
+            if not matches: continue
+            for match in sorted(matches):
+                if os.path.isdir(match):
+                    found.extend(os.path.join(match, f) for f in sorted(os.listdir(match))
+                                 if f.lower().endswith(extensions))
+                else:
+                    found.append(match)
+            break
+        else:
+            print(f"  [Error] Not found: {arg}")
+    seen = set()
+    return [p for p in (os.path.abspath(f) for f in found) if not (p in seen or seen.add(p))]
 
 
 def main():
-    if len(sys.argv) > 1:
-        # Process specific file
-        target = sys.argv[1]
-        if not os.path.isabs(target):
-            # Check in parent directory first
-            parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            target = os.path.join(parent_dir, target)
-        faststart(target)
+    # Only when run as a script: importers (GUI, worker service) may have no or a replaced stdout
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description="Move the MP4 moov atom to the front (in place, or FFmpeg faststart).")
+    parser.add_argument("paths", nargs="*", help="Files, globs or folders (default: all MP4 in parent dir)")
+    parser.add_argument("--jobs-per-volume", type=int, default=1, help="Concurrent FFmpeg jobs per physical volume")
+    parser.add_argument("--max-jobs", type=int, help="Overall concurrent job limit")
+    parser.add_argument("--resume", action="store_true", help="Continue the last interrupted batch, skipping finished files")
+    parser.add_argument("--ffmpeg", action="store_true", help="Always remux with FFmpeg instead of moving moov in place")
+    parser.add_argument("--distributed", action="store_true", help="Skip files another worker (machine/process) is rewriting (lease files)")
+    args = parser.parse_args()
+    metrics.start()
+
+    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if args.paths:
+        # Relative paths: check in parent directory too
+        files = expand_paths(args.paths, base_dir=parent_dir)
     else:
         # Process all MP4 in parent directory
-        parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         print(f"Scanning: {parent_dir}")
-        
-        for filename in sorted(os.listdir(parent_dir)):
-            if filename.lower().endswith(".mp4"):
-                faststart(os.path.join(parent_dir, filename))
+        files = expand_paths([parent_dir])
+
+    batch_journal.recover()
+    journal = batch_journal.BatchJournal.open("faststart", resume=args.resume, files=files)
+    files = [f for f in files if not journal.is_done(f)]
+    if not files:
+        print("No MP4 files to process.")
+        journal.close()
+        return
+
+    start = time.time()
+    leases = work_leases.LeaseManager() if args.distributed else None
+    busy = []
+
+    def job(path):
+        if leases is None: return faststart(path, journal=journal, in_place=not args.ffmpeg)
+        if not leases.claim(path):
+            print(f"\n[Lease] Held by another worker, skipped: {os.path.basename(path)}")
+            busy.append(path)
+            return True
+        try:
+            return faststart(path, journal=journal, in_place=not args.ffmpeg)
+        finally:
+            leases.release(path)
+
+    results = run_per_volume(files, job, jobs_per_volume=args.jobs_per_volume, max_workers=args.max_jobs)
+    journal.close()
+    if leases: leases.close()
+    failed = [p for p, ok in results.items() if not ok]
+    if busy: print(f"\n{len(busy)} file(s) were being processed by other workers.")
+
+    print(f"\n{'=' * 50}")
+    print(f"Summary: {len(files) - len(failed) - len(busy)} succeeded, {len(failed)} failed, {time.time() - start:.1f}s")
+    for path in failed:
+        print(f"  [Failed] {path}")
+    run_report.print_summary()
 
 
 if __name__ == "__main__":
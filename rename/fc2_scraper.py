@@ -3,6 +3,8 @@ import re
 import logging
 import json
 
+import http_client
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,7 +38,8 @@ def get_fc2_metadata(fc2_id):
             'age_check_done': '1'
         }
         
-        resp = requests.get(url, headers=headers, cookies=cookies, timeout=15)
+        # Adaptive timeout + hedging for stalled connections (see http_client)
+        resp = http_client.get(requests, url, headers=headers, cookies=cookies, timeout=15)
         html_content = resp.text
         
         # Check for region block / login redirect
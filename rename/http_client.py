@@ -0,0 +1,166 @@
+"""
+GET requests with per-host latency statistics, hedging and adaptive timeouts.
+
+Fixed timeouts (30 s for pages, 15 s for covers) let one stalled connection
+hold up a serial batch for the whole timeout. Here every host keeps a window
+of recent latencies (time until the response headers arrive):
+
+  * hedging: if a request is still waiting after the host's p95, an identical
+    request is sent and whichever answers first is used (the other is closed);
+  * adaptive timeouts: once a host has enough samples, its connect/read
+    timeouts are derived from the same p95 (capped by the caller's timeout).
+
+    resp = http_client.get(scraper, url, timeout=30)             # any requests-like session
+    resp = http_client.get(requests, url, timeout=15, stream=True)
+
+The run report gets http.requests / http.hedged / http.hedge_won /
+http.timeouts counters and, per host, the current p95 and read timeout.
+Every attempt (hedges included) is also recorded in metrics, per host:
+latency histogram, status codes, timeouts/errors and Cloudflare challenges.
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
+
+import run_report
+import metrics
+
+# Latency samples kept per host
+WINDOW = 200
+# Samples needed before p95-based hedging/timeouts kick in
+MIN_SAMPLES = 8
+# Never hedge earlier than this (seconds)
+MIN_HEDGE_DELAY = 0.5
+# Adaptive timeouts: multiples of the host's p95, clamped (seconds)
+CONNECT_FACTOR, MIN_CONNECT, MAX_CONNECT = 2, 3.0, 10.0
+READ_FACTOR, MIN_READ = 4, 5.0
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="http")
+
+
+class HostStats:
+    def __init__(self):
+        self._samples = deque(maxlen=WINDOW)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self):
+        """p95 latency in seconds, None until MIN_SAMPLES requests have been seen."""
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES: return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def timeouts(self, cap):
+        """(connect, read) timeout for a request whose caller allows at most `cap` seconds."""
+        p95 = self.p95()
+        if p95 is None: return min(MAX_CONNECT, cap), cap
+        connect = min(MAX_CONNECT, max(MIN_CONNECT, p95 * CONNECT_FACTOR), cap)
+        read = min(cap, max(MIN_READ, p95 * READ_FACTOR))
+        return connect, read
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+
+def host_stats(host):
+    with _hosts_lock:
+        stats = _hosts.get(host)
+        if stats is None: stats = _hosts[host] = HostStats()
+        return stats
+
+
+def _is_timeout(error):
+    return "timeout" in type(error).__name__.lower() or "timed out" in str(error).lower()
+
+
+def _is_cloudflare(resp=None, error=None):
+    """A Cloudflare challenge/block: cloudscraper's Cloudflare* errors or a 403/429/503 served by Cloudflare."""
+    if error is not None: return "cloudflare" in type(error).__name__.lower()
+    headers = getattr(resp, "headers", None) or {}
+    return resp.status_code in (403, 429, 503) and \
+        (headers.get("Server", "").lower() == "cloudflare" or "cf-mitigated" in headers)
+
+
+def _close_later(future):
+    """Close the response of a request that lost the race once it arrives."""
+    def close(f):
+        try:
+            f.result().close()
+        except Exception:
+            pass
+    future.add_done_callback(close)
+
+
+def get(session, url, timeout=30, **kwargs):
+    """
+    session.get(url, **kwargs) with an adaptive (connect, read) timeout no longer than
+    `timeout`, hedged with a duplicate request after the host's p95 latency.
+    """
+    host = urlsplit(url).hostname or ""
+    stats = host_stats(host)
+    connect, read = stats.timeouts(timeout)
+    p95 = stats.p95()
+    run_report.add("http.requests")
+
+    def attempt():
+        start = time.monotonic()
+        try:
+            resp = session.get(url, timeout=(connect, read), **kwargs)
+        except Exception as e:
+            # A timeout is a (censored) latency sample too: it pushes the p95 up
+            if _is_timeout(e):
+                stats.add(time.monotonic() - start)
+                run_report.add("http.timeouts")
+                metrics.inc("http_errors_total", host=host, kind="timeout")
+            elif _is_cloudflare(error=e):
+                metrics.inc("http_errors_total", host=host, kind="cloudflare")
+                metrics.inc("cloudflare_challenges_total", host=host)
+            else:
+                metrics.inc("http_errors_total", host=host, kind="error")
+            raise
+        elapsed = time.monotonic() - start
+        stats.add(elapsed)
+        metrics.observe("http_request_seconds", elapsed, host=host)
+        metrics.inc("http_responses_total", host=host, status=resp.status_code)
+        if _is_cloudflare(resp): metrics.inc("cloudflare_challenges_total", host=host)
+        return resp
+
+    primary = _executor.submit(attempt)
+    pending = {primary}
+    if p95 is not None:
+        done, _ = wait(pending, timeout=max(MIN_HEDGE_DELAY, p95))
+        if not done:
+            print(f"  [HTTP] {host} slower than its p95 ({p95:.1f}s), sending a hedged request...")
+            run_report.add("http.hedged")
+            pending.add(_executor.submit(attempt))
+
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                resp = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if future is not primary: run_report.add("http.hedge_won")
+            for other in (done | pending) - {future}: _close_later(other)
+            _report(host, stats)
+            return resp
+    _report(host, stats)
+    raise error
+
+
+def _report(host, stats):
+    p95 = stats.p95()
+    if p95 is None: return
+    run_report.set(f"http.{host}.p95_ms", round(p95 * 1000))
+    run_report.set(f"http.{host}.read_timeout_ms", round(stats.timeouts(float('inf'))[1] * 1000))
@@ -0,0 +1,103 @@
+"""
+Disk-aware scheduling of heavy file operations.
+
+ffmpeg remuxes, repairs and mutagen saves read and rewrite whole videos.
+Running several of them on the same HDD/NAS volume makes them all slower,
+so each physical volume (st_dev) gets its own concurrency limit, while work
+on different volumes and all network/CPU stages run freely in parallel.
+
+    with io_slot(video_path):
+        subprocess.run(["ffmpeg", ...])
+
+Slots are re-entrant per thread: a job that already holds the slot for a
+volume can call other helpers that ask for the same slot without deadlocking.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+DEFAULT_LIMIT = 1
+
+
+def volume_id(path):
+    """Device id of the volume holding `path` (or its nearest existing parent)."""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path: return None
+            path = parent
+
+
+def temp_path_for(path, suffix):
+    """
+    Temp file for rewriting `path`: always next to it, i.e. on the same volume,
+    so the final swap is an atomic rename instead of a cross-device copy.
+    """
+    return path + suffix
+
+
+class DiskScheduler:
+    def __init__(self, default_limit=DEFAULT_LIMIT):
+        self.default_limit = default_limit
+        self._limits = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self._held = threading.local()
+
+    def set_limit(self, path_or_dev, limit):
+        """Allow `limit` concurrent heavy jobs on the volume of `path_or_dev` (e.g. 4 for an SSD)."""
+        dev = path_or_dev if isinstance(path_or_dev, int) else volume_id(path_or_dev)
+        with self._lock:
+            self._limits[dev] = max(1, limit)
+            self._semaphores.pop(dev, None)
+
+    def _semaphore(self, dev):
+        with self._lock:
+            sem = self._semaphores.get(dev)
+            if sem is None:
+                sem = self._semaphores[dev] = threading.BoundedSemaphore(self._limits.get(dev, self.default_limit))
+            return sem
+
+    @contextmanager
+    def slot(self, path):
+        dev = volume_id(path)
+        held = getattr(self._held, "counts", None)
+        if held is None: held = self._held.counts = {}
+        if held.get(dev):
+            held[dev] += 1
+            try:
+                yield
+            finally:
+                held[dev] -= 1
+            return
+        sem = self._semaphore(dev)
+        sem.acquire()
+        held[dev] = 1
+        try:
+            yield
+        finally:
+            held[dev] = 0
+            sem.release()
+
+
+SCHEDULER = DiskScheduler()
+
+
+def io_slot(path):
+    """Context manager: hold the shared scheduler's slot for the volume of `path`."""
+    return SCHEDULER.slot(path)
+
+
+def configure(default_limit=None, limits=None):
+    """Set the per-volume limits of the shared scheduler. limits: {path_or_dev: n}."""
+    if default_limit is not None:
+        SCHEDULER.default_limit = max(1, default_limit)
+        with SCHEDULER._lock:
+            SCHEDULER._semaphores = {dev: sem for dev, sem in SCHEDULER._semaphores.items()
+                                     if dev in SCHEDULER._limits}
+    for key, limit in (limits or {}).items():
+        SCHEDULER.set_limit(key, limit)
@@ -0,0 +1,185 @@
+"""
+Cooperative cancel / pause for running jobs.
+
+A JobControl is passed to process_directory / manual_fix.process_file
+(control=...) and made the thread's current control. The pipeline calls
+checkpoint() between stages: it blocks while the job is paused and raises
+Cancelled once the job is cancelled.
+
+Long waits inside a stage are cut short as well, so a cancel takes effect
+within a fraction of a second instead of after the current file:
+  * ffmpeg runs through run_process(): the process is killed on cancel
+  * network lookups run through call(): the wait is abandoned on cancel
+  * cover downloads and tag rewrites check check_cancelled() per chunk
+
+The interrupted stage rolls itself back (temp files removed, journal step
+marked failed, the original video untouched) and the file is not marked done,
+so --resume or the next job does it again. Steps that already finished
+(e.g. a completed rename) are kept.
+
+    control = JobControl()
+    threading.Thread(target=process_directory, args=(folder,), kwargs={"control": control}).start()
+    control.pause(); control.resume(); control.cancel()
+"""
+
+import threading
+import subprocess
+from contextlib import contextmanager
+
+# How often blocked waits look at the cancel flag (seconds)
+POLL_INTERVAL = 0.2
+
+
+class Cancelled(BaseException):
+    """
+    Raised at a checkpoint of a cancelled job. Derived from BaseException (like
+    KeyboardInterrupt) so the pipeline's broad `except Exception` handlers let it through.
+    """
+
+
+class JobControl:
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def cancel(self):
+        """Stop at the next checkpoint; running ffmpeg processes are killed now."""
+        self._cancelled.set()
+        self._running.set()
+        with self._lock:
+            processes = list(self._processes)
+        for proc in processes: _kill(proc)
+
+    def pause(self):
+        """Hold the job at its next checkpoint (the current stage finishes first)."""
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set(): raise Cancelled()
+
+    def checkpoint(self):
+        """Between stages: wait while paused, raise Cancelled if cancelled."""
+        self._running.wait()
+        self.check_cancelled()
+
+    def _register(self, proc):
+        with self._lock:
+            self._processes.add(proc)
+        if self.cancelled: _kill(proc)
+
+    def _unregister(self, proc):
+        with self._lock:
+            self._processes.discard(proc)
+
+
+class _NullControl(JobControl):
+    """Used when no control is active (plain CLI runs): never pauses or cancels."""
+
+    def cancel(self):
+        pass
+
+    def pause(self):
+        pass
+
+
+NULL = _NullControl()
+_local = threading.local()
+
+
+def _kill(proc):
+    try:
+        proc.kill()
+    except OSError:
+        pass
+
+
+def current():
+    """The control of the job running on this thread (NULL if none)."""
+    return getattr(_local, "control", None) or NULL
+
+
+@contextmanager
+def active(control):
+    """Make `control` the current control of this thread for the duration of the block."""
+    previous = getattr(_local, "control", None)
+    _local.control = control or previous
+    try:
+        yield _local.control or NULL
+    finally:
+        _local.control = previous
+
+
+def checkpoint():
+    current().checkpoint()
+
+
+def check_cancelled():
+    current().check_cancelled()
+
+
+def run_process(cmd, **kwargs):
+    """
+    subprocess.run(cmd, capture_output=True, **kwargs) that the current job can kill.
+    Raises Cancelled (after the process has exited) if the job was cancelled meanwhile.
+    """
+    control = current()
+    control.check_cancelled()
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+    control._register(proc)
+    try:
+        while True:
+            try:
+                stdout, stderr = proc.communicate(timeout=POLL_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                # Don't wait for the pipes once cancelled: a killed process' children may still hold them
+                control.check_cancelled()
+    except BaseException:
+        _kill(proc)
+        proc.wait()
+        raise
+    finally:
+        control._unregister(proc)
+    control.check_cancelled()
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def call(func, *args, **kwargs):
+    """
+    func(*args, **kwargs), abandoned with Cancelled if the current job is cancelled
+    before it returns (for blocking network calls). The abandoned call finishes in the
+    background, bounded by its own timeout; its result is discarded.
+    """
+    control = current()
+    if control is NULL: return func(*args, **kwargs)
+    control.check_cancelled()
+    outcome = {}
+    finished = threading.Event()
+
+    def run():
+        try:
+            outcome["value"] = func(*args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            finished.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    while not finished.wait(POLL_INTERVAL):
+        control.check_cancelled()
+    if "error" in outcome: raise outcome["error"]
+    return outcome["value"]
@@ -0,0 +1,108 @@
+"""
+Learned JavTrailers content IDs per label.
+
+JavTrailers detail pages live at /ja/video/<content id>, where the content id
+is the label and number with a maker prefix and zero padding that depend on
+the label ("ABW-009" -> "118abw00009", "IPX-123" -> "ipx00123"). Every
+successful search teaches us that pattern for the label; afterwards the
+detail page of any code of that label can be fetched directly, skipping the
+search request. A direct hit is still verified against the code on the page,
+and the search stays the fallback when it is not.
+
+The patterns are kept in <data dir>/label_patterns.json:
+
+    {"version": 1, "labels": {"ABW": {"maker": "118", "pad": 5, "suffix": "", "hits": 12, "misses": 0}}}
+"""
+
+import os
+import re
+import json
+import threading
+
+from app_paths import data_dir
+
+VERSION = 1
+FILENAME = "label_patterns.json"
+BASE_URL = "https://javtrailers.com/ja/video/"
+# A label whose direct URL failed this many times in a row is searched again until re-learned
+MAX_MISSES = 3
+
+_CODE_RE = re.compile(r'^([A-Z]+)-(\d+)$')
+
+
+class LabelPatterns:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._labels = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == VERSION: self._labels = data.get("labels", {})
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        temp = self.path + ".tmp"
+        try:
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump({"version": VERSION, "labels": self._labels}, f, indent=1, sort_keys=True)
+            os.replace(temp, self.path)
+        except OSError as e:
+            print(f"  [JavTrailers] Could not save label patterns: {e}")
+
+    def direct_url(self, code):
+        """Detail page URL for `code` if its label's pattern is known and trusted, else None."""
+        match = _CODE_RE.match(code.upper())
+        if not match: return None
+        label, number = match.group(1), int(match.group(2))
+        with self._lock:
+            entry = self._labels.get(label)
+            if not entry or entry["misses"] >= MAX_MISSES: return None
+            return f"{BASE_URL}{entry['maker']}{label.lower()}{number:0{entry['pad']}d}{entry['suffix']}"
+
+    def learn(self, code, detail_href):
+        """Record the pattern of a detail link that a search returned for `code`."""
+        match = _CODE_RE.match(code.upper())
+        if not match: return
+        label, number = match.group(1), int(match.group(2))
+        slug = detail_href.rstrip('/').rsplit('/', 1)[-1].lower()
+        found = re.match(rf'^([0-9a-z_]*?){re.escape(label.lower())}(\d+)([a-z]*)$', slug)
+        if not found or int(found.group(2)) != number: return
+        maker, digits, suffix = found.groups()
+        with self._lock:
+            entry = self._labels.get(label)
+            if entry and entry["maker"] == maker and entry["suffix"] == suffix and \
+                    (len(digits) == entry["pad"] or (digits[0] != '0' and len(digits) > entry["pad"])):
+                # Same pattern (an unpadded number longer than the padding fits it too).
+                # Hit counts alone are not worth a write; they are saved with the next change.
+                if entry["misses"] == 0:
+                    entry["hits"] += 1
+                    return
+                entry.update(hits=entry["hits"] + 1, misses=0)
+            else:
+                self._labels[label] = {"maker": maker, "pad": len(digits), "suffix": suffix, "hits": 1, "misses": 0}
+            self._save()
+
+    def miss(self, code):
+        """The direct URL of `code` did not lead to its page."""
+        match = _CODE_RE.match(code.upper())
+        if not match: return
+        with self._lock:
+            entry = self._labels.get(match.group(1))
+            if not entry: return
+            entry["misses"] += 1
+            self._save()
+
+
+_PATTERNS = None
+_PATTERNS_LOCK = threading.Lock()
+
+
+def get_label_patterns():
+    """The shared store (loaded once per process)."""
+    global _PATTERNS
+    with _PATTERNS_LOCK:
+        if _PATTERNS is None:
+            _PATTERNS = LabelPatterns(os.path.join(data_dir(), FILENAME))
+        return _PATTERNS
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+Library health audit: find damaged or unfinished MP4s without touching them.
+
+Only box headers are read (a handful of small reads per file; no mutagen,
+no ffmpeg), so a 20k-file library on a NAS is swept in minutes. Files are
+audited in parallel and findings are streamed to a CSV or JSONL report as
+they come in:
+
+    truncated       a box runs past the end of the file (incomplete download)
+    bad_box         unreadable box header before the end of the file
+    dat_corruption  stray 'dat' atom at the start (LosslessCut corruption)
+    no_moov         no movie header at all
+    moov_at_end     moov after mdat (not streamable)
+    no_cover        no embedded cover
+
+--fix sends the flagged files through the existing pipeline: ffmpeg repair
+for dat corruption, (in-place) faststart for moov_at_end, and the rename/
+cover pipeline for missing covers. Truncated files are only reported.
+
+Usage:
+    python library_audit.py "H:\\Videos" -r --report audit.csv
+    python library_audit.py "H:\\Videos" -r --report audit.jsonl --fix
+    python library_audit.py --from-report audit.jsonl --fix      # fix what an earlier audit found
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from library_scan import scan_videos
+from mp4_boxes import iter_boxes
+import mp4_tags
+import mkv_tags
+import run_report
+import batch_journal
+import io_scheduler
+import metrics
+
+ISSUES = ("truncated", "bad_box", "dat_corruption", "no_moov", "moov_at_end", "no_cover")
+FIXABLE = ("dat_corruption", "moov_at_end", "no_cover")
+UNFIXABLE = ("truncated", "bad_box", "unreadable")
+FIELDS = ["file", "size", "issues", "detail"]
+DEFAULT_WORKERS = 16
+# A 'dat' box this close to the start is the LosslessCut corruption (see rename_movies.check_file_structure)
+DAT_WINDOW = 100
+
+
+def audit_file(path, size=None):
+    """{"file", "size", "issues": [...], "detail"} for one MP4, from its box headers."""
+    result = {"file": path, "size": size, "issues": [], "detail": ""}
+    issues, details = result["issues"], []
+    try:
+        with open(path, 'rb') as f:
+            file_size = f.seek(0, 2)
+            result["size"] = file_size
+            names, end = [], 0
+            for name, offset, box_size, _ in iter_boxes(f, 0, file_size):
+                names.append(name)
+                if name.strip(' \x00') == 'dat' and offset < DAT_WINDOW and "dat_corruption" not in issues:
+                    issues.append("dat_corruption")
+                end = offset + box_size
+                if end > file_size:
+                    issues.append("truncated")
+                    details.append(f"{name} ends at {end}, file has {file_size} bytes")
+                    break
+            else:
+                if end < file_size:
+                    issues.append("bad_box")
+                    details.append(f"no valid box at offset {end}")
+    except OSError as e:
+        result["issues"] = ["unreadable"]
+        result["detail"] = str(e)
+        return result
+
+    if 'moov' not in names:
+        issues.append("no_moov")
+    else:
+        if 'mdat' in names and names.index('mdat') < names.index('moov'): issues.append("moov_at_end")
+        if not mp4_tags.find_item(path, "covr"): issues.append("no_cover")
+    result["detail"] = "; ".join(details)
+    return result
+
+
+def audit_library(root, recursive=True, include=None, exclude=None, scan_workers=1, workers=DEFAULT_WORKERS):
+    """Yield audit_file() results for every MP4 under `root`, in completion order."""
+    entries = scan_videos(root, recursive=recursive, include=include, exclude=exclude, workers=scan_workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for entry in entries:
+            try:
+                size = entry.stat().st_size
+            except OSError:
+                size = None
+            pending.add(executor.submit(audit_file, entry.path, size))
+            # Bounded window: results stream out while the scan continues
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done: yield future.result()
+        for future in pending: yield future.result()
+
+
+class ReportWriter:
+    """Append audit results to a .csv or .jsonl report as they arrive."""
+    def __init__(self, path):
+        self.path = path
+        self._csv = path.lower().endswith(".csv")
+        self._f = open(path, 'w', encoding='utf-8-sig' if self._csv else 'utf-8', newline='' if self._csv else None)
+        if self._csv:
+            self._writer = csv.DictWriter(self._f, fieldnames=FIELDS)
+            self._writer.writeheader()
+
+    def write(self, result):
+        if self._csv: self._writer.writerow({**result, "issues": "|".join(result["issues"])})
+        else: self._f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+def read_report(path):
+    """Results from a report written by ReportWriter."""
+    results = []
+    if path.lower().endswith(".csv"):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                row["issues"] = [i for i in row["issues"].split("|") if i]
+                results.append(row)
+        return results
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _fixable(result):
+    """Has something --fix can address, and no damage (truncation) that no rewrite can undo."""
+    issues = result["issues"]
+    return any(i in FIXABLE for i in issues) and not any(i in UNFIXABLE for i in issues)
+
+
+def fix_file(result, cover_dir=None, journal=None):
+    """Run the pipeline steps that address the issues of one audited file. True if all succeeded."""
+    import rename_movies
+    import faststart
+    path, issues = result["file"], result["issues"]
+    if not os.path.exists(path):
+        print(f"  [Fix] Gone: {path}")
+        return False
+    ok = True
+    if "dat_corruption" in issues:
+        # The ffmpeg remux also writes moov first, so no separate faststart
+        ok = rename_movies.repair_with_ffmpeg(path, journal=journal)[0]
+    elif "moov_at_end" in issues:
+        ok = faststart.faststart(path, journal=journal)
+    if ok and "no_cover" in issues:
+        # Fetches metadata and embeds the cover (renaming as usual)
+        name = rename_movies.process_file(os.path.dirname(path), os.path.basename(path), dry_run=False,
+                                          cover_dir=cover_dir, journal=journal)
+        # process_file also succeeds when no cover could be found or embedded: look at the file itself
+        new_path = os.path.join(os.path.dirname(path), name) if name else None
+        ok = bool(new_path) and (mkv_tags.has_cover(new_path) if new_path.lower().endswith(mkv_tags.EXTENSIONS)
+                                 else mp4_tags.find_item(new_path, "covr") is not None)
+    run_report.add("audit.fixed" if ok else "audit.fix_failed")
+    return ok
+
+
+def fix_files(results, jobs_per_volume=1, cover_dir=None):
+    """Fix every fixable result; heavy steps queue per physical volume (see faststart.run_per_volume)."""
+    from faststart import run_per_volume
+    results = [r for r in results if _fixable(r)]
+    if not results:
+        print("Nothing to fix.")
+        return {}
+    print(f"\nFixing {len(results)} file(s)...")
+    by_path = {r["file"]: r for r in results}
+    journal = batch_journal.BatchJournal.open("audit-fix", files=list(by_path))
+    try:
+        return run_per_volume(list(by_path), lambda p: fix_file(by_path[p], cover_dir, journal),
+                              jobs_per_volume=jobs_per_volume)
+    finally:
+        journal.close()
+
+
+def main():
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description="Audit an MP4 library (box headers only) and optionally fix what is found.")
+    parser.add_argument("root", nargs="?", help="Library folder to audit")
+    parser.add_argument("--recursive", "-r", action="store_true", help="Also audit subdirectories")
+    parser.add_argument("--include", action="append", help="Glob of files to include (repeatable)")
+    parser.add_argument("--exclude", action="append", help="Glob of files/folders to skip (repeatable)")
+    parser.add_argument("--scan-workers", type=int, default=1, help="Parallel directory listings (helps on NAS)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Files audited in parallel")
+    parser.add_argument("--report", help="Write findings to this .csv or .jsonl file")
+    parser.add_argument("--all", action="store_true", help="Also write files without findings to the report")
+    parser.add_argument("--fix", action="store_true", help="Repair / faststart / add covers for flagged files (LIVE)")
+    parser.add_argument("--from-report", metavar="REPORT", help="Use the findings of an earlier report instead of auditing")
+    parser.add_argument("--jobs-per-volume", type=int, default=1, help="--fix: concurrent rewrites per physical volume")
+    parser.add_argument("--cover-dir", help="--fix: cover folder (default: label/cover)")
+    args = parser.parse_args()
+    metrics.start()
+    if not args.root and not args.from_report:
+        parser.error("give a library folder or --from-report")
+
+    if args.from_report:
+        flagged = [r for r in read_report(args.from_report) if r["issues"]]
+        print(f"{len(flagged)} flagged file(s) in {args.from_report}")
+    else:
+        start = time.time()
+        writer = ReportWriter(args.report) if args.report else None
+        flagged, total = [], 0
+        counts = dict.fromkeys(ISSUES + ("unreadable",), 0)
+        try:
+            for result in audit_library(args.root, recursive=args.recursive, include=args.include,
+                                        exclude=args.exclude, scan_workers=args.scan_workers, workers=args.workers):
+                total += 1
+                run_report.add("audit.files")
+                if result["issues"]:
+                    flagged.append(result)
+                    for issue in result["issues"]:
+                        counts[issue] += 1
+                        run_report.add(f"audit.{issue}")
+                    print(f"  [{', '.join(result['issues'])}] {result['file']}")
+                if writer and (result["issues"] or args.all): writer.write(result)
+        finally:
+            if writer: writer.close()
+        print(f"\n{'=' * 50}")
+        print(f"Audited {total} file(s) in {time.time() - start:.1f}s, {len(flagged)} with findings")
+        for issue, count in counts.items():
+            if count: print(f"  {issue:15} {count}")
+        if writer: print(f"Report written to: {args.report}")
+
+    if args.fix:
+        batch_journal.recover()
+        io_scheduler.configure(default_limit=args.jobs_per_volume)
+        results = fix_files(flagged, jobs_per_volume=args.jobs_per_volume, cover_dir=args.cover_dir)
+        failed = [p for p, ok in results.items() if not ok]
+        for path in failed: print(f"  [Failed] {path}")
+        left = [r["file"] for r in flagged if any(i in UNFIXABLE for i in r["issues"])]
+        if left: print(f"{len(left)} file(s) cannot be fixed automatically (truncated/unreadable); re-download them.")
+    run_report.print_summary()
+
+
+if __name__ == "__main__":
+    main()
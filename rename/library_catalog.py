@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+"""
+Catalog of library files for duplicate detection (SQLite, in the data dir).
+
+The same release tends to arrive more than once: with and without an
+uploader prefix, re-downloaded, as a ".restored" copy. Each copy used to cost
+a full scrape, cover download and remux. Every file the pipeline sees is
+recorded here with:
+
+  * a content key: the size of its media data plus a partial hash (head,
+    tail and evenly spaced blocks of `mdat`, or of the clusters of an MKV). Only the media payload is
+    hashed, so the key survives renames, tag/cover edits and faststart;
+  * its normalized code and suffix (code_parser).
+
+process_file() checks the key before any network or remux work and skips a
+file whose content is already catalogued under another path that still
+exists (the copy seen first wins). Files that share a code but not the
+content are "variants" (e.g. -C and uncensored releases); they are listed,
+never skipped.
+
+Usage:
+    python library_catalog.py scan "H:\\Videos" -r     # catalog a library without processing it
+    python library_catalog.py duplicates              # groups of identical files
+    python library_catalog.py variants                # codes with several different files
+    python library_catalog.py prune                   # forget files that no longer exist
+"""
+
+import os
+import sys
+import time
+import json
+import struct
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+from app_paths import data_dir
+from mp4_boxes import iter_boxes
+from library_scan import scan_videos, RENAMABLE_EXTENSIONS
+import code_parser
+import mkv_tags
+import run_report
+
+FILENAME = "catalog.sqlite"
+# Blocks hashed per file (first and last included) and their size
+BLOCKS = 8
+BLOCK_SIZE = 64 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT PRIMARY KEY,       -- normcase(abspath)
+    path TEXT NOT NULL,
+    size INTEGER, mtime REAL,   -- reuse the digest while these are unchanged
+    content_size INTEGER, digest TEXT,
+    code TEXT, suffix TEXT,
+    first_seen REAL
+);
+CREATE INDEX IF NOT EXISTS files_content ON files (content_size, digest);
+CREATE INDEX IF NOT EXISTS files_code ON files (code);
+"""
+
+
+def content_digest(path):
+    """(content size, hex digest) of the media payload (largest mdat / MKV clusters; whole file if none)."""
+    with open(path, 'rb') as f:
+        file_size = f.seek(0, 2)
+        start, end = 0, file_size
+        if path.lower().endswith(mkv_tags.EXTENSIONS):
+            try:
+                start, end = mkv_tags.media_range(path)
+            except mkv_tags.UnsupportedLayout:
+                pass
+        else:
+            mdats = [b for b in iter_boxes(f, 0, file_size) if b[0] == 'mdat']
+            if mdats:
+                _, offset, size, header_size = max(mdats, key=lambda b: b[2])
+                start, end = offset + header_size, min(file_size, offset + size)
+        length = end - start
+        digest = hashlib.sha1(struct.pack('>Q', length))
+        for i in range(BLOCKS):
+            f.seek(start + max(0, length - BLOCK_SIZE) * i // (BLOCKS - 1))
+            digest.update(f.read(min(BLOCK_SIZE, length)))
+    return length, digest.hexdigest()
+
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class Catalog:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # One connection shared by the pipeline's threads (guarded by the lock)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    def add(self, path, code=None, suffix=None):
+        """Record `path` (hashing it only if new or changed). Returns its row as a dict."""
+        st = os.stat(path)
+        if code is None: code, suffix, _ = code_parser.parse_filename(os.path.basename(path))
+        key = _key(path)
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime, content_size, digest, first_seen FROM files WHERE key = ?",
+                                   (key,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            content_size, digest, first_seen = row[2], row[3], row[4]
+        else:
+            content_size, digest = content_digest(path)
+            first_seen = row[4] if row else time.time()
+            run_report.add("catalog.hashed")
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (key, os.path.abspath(path), st.st_size, st.st_mtime, content_size, digest,
+                              code, suffix or "", first_seen))
+        return {"path": os.path.abspath(path), "content_size": content_size, "digest": digest,
+                "code": code, "suffix": suffix or "", "first_seen": first_seen}
+
+    def find_duplicate(self, path, code=None, suffix=None):
+        """
+        Record `path`; return an existing file with the same content that was catalogued
+        before it (that copy is the one to keep), else None.
+        """
+        entry = self.add(path, code, suffix)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, path, first_seen FROM files WHERE content_size = ? AND digest = ? AND key != ? "
+                "ORDER BY first_seen, path", (entry["content_size"], entry["digest"], _key(path))).fetchall()
+        for key, other, first_seen in rows:
+            if not os.path.exists(other):
+                self.forget(other)
+                continue
+            if (first_seen, other) < (entry["first_seen"], entry["path"]): return other
+        return None
+
+    def moved(self, old, new):
+        """Follow a rename done by the pipeline (the content key stays valid)."""
+        try:
+            st = os.stat(new)
+        except OSError:
+            return
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM files WHERE key = ?", (_key(new),))
+            self._db.execute("UPDATE files SET key = ?, path = ?, size = ?, mtime = ? WHERE key = ?",
+                             (_key(new), os.path.abspath(new), st.st_size, st.st_mtime, _key(old)))
+
+    def forget(self, path):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM files WHERE key = ?", (_key(path),))
+
+    def prune(self):
+        """Forget files that no longer exist. Returns how many were removed."""
+        with self._lock:
+            paths = [row[0] for row in self._db.execute("SELECT path FROM files")]
+        gone = [p for p in paths if not os.path.exists(p)]
+        for path in gone: self.forget(path)
+        return len(gone)
+
+    def duplicate_groups(self):
+        """Lists of paths with identical content (oldest entry first), largest files first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT f.content_size, f.digest, f.path FROM files f JOIN ("
+                "  SELECT content_size, digest FROM files GROUP BY content_size, digest HAVING COUNT(*) > 1"
+                ") d USING (content_size, digest) ORDER BY f.content_size DESC, f.digest, f.first_seen").fetchall()
+        groups = {}
+        for content_size, digest, path in rows:
+            groups.setdefault((content_size, digest), []).append(path)
+        return list(groups.values())
+
+    def variants(self):
+        """{code: [{"path", "suffix", "content_size"}]} for codes with more than one distinct content."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT code, path, suffix, content_size FROM files WHERE code IN ("
+                "  SELECT code FROM files WHERE code IS NOT NULL GROUP BY code"
+                "  HAVING COUNT(DISTINCT content_size || ':' || digest) > 1"
+                ") ORDER BY code, suffix, path").fetchall()
+        found = {}
+        for code, path, suffix, content_size in rows:
+            found.setdefault(code, []).append({"path": path, "suffix": suffix, "content_size": content_size})
+        return found
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_CATALOG = None
+_CATALOG_LOCK = threading.Lock()
+
+
+def get_catalog():
+    """The shared catalog (opened once per process)."""
+    global _CATALOG
+    with _CATALOG_LOCK:
+        if _CATALOG is None:
+            _CATALOG = Catalog(os.path.join(data_dir(), FILENAME))
+        return _CATALOG
+
+
+def _size(n):
+    return f"{n / 1024 ** 3:.2f} GB" if n >= 1024 ** 3 else f"{n / 1024 ** 2:.1f} MB"
+
+
+def main():
+    sys.stdout.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description="Catalog of library files for duplicate detection.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_scan = sub.add_parser("scan", help="Add the MP4/MKV files of a folder to the catalog")
+    p_scan.add_argument("root")
+    p_scan.add_argument("--recursive", "-r", action="store_true")
+    p_scan.add_argument("--scan-workers", type=int, default=1, help="Parallel directory listings (helps on NAS)")
+    p_dupes = sub.add_parser("duplicates", help="List groups of identical files")
+    p_dupes.add_argument("--json", action="store_true")
+    p_variants = sub.add_parser("variants", help="List codes with several different files")
+    p_variants.add_argument("--json", action="store_true")
+    sub.add_parser("prune", help="Forget files that no longer exist")
+    args = parser.parse_args()
+
+    catalog = get_catalog()
+    if args.command == "scan":
+        count = 0
+        for entry in scan_videos(args.root, recursive=args.recursive, workers=args.scan_workers,
+                                 extensions=RENAMABLE_EXTENSIONS):
+            try:
+                duplicate = catalog.find_duplicate(entry.path)
+            except OSError as e:
+                print(f"  [Error] {entry.name}: {e}")
+                continue
+            count += 1
+            if duplicate: print(f"  [Duplicate] {entry.path}\n              = {duplicate}")
+        print(f"Catalogued {count} file(s) in {catalog.path}")
+    elif args.command == "duplicates":
+        groups = catalog.duplicate_groups()
+        if args.json:
+            print(json.dumps(groups, ensure_ascii=False, indent=1))
+            return
+        for group in groups:
+            print(f"\n{_size(os.path.getsize(group[0]) if os.path.exists(group[0]) else 0)} x {len(group)}:")
+            for path in group: print(f"  {path}")
+        print(f"\n{len(groups)} duplicate group(s)")
+    elif args.command == "variants":
+        found = catalog.variants()
+        if args.json:
+            print(json.dumps(found, ensure_ascii=False, indent=1))
+            return
+        for code, files in found.items():
+            print(f"\n{code}:")
+            for item in files:
+                print(f"  {item['suffix'] or '-':6} {_size(item['content_size']):>10}  {item['path']}")
+        print(f"\n{len(found)} code(s) with variants")
+    elif args.command == "prune":
+        print(f"Removed {catalog.prune()} missing file(s) from the catalog")
+
+
+if __name__ == "__main__":
+    main()
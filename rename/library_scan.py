@@ -0,0 +1,89 @@
+"""
+Library scanning built on os.scandir.
+
+`scan_videos()` is a generator: files of a directory are yielded as soon as
+that directory has been listed, so processing can start before a large tree
+(hundreds of studio subfolders) is fully enumerated. DirEntry objects are
+yielded as-is so callers can reuse their cached type/stat information instead
+of issuing extra os.path / os.stat calls.
+"""
+
+import os
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+VIDEO_EXTENSIONS = (".mp4",)
+# What the rename/cover pipeline accepts (MKV covers: see mkv_tags)
+RENAMABLE_EXTENSIONS = VIDEO_EXTENSIONS + (".mkv",)
+
+
+def _matches(patterns, rel_path, name):
+    for pattern in patterns:
+        if fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def _list_dir(path, root, include, exclude, extensions):
+    """List one directory. Returns (sorted video entries, sorted subdirectory paths)."""
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        print(f"  [Scan] Cannot list {path}: {e}")
+        return files, subdirs
+
+    for entry in entries:
+        rel_path = os.path.relpath(entry.path, root).replace(os.sep, '/')
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                # Hidden dirs hold our own state (.javcover, .journal) or system junk
+                if entry.name.startswith('.'): continue
+                if exclude and _matches(exclude, rel_path, entry.name): continue
+                subdirs.append(entry.path)
+                continue
+            if not entry.is_file(): continue
+        except OSError:
+            continue
+        if not entry.name.lower().endswith(extensions): continue
+        if include and not _matches(include, rel_path, entry.name): continue
+        if exclude and _matches(exclude, rel_path, entry.name): continue
+        files.append(entry)
+    return files, subdirs
+
+
+def scan_videos(root, recursive=False, include=None, exclude=None, workers=1, extensions=VIDEO_EXTENSIONS):
+    """
+    Yield os.DirEntry objects for video files under `root`.
+
+    include / exclude: lists of glob patterns matched against both the file
+    name and the path relative to `root` (e.g. "S1/*", "*-C.mp4").
+    Excluded directories are pruned entirely.
+    workers > 1 lists subdirectories in parallel (useful on NAS/SMB where each
+    listing is a network round-trip); files still stream out per directory.
+    """
+    root = os.path.abspath(root)
+    include = list(include or [])
+    exclude = list(exclude or [])
+
+    if not recursive or workers <= 1:
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            files, subdirs = _list_dir(path, root, include, exclude, extensions)
+            yield from files
+            if recursive:
+                # Reverse so the alphabetically first subdirectory is walked next
+                stack.extend(reversed(subdirs))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_list_dir, root, root, include, exclude, extensions)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for sub in subdirs:
+                    pending.add(executor.submit(_list_dir, sub, root, include, exclude, extensions))
+                yield from files
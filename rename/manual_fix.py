@@ -4,61 +4,75 @@
 用途：处理 rename_movies.py 无法处理的文件
 
 工作流程：
-1. Faststart（移动 moov atom 到文件开头）
+1. Faststart（移动 moov atom 到文件开头；优先在原文件内原地移动，不支持的结构才用 ffmpeg）
 2. 从 label/cover 文件夹查找已有封面
 3. 重新嵌入封面（因为 ffmpeg 会删掉原有封面）
 
-用法: python manual_fix.py "视频文件路径"
+用法: python manual_fix.py "视频文件路径" ["更多路径/通配符/文件夹" ...]
+      python manual_fix.py "D:\\Videos\\*.mp4" --jobs-per-volume 2 --report unresolved.csv
+
+无法提取番号或找不到封面的文件不会中断批处理，而是记录到报告中。
 """
 
 import os
 import sys
-import re
-import subprocess
+import csv
+import time
+import argparse
+
+from cover_index import get_cover_index
+from faststart import run_per_volume, expand_paths
+from mp4_boxes import is_faststart
+import run_report
+import batch_journal
+import code_parser
+from io_scheduler import io_slot, temp_path_for
+import mp4_tags
+import mp4_faststart
+import mp4_verify
+import job_control
+import metrics
 
 # 封面目录（相对于脚本所在的 rename/ 的上级目录）
 COVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cover')
 
 def extract_code(filename):
-    """从文件名提取番号"""
-    clean_name = filename.upper()
-    
-    # FC2 格式
-    fc2_match = re.search(r'FC2[-_]?(?:PPV)?[-_]?(\d+)', clean_name)
-    if fc2_match:
-        return f"FC2-{fc2_match.group(1)}"
-    
-    # 标准格式: LETTERS-DIGITS
-    match = re.search(r'^([A-Z]+)-?0*(\d+)', clean_name)
-    if match:
-        return f"{match.group(1)}-{match.group(2)}"
-    
-    return None
+    """从文件名提取番号（与 rename_movies 共用 code_parser 的规则）"""
+    return code_parser.parse_filename(filename)[0]
 
 def find_cover(code):
-    """在 cover 文件夹查找匹配的封面"""
+    """在 cover 文件夹查找匹配的封面（使用封面索引，整个运行期间只扫描一次目录）"""
     if not os.path.exists(COVER_DIR):
         return None
-    
-    # 优先精确匹配 CODE
-    for filename in os.listdir(COVER_DIR):
-        if filename.upper().startswith(code.upper() + ' ') or filename.upper().startswith(code.upper() + '.'):
-            return os.path.join(COVER_DIR, filename)
-    
-    # 模糊匹配
-    for filename in os.listdir(COVER_DIR):
-        if code.upper() in filename.upper() and filename.lower().endswith('.jpg'):
-            return os.path.join(COVER_DIR, filename)
-    
-    return None
+    return get_cover_index(COVER_DIR).find(code)
 
-def apply_faststart(mp4_path):
-    """应用 faststart (移动 moov atom 到开头)"""
+@metrics.timed("faststart")
+def apply_faststart(mp4_path, journal=None):
+    """应用 faststart (移动 moov atom 到开头)，每一步写入 journal 以便中断后恢复"""
+    file_size = os.path.getsize(mp4_path)
+    if is_faststart(mp4_path):
+        print("moov 已在 mdat 之前，跳过 faststart")
+        run_report.add("faststart.skipped")
+        run_report.add("faststart.avoided_bytes", file_size)
+        return True
+    
     print("正在应用 faststart...")
     
-    directory = os.path.dirname(mp4_path)
-    filename = os.path.basename(mp4_path)
-    temp_path = os.path.join(directory, f"_temp_{filename}")
+    journal = journal or batch_journal.NULL
+    # 优先原地移动 moov：不需要第二份完整文件的空间（见 mp4_faststart）
+    try:
+        mp4_faststart.faststart_inplace(mp4_path, journal=journal)
+        print("✓ Faststart 完成（原地移动）!")
+        return True
+    except mp4_tags.UnsupportedLayout as e:
+        print(f"无法原地移动（{e}），改用 ffmpeg")
+    except OSError as e:
+        print(f"错误: {e}")
+        return False
+    
+    # 临时文件放在同一目录（同一卷），保证最后的改名是原子操作
+    temp_path = temp_path_for(mp4_path, ".faststart.mp4")
+    journal.record(mp4_path, "faststart", "intent", temp=temp_path)
     
     cmd = [
         'ffmpeg', '-y', '-i', mp4_path,
@@ -67,51 +81,84 @@ def apply_faststart(mp4_path):
         temp_path
     ]
     
-    try:
-        # 使用 utf-8 避免编码问题
-        result = subprocess.run(cmd, capture_output=True, encoding='utf-8', errors='replace')
+    # 同一物理磁盘同时只做有限个重写（见 io_scheduler）
+    with io_slot(mp4_path):
+        try:
+            # 使用 utf-8 避免编码问题；任务取消时 ffmpeg 会被终止（见 job_control）
+            result = job_control.run_process(cmd, encoding='utf-8', errors='replace')
         
-        if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
-            os.remove(mp4_path)
-            os.rename(temp_path, mp4_path)
-            print("✓ Faststart 完成!")
-            return True
-        else:
-            print(f"Faststart 失败")
+            # 校验结构、时长和抽样的媒体数据（见 mp4_verify），不通过则保留原文件
+            problems = None
+            if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
+                problems = mp4_verify.verify(temp_path, source=mp4_path)
+                if problems: print(f"输出文件校验失败: {'; '.join(problems)}")
+            if problems == []:
+                # 临时文件已完整：之后若在删除原文件与改名之间中断，恢复时会直接用临时文件补完
+                journal.record(mp4_path, "faststart", "swap", temp=temp_path)
+                os.remove(mp4_path)
+                os.rename(temp_path, mp4_path)
+                journal.record(mp4_path, "faststart", "done")
+                print("✓ Faststart 完成!")
+                run_report.add("faststart.rewritten")
+                run_report.add("faststart.rewritten_bytes", file_size)
+                return True
+            else:
+                print(f"Faststart 失败")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                journal.record(mp4_path, "faststart", "failed", temp=temp_path)
+                return False
+        except job_control.Cancelled:
+            # 原文件尚未改动，只需删除不完整的临时文件
             if os.path.exists(temp_path):
                 os.remove(temp_path)
+            journal.record(mp4_path, "faststart", "failed", temp=temp_path)
+            print("Faststart 已取消")
+            raise
+        except FileNotFoundError:
+            print("未找到 ffmpeg，请确保已安装并添加到 PATH")
+            journal.record(mp4_path, "faststart", "failed", temp=temp_path)
+            return False
+        except Exception as e:
+            print(f"错误: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            journal.record(mp4_path, "faststart", "failed", temp=temp_path)
             return False
-    except FileNotFoundError:
-        print("未找到 ffmpeg，请确保已安装并添加到 PATH")
-        return False
-    except Exception as e:
-        print(f"错误: {e}")
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        return False
 
-def embed_cover(mp4_path, cover_path):
-    """嵌入封面到 MP4 文件"""
-    try:
-        from mutagen.mp4 import MP4, MP4Cover
-    except ImportError:
-        print("缺少 mutagen 库，请运行: pip install mutagen")
-        return False
-    
+@metrics.timed("cover_embed")
+def embed_cover(mp4_path, cover_path, journal=None, code=None):
+    """嵌入封面到 MP4 文件（封面按块流式写入，见 mp4_tags）；同时写入番号标签"""
     print(f"正在嵌入封面: {os.path.basename(cover_path)}")
     try:
-        video = MP4(mp4_path)
-        with open(cover_path, 'rb') as f:
-            video['covr'] = [MP4Cover(f.read(), imageformat=MP4Cover.FORMAT_JPEG)]
-        video.save()
+        before = mp4_verify.fingerprint(mp4_path)
+        mp4_tags.embed_cover(mp4_path, cover_path, journal=journal, code=code)
+        problems = mp4_verify.verify(mp4_path, source=before)
+        if problems:
+            print(f"嵌入后文件校验失败: {'; '.join(problems)}")
+            return False
         print("✓ 封面嵌入成功!")
         return True
+    except ImportError:
+        print("此文件结构需要 mutagen 库，请运行: pip install mutagen")
+        return False
     except Exception as e:
         print(f"嵌入失败: {e}")
         return False
 
-def process_file(mp4_path, progress_callback=None):
-    """处理单个文件：faststart + 重新嵌入封面"""
+def process_file(mp4_path, progress_callback=None, unresolved=None, journal=None, control=None):
+    """
+    处理单个文件：faststart + 重新嵌入封面
+    unresolved: 可选列表，无法处理的文件会以 {"file", "code", "reason"} 追加进去（不再阻塞等待输入）
+    journal: 可选 BatchJournal，记录每一步以便 --resume
+    control: 可选 job_control.JobControl，在各步骤之间暂停/取消；取消时抛出 job_control.Cancelled
+    """
+    with job_control.active(control):
+        return _process_file(mp4_path, progress_callback, unresolved, journal)
+
+@metrics.timed("file")
+def _process_file(mp4_path, progress_callback, unresolved, journal):
+    journal = journal or batch_journal.NULL
     filename = os.path.basename(mp4_path)
     code = extract_code(filename)
     
@@ -119,58 +166,113 @@ def process_file(mp4_path, progress_callback=None):
     print(f"文件: {filename}")
     
     if not code:
-        code = input("无法自动提取番号，请手动输入: ").strip().upper()
-    else:
-        print(f"番号: {code}")
+        print("⚠ 无法自动提取番号，已记录到报告")
+        if unresolved is not None:
+            unresolved.append({"file": mp4_path, "code": "", "reason": "no_code"})
+        return False
+    print(f"番号: {code}")
     
     # 1. 查找封面
+    job_control.checkpoint()
     if progress_callback: progress_callback(20, "Looking for cover...")
     cover_path = find_cover(code)
     if not cover_path:
         print(f"⚠ 未找到 {code} 的封面，跳过处理")
         # 显示可能相关的封面
         prefix = code.split('-')[0] if '-' in code else code[:4]
-        related = [f for f in os.listdir(COVER_DIR) if prefix in f.upper()][:5]
+        related = get_cover_index(COVER_DIR).related(prefix) if os.path.exists(COVER_DIR) else []
         if related:
             print(f"  相关封面: {related}")
+        if unresolved is not None:
+            unresolved.append({"file": mp4_path, "code": code, "reason": "no_cover",
+                               "related": " | ".join(related)})
         return False
     
     print(f"找到封面: {os.path.basename(cover_path)}")
     
     # 2. Faststart
+    job_control.checkpoint()
     if progress_callback: progress_callback(60, "Running Faststart...")
-    if not apply_faststart(mp4_path):
+    if not apply_faststart(mp4_path, journal=journal):
         return False
     
     # 3. 重新嵌入封面
+    job_control.checkpoint()
     if progress_callback: progress_callback(90, "Embedding cover...")
-    if not embed_cover(mp4_path, cover_path):
+    journal.record(mp4_path, "cover", "intent")
+    if not embed_cover(mp4_path, cover_path, journal=journal, code=code):
+        journal.record(mp4_path, "cover", "failed")
         return False
+    journal.record(mp4_path, "cover", "done")
+    journal.file_done(mp4_path)
     
     print("✓ 处理完成!")
     if progress_callback: progress_callback(100, "Done.")
     return True
 
+def write_report(unresolved, report_path):
+    """把未解决的文件写成 CSV（utf-8-sig，方便 Excel 打开）"""
+    with open(report_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["file", "code", "reason", "related"])
+        writer.writeheader()
+        for row in unresolved:
+            writer.writerow({"related": "", **row})
+
 def main():
-    if len(sys.argv) < 2:
-        print("用法: python manual_fix.py <视频文件路径>")
-        print("\n功能: Faststart + 重新嵌入封面")
-        print("  - 从 label/cover 文件夹查找已有封面")
-        print("  - 运行 ffmpeg faststart")
-        print("  - 重新嵌入封面")
-        sys.exit(1)
-    
-    mp4_path = sys.argv[1]
-    
-    if not os.path.exists(mp4_path):
-        print(f"文件不存在: {mp4_path}")
+    parser = argparse.ArgumentParser(description="Faststart + 重新嵌入封面（从 label/cover 文件夹查找已有封面）")
+    parser.add_argument("paths", nargs="*", help="视频文件、通配符或文件夹")
+    parser.add_argument("--jobs-per-volume", type=int, default=1, help="同一物理磁盘上同时处理的文件数")
+    parser.add_argument("--max-jobs", type=int, help="总并发上限")
+    parser.add_argument("--report", help="把未解决的文件写入 CSV 报告")
+    parser.add_argument("--resume", action="store_true", help="继续上次中断的批处理，跳过已完成的文件")
+    args = parser.parse_args()
+    metrics.start()
+
+    if not args.paths:
+        parser.print_help()
         sys.exit(1)
     
-    if not mp4_path.lower().endswith('.mp4'):
-        print("只支持 MP4 文件")
-        sys.exit(1)
+    files = expand_paths(args.paths)
+    skipped = [f for f in files if not f.lower().endswith('.mp4') or not os.path.isfile(f)]
+    for f in skipped:
+        print(f"跳过（只支持已存在的 MP4 文件）: {f}")
+    files = [f for f in files if f not in skipped]
+    # 恢复上次中断留下的临时文件 / 备份
+    batch_journal.recover()
+    for directory in sorted({os.path.dirname(f) for f in files}):
+        batch_journal.sweep_temp_files(directory)
+    files = [f for f in files if os.path.isfile(f)]
+
+    journal = batch_journal.BatchJournal.open("manual", resume=args.resume, files=files)
+    done_before = [f for f in files if journal.is_done(f)]
+    files = [f for f in files if f not in done_before]
+    if done_before:
+        print(f"跳过上次已完成的 {len(done_before)} 个文件")
+    if not files:
+        journal.close()
+        sys.exit(0)
+
+    start = time.time()
+    unresolved = []
+    results = run_per_volume(files, lambda f: process_file(f, unresolved=unresolved, journal=journal),
+                             jobs_per_volume=args.jobs_per_volume, max_workers=args.max_jobs)
+    journal.close()
     
-    process_file(mp4_path)
+    succeeded = sum(1 for ok in results.values() if ok)
+    unresolved_files = {row["file"] for row in unresolved}
+    failed = [f for f, ok in results.items() if not ok and f not in unresolved_files]
+
+    print(f"\n{'='*50}")
+    print(f"汇总: 成功 {succeeded}，未解决 {len(unresolved)}，失败 {len(failed)}，跳过 {len(skipped)}，耗时 {time.time() - start:.1f}s")
+    for row in unresolved:
+        reason = "无法提取番号" if row["reason"] == "no_code" else f"找不到 {row['code']} 的封面"
+        print(f"  [未解决] {os.path.basename(row['file'])}: {reason}")
+    for f in failed:
+        print(f"  [失败] {os.path.basename(f)}")
+    run_report.print_summary("运行统计")
+    if args.report and unresolved:
+        write_report(unresolved, args.report)
+        print(f"报告已写入: {args.report}")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,52 @@
+"""
+Metadata lookups kept on disk (data dir), one small JSON file per code.
+
+fetch_metadata() used to remember (title, cover URL) for the current process
+only. Results are now also written to <data dir>/metadata/, so a re-run, the
+GUI and other machines whose JAVCOVER_DATA_DIR points at the same share skip
+the scrape. One file per code means workers never rewrite each other's
+entries; each is replaced atomically.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+
+from app_paths import data_dir
+
+# Refetch after this long (titles rarely change, cover URLs sometimes do)
+MAX_AGE = 30 * 24 * 3600
+
+
+def _path(code, is_fc2):
+    name = re.sub(r'[^A-Za-z0-9_-]', '_', code.upper())
+    return os.path.join(data_dir("metadata"), f"{'fc2-' if is_fc2 else ''}{name}.json")
+
+
+def get(code, is_fc2=False):
+    """(title, cover_url) stored for the code, or None."""
+    try:
+        with open(_path(code, is_fc2), 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        if time.time() - entry["fetched"] > MAX_AGE or not entry["title"]: return None
+        return entry["title"], entry["cover_url"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def put(code, is_fc2, title, cover_url):
+    path = _path(code, is_fc2)
+    temp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump({"code": code, "title": title, "cover_url": cover_url, "fetched": time.time()},
+                      f, ensure_ascii=False)
+        os.replace(temp, path)
+    except OSError as e:
+        print(f"  [Cache] Could not store metadata for {code}: {e}")
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
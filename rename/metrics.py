@@ -0,0 +1,221 @@
+"""
+Process-lifetime metrics in the Prometheus text format.
+
+run_report summarizes one batch. An unattended process (watch mode, the
+worker service behind a GUI left open) needs live numbers instead:
+
+  javcover_stage_seconds{stage}              histogram of each pipeline stage
+  javcover_stage_errors_total{stage}         stages that raised
+  javcover_http_request_seconds{host}        histogram of time to response headers
+  javcover_http_responses_total{host,status}
+  javcover_http_errors_total{host,kind}      kind: timeout / cloudflare / error
+  javcover_cloudflare_challenges_total{host} challenge pages and cloudscraper challenge errors
+  javcover_scrape_total{source,result}       metadata lookups: found / not_found
+  javcover_queue_depth{queue}                watch folder / worker service queues
+  javcover_events_total{event}               every run_report counter since start
+  javcover_event_bytes_total{event}          ... those counting bytes (e.g. faststart.moved_bytes)
+
+Exposure is optional:
+
+    metrics.start(port=9464, path="metrics.prom")   # or JAVCOVER_METRICS_PORT / JAVCOVER_METRICS_FILE
+
+serves GET /metrics on 127.0.0.1:<port> from a background thread and writes
+the same text to <path> when the process exits. Recording is always on; it
+is a dict update under a lock.
+"""
+
+import os
+import time
+import atexit
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import run_report
+
+PREFIX = "javcover_"
+# Histogram bucket upper bounds (seconds)
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+PORT_ENV = "JAVCOVER_METRICS_PORT"
+FILE_ENV = "JAVCOVER_METRICS_FILE"
+
+_HELP = {
+    "stage_seconds": "Duration of pipeline stages",
+    "stage_errors_total": "Pipeline stages that raised an error",
+    "http_request_seconds": "Time until response headers, per host",
+    "http_responses_total": "HTTP responses by host and status",
+    "http_errors_total": "Failed HTTP requests by host and kind",
+    "cloudflare_challenges_total": "Cloudflare challenge pages / challenge errors",
+    "scrape_total": "Metadata lookups by source and result",
+    "queue_depth": "Files or jobs waiting",
+    "events_total": "run_report counters since the process started",
+    "event_bytes_total": "run_report byte counters since the process started",
+}
+
+_lock = threading.Lock()
+_counters = {}      # (name, labels) -> value
+_gauges = {}        # (name, labels) -> value or callable
+_histograms = {}    # (name, labels) -> [bucket counts..., +Inf count, sum]
+_started = time.time()
+_server = None
+_dump_path = None
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """Current value; `value` may be a callable evaluated at each scrape (e.g. a queue length)."""
+    with _lock:
+        _gauges[(name, _labels(labels))] = value
+
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None: hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        hist[bisect.bisect_left(BUCKETS, seconds)] += 1
+        hist[-1] += seconds
+
+
+@contextmanager
+def stage(name):
+    """Time the block as pipeline stage `name`; an exception also counts as a stage error."""
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException as e:
+        if not isinstance(e, (KeyboardInterrupt, SystemExit, GeneratorExit)):
+            inc("stage_errors_total", stage=name)
+        raise
+    finally:
+        observe("stage_seconds", time.monotonic() - start, stage=name)
+
+
+def timed(name):
+    """Decorator: every call of the function is timed as stage `name`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return run
+    return decorate
+
+
+# --- Exposition ---
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name, labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs: return PREFIX + name
+    return PREFIX + name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: list(hist) for key, hist in _histograms.items()}
+    for event, value in run_report.totals().items():
+        name = "event_bytes_total" if event.endswith("bytes") else "events_total"
+        counters[(name, (("event", event),))] = value
+
+    families = {}   # (name, type) -> [(labels, lines)]
+    for (name, labels), value in counters.items():
+        families.setdefault((name, "counter"), []).append((labels, [f"{_series(name, labels)} {_number(value)}"]))
+    for (name, labels), value in gauges.items():
+        try:
+            value = value() if callable(value) else value
+        except Exception:
+            continue
+        families.setdefault((name, "gauge"), []).append((labels, [f"{_series(name, labels)} {_number(value)}"]))
+    for (name, labels), hist in histograms.items():
+        lines, cumulative = [], 0
+        for bound, count in zip(BUCKETS + ("+Inf",), hist[:-1]):
+            cumulative += count
+            lines.append(f"{_series(name + '_bucket', labels, [('le', str(bound))])} {cumulative}")
+        lines.append(f"{_series(name + '_sum', labels)} {_number(hist[-1])}")
+        lines.append(f"{_series(name + '_count', labels)} {cumulative}")
+        families.setdefault((name, "histogram"), []).append((labels, lines))
+
+    out = [f"# TYPE {PREFIX}process_start_time_seconds gauge", f"{PREFIX}process_start_time_seconds {_started:.3f}"]
+    for (name, kind), series in sorted(families.items()):
+        if name in _HELP: out.append(f"# HELP {PREFIX}{name} {_HELP[name]}")
+        out.append(f"# TYPE {PREFIX}{name} {kind}")
+        for _, lines in sorted(series): out.extend(lines)
+    return "\n".join(out) + "\n"
+
+
+def dump(path):
+    """Write render() to `path` (atomically)."""
+    temp = path + ".tmp"
+    with open(temp, 'w', encoding='utf-8') as f:
+        f.write(render())
+    os.replace(temp, path)
+
+
+def _dump_at_exit():
+    try:
+        dump(_dump_path)
+        print(f"[Metrics] Written to {_dump_path}")
+    except OSError as e:
+        print(f"[Metrics] Could not write {_dump_path}: {e}")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start(port=None, path=None):
+    """
+    Serve /metrics on 127.0.0.1:port and/or dump to `path` at exit. Both default to the
+    JAVCOVER_METRICS_PORT / JAVCOVER_METRICS_FILE environment variables; nothing happens
+    when neither is set. Safe to call more than once (the first server/path wins).
+    """
+    global _server, _dump_path
+    port = port if port is not None else os.environ.get(PORT_ENV)
+    path = path or os.environ.get(FILE_ENV)
+    with _lock:
+        if path and _dump_path is None:
+            _dump_path = os.path.abspath(path)
+            atexit.register(_dump_at_exit)
+        if port not in (None, "") and _server is None:
+            try:
+                _server = ThreadingHTTPServer(("127.0.0.1", int(port)), _Handler)
+            except (OSError, ValueError) as e:
+                print(f"[Metrics] Could not listen on port {port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"[Metrics] Serving http://127.0.0.1:{_server.server_address[1]}/metrics")
+    return _server.server_address[1] if _server else None
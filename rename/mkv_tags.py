@@ -0,0 +1,418 @@
+"""
+Cover embedding for Matroska (MKV) files, edited at the EBML level.
+
+The cover becomes an attachment named cover.jpg (the name Matroska players
+and media servers look for). Only the Attachments element, the SeekHead
+entry that points to it and, if the file grows, the Segment size are
+rewritten; the clusters (the actual video) are never read or moved:
+
+  1. existing Attachments (plus any Void after it) has room -> rewritten in place;
+  2. a Void element before the first Cluster has room      -> written there;
+  3. the Segment ends the file                             -> appended at the end.
+
+The old Attachments element is turned into a Void when it moved. Each write
+is staged in a sidecar and journaled like mp4_tags' in-place edits, so an
+interrupted write is finished by batch_journal.recover(). Layouts none of
+the three cases fit (e.g. no room for the SeekHead entry) raise
+UnsupportedLayout; embed_cover() then uses mkvpropedit when it is installed.
+
+Other attachments (fonts etc.) are kept as they are.
+"""
+
+import os
+import shutil
+import tempfile
+
+from io_scheduler import io_slot, temp_path_for
+from mp4_tags import UnsupportedLayout, finish_copy_back, TEMP_SUFFIX
+import batch_journal
+import job_control
+import run_report
+
+EXTENSIONS = (".mkv",)
+COVER_NAME = "cover.jpg"
+COVER_MIME = "image/jpeg"
+CHUNK_SIZE = 1024 * 1024
+
+# Element IDs (with their length marker bits, as stored)
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEKHEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+CLUSTER = 0x1F43B675
+VOID = 0xEC
+ATTACHMENTS = 0x1941A469
+ATTACHED_FILE = 0x61A7
+FILE_NAME = 0x466E
+FILE_MIME = 0x4660
+FILE_DATA = 0x465C
+FILE_UID = 0x46AE
+
+
+# --- EBML primitives ---
+
+def _read_vint(f, keep_marker=False):
+    """(value, length, unknown) of the variable-length integer at the current position."""
+    first = f.read(1)
+    if not first: raise UnsupportedLayout("unexpected end of file")
+    length = 9 - first[0].bit_length()
+    if length > 8: raise UnsupportedLayout("invalid EBML length")
+    rest = f.read(length - 1)
+    if len(rest) != length - 1: raise UnsupportedLayout("unexpected end of file")
+    value = first[0] if keep_marker else first[0] & ((1 << (8 - length)) - 1)
+    for byte in rest: value = (value << 8) | byte
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, length, unknown
+
+
+def _vint(value, width=None):
+    """Encode a size as an EBML vint (minimal width unless `width` is given)."""
+    if width is None:
+        width = 1
+        while value >= (1 << (7 * width)) - 1: width += 1
+    if width > 8 or value >= (1 << (7 * width)) - 1: raise UnsupportedLayout("value too large for its size field")
+    return ((1 << (7 * width)) | value).to_bytes(width, 'big')
+
+
+def _id_bytes(element_id):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+
+
+def _element(element_id, payload):
+    return _id_bytes(element_id) + _vint(len(payload)) + payload
+
+
+def _uint(value):
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big')
+
+
+def _void(total):
+    """Header of a Void element spanning `total` (>= 2) bytes; its payload is left as it is."""
+    for width in range(1, 9):
+        payload = total - 1 - width
+        if 0 <= payload < (1 << (7 * width)) - 1: return bytes([VOID]) + _vint(payload, width)
+    raise UnsupportedLayout(f"cannot fill {total} byte(s) with a Void element")
+
+
+class _Elem:
+    def __init__(self, element_id, offset, header_size, size):
+        self.id, self.offset, self.header_size, self.size = element_id, offset, header_size, size
+
+    @property
+    def data(self): return self.offset + self.header_size
+
+    @property
+    def end(self): return self.data + self.size
+
+
+def _read_header(f, offset, limit):
+    f.seek(offset)
+    element_id, id_length, _ = _read_vint(f, keep_marker=True)
+    size, size_length, unknown = _read_vint(f)
+    header_size = id_length + size_length
+    return _Elem(element_id, offset, header_size, (limit - offset - header_size) if unknown else size), unknown
+
+
+def _children(f, start, end):
+    offset = start
+    while offset < end:
+        elem, unknown = _read_header(f, offset, end)
+        if elem.end > end: raise UnsupportedLayout("element runs past its parent")
+        yield elem
+        if unknown: return
+        offset = elem.end
+
+
+# --- Layout ---
+
+class _Layout:
+    """Top-level elements of the Segment that matter here (clusters are skipped, not read)."""
+    def __init__(self, f):
+        self.file_size = f.seek(0, 2)
+        header, _ = _read_header(f, 0, self.file_size)
+        if header.id != EBML: raise UnsupportedLayout("not a Matroska file")
+        segment, self.unknown_size = _read_header(f, header.end, self.file_size)
+        if segment.id != SEGMENT: raise UnsupportedLayout("no Segment")
+        self.segment = segment
+        self.segment_size_width = segment.header_size - 4
+        self.first_cluster = None
+        self.elements = []
+        offset = segment.data
+        while offset < segment.end:
+            elem, unknown = _read_header(f, offset, segment.end)
+            if elem.id == CLUSTER:
+                self.first_cluster = offset
+                break
+            self.elements.append(elem)
+            if unknown: break
+            offset = elem.end
+        self.seekhead = next((e for e in self.elements if e.id == SEEKHEAD), None)
+        self.seeks = self._read_seeks(f) if self.seekhead else []
+        # Elements after the clusters are only reachable through the SeekHead
+        known = {e.offset for e in self.elements}
+        for element_id, position, _, _ in self.seeks:
+            offset = segment.data + position
+            if offset in known or offset >= segment.end: continue
+            elem, _ = _read_header(f, offset, segment.end)
+            if elem.id == element_id:
+                self.elements.append(elem)
+                known.add(offset)
+        self.attachments = next((e for e in self.elements if e.id == ATTACHMENTS), None)
+
+    def _read_seeks(self, f):
+        """[(element id, position, offset of the SeekPosition payload, its width)]."""
+        seeks = []
+        for seek in _children(f, self.seekhead.data, self.seekhead.end):
+            if seek.id != SEEK: continue
+            element_id = position = None
+            for child in _children(f, seek.data, seek.end):
+                f.seek(child.data)
+                payload = f.read(child.size)
+                if child.id == SEEK_ID: element_id = int.from_bytes(payload, 'big')
+                elif child.id == SEEK_POSITION: position, where, width = int.from_bytes(payload, 'big'), child.data, child.size
+            if element_id is not None and position is not None: seeks.append((element_id, position, where, width))
+        return seeks
+
+    def room_after(self, f, elem):
+        """Bytes from elem.offset to the end of the Void elements directly after it."""
+        end = elem.end
+        while end < self.segment.end:
+            nxt, _ = _read_header(f, end, self.segment.end)
+            if nxt.id != VOID: break
+            end = nxt.end
+        return end - elem.offset
+
+    def ends_file(self, end):
+        return end == self.file_size and (self.unknown_size or self.segment.end == self.file_size)
+
+
+def _attached_files(f, attachments):
+    """[(element, name, mime)] of the attachments."""
+    found = []
+    if not attachments: return found
+    for item in _children(f, attachments.data, attachments.end):
+        if item.id != ATTACHED_FILE: continue
+        name = mime = ""
+        for child in _children(f, item.data, item.end):
+            if child.id in (FILE_NAME, FILE_MIME) and child.size < 1024:
+                f.seek(child.data)
+                text = f.read(child.size).decode('utf-8', 'replace')
+                if child.id == FILE_NAME: name = text
+                else: mime = text
+        found.append((item, name, mime))
+    return found
+
+
+def _is_cover(name, mime):
+    return name.lower().startswith("cover.") and mime.lower().startswith("image/")
+
+
+# --- Reading ---
+
+def has_cover(path):
+    """True if the file has a cover.* image attachment (element headers only)."""
+    try:
+        with open(path, 'rb') as f:
+            layout = _Layout(f)
+            return any(_is_cover(name, mime) for _, name, mime in _attached_files(f, layout.attachments))
+    except (OSError, UnsupportedLayout):
+        return False
+
+
+def read_tags(path):
+    """Same shape as mp4_tags.read_tags(); only the cover is stored for MKV files."""
+    return {"title": None, "code": None, "source": None, "fetched": None, "cover": has_cover(path)}
+
+
+def media_range(path):
+    """(start, end) of the clusters, i.e. the bytes that cover edits never touch."""
+    with open(path, 'rb') as f:
+        layout = _Layout(f)
+    start = layout.first_cluster or layout.segment.data
+    # Cues/Tags/Attachments after the clusters (found through the SeekHead) are not media
+    after = [e.offset for e in layout.elements if e.offset > start]
+    return start, min(after + [layout.segment.end])
+
+
+# --- Writing ---
+
+def _part_size(part):
+    return len(part) if isinstance(part, (bytes, bytearray)) else part[2]
+
+
+def _stage(f, sidecar, parts):
+    """Write `parts` (bytes, ("copy", offset, size) of the video, ("file", path, size)) to the sidecar."""
+    with open(sidecar, 'wb') as out:
+        for part in parts:
+            if isinstance(part, (bytes, bytearray)):
+                out.write(part)
+                continue
+            kind, source, size = part
+            src = f if kind == "copy" else open(source, 'rb')
+            try:
+                if kind == "copy": src.seek(source)
+                remaining = size
+                while remaining > 0:
+                    chunk = src.read(min(CHUNK_SIZE, remaining))
+                    if not chunk: raise OSError("source changed while being staged")
+                    out.write(chunk)
+                    remaining -= len(chunk)
+            finally:
+                if src is not f: src.close()
+        out.flush()
+        os.fsync(out.fileno())
+
+
+def _patch(f, path, offset, parts, journal, truncate=None):
+    """Write `parts` at `offset` through a journaled sidecar (finished by recover() if interrupted)."""
+    sidecar = temp_path_for(path, TEMP_SUFFIX)
+    journal.record(path, "tags", "intent", temp=sidecar)
+    try:
+        _stage(f, sidecar, parts)
+    except BaseException:
+        if os.path.exists(sidecar): os.remove(sidecar)
+        journal.record(path, "tags", "failed", temp=sidecar)
+        raise
+    journal.record(path, "tags", "swap", temp=sidecar, tail_offset=offset, truncate=truncate)
+    f.flush()
+    finish_copy_back(sidecar, path, offset, truncate)
+    os.remove(sidecar)
+    journal.record(path, "tags", "done")
+
+
+def _cover_file_parts(cover):
+    """Parts of an AttachedFile element holding `cover` (path or bytes)."""
+    if isinstance(cover, (bytes, bytearray, memoryview)):
+        data_parts, size = [bytes(cover)], len(cover)
+    else:
+        size = os.path.getsize(cover)
+        data_parts = [("file", cover, size)]
+    head = (_element(FILE_NAME, COVER_NAME.encode()) + _element(FILE_MIME, COVER_MIME.encode()) +
+            _id_bytes(FILE_DATA) + _vint(size))
+    uid = _element(FILE_UID, _uint(int.from_bytes(os.urandom(8), 'big') | 1))
+    body = [head] + data_parts + [uid]
+    body_size = len(head) + size + len(uid)
+    return [_id_bytes(ATTACHED_FILE) + _vint(body_size)] + body
+
+
+def _seek_update(f, layout, position, limit):
+    """
+    (offset, bytes) patch pointing the SeekHead's Attachments entry at `position`, or None if
+    impossible. A rebuilt SeekHead may grow into the Voids after it, but not to `limit`.
+    """
+    entry = next((s for s in layout.seeks if s[0] == ATTACHMENTS), None)
+    if entry and position < (1 << (8 * entry[3])):
+        return entry[2], position.to_bytes(entry[3], 'big')
+    if not layout.seekhead: return None
+    # Rebuild the SeekHead with the entry added/widened, inside its own span plus trailing Voids
+    seeks = [(sid, pos) for sid, pos, _, _ in layout.seeks if sid != ATTACHMENTS] + [(ATTACHMENTS, position)]
+    body = b"".join(_element(SEEK, _element(SEEK_ID, _id_bytes(sid)) + _element(SEEK_POSITION, _uint(pos)))
+                    for sid, pos in seeks)
+    data = _id_bytes(SEEKHEAD) + _vint(len(body)) + body
+    room = layout.room_after(f, layout.seekhead)
+    if limit > layout.seekhead.offset: room = min(room, limit - layout.seekhead.offset)
+    if len(data) == room - 1: data = _id_bytes(SEEKHEAD) + _vint(len(body), len(_vint(len(body))) + 1) + body
+    if len(data) > room or room - len(data) == 1: return None
+    if room > len(data): data += _void(room - len(data))
+    return layout.seekhead.offset, data
+
+
+def _plan(f, cover):
+    """List of (offset, parts, truncate) patches, in the order they must be written."""
+    layout = _Layout(f)
+    old = layout.attachments
+    kept = [("copy", item.offset, item.end - item.offset)
+            for item, name, mime in _attached_files(f, old) if not _is_cover(name, mime)]
+    body = kept + _cover_file_parts(cover)
+    body_size = sum(_part_size(p) for p in body)
+
+    def element(room=None):
+        """Attachments element (+ Void filler) for a slot of `room` bytes (None: open-ended)."""
+        header = _id_bytes(ATTACHMENTS) + _vint(body_size)
+        total = len(header) + body_size
+        if room is None or room == total: return [header] + body, total
+        if room == total + 1:
+            # A 1-byte gap cannot hold a Void: spend it on a wider size field instead
+            return [_id_bytes(ATTACHMENTS) + _vint(body_size, len(_vint(body_size)) + 1)] + body, room
+        if room >= total + 2: return [header] + body + [_void(room - total)], room
+        return None, total
+
+    segment_patch = lambda new_end: (
+        None if layout.unknown_size else
+        (layout.segment.offset + 4, [_vint(new_end - layout.segment.data, layout.segment_size_width)], None))
+
+    # 1. In place, growing into following Voids (or past the end of the file)
+    if old:
+        at_end = layout.ends_file(old.end)
+        parts, size = element(None if at_end else layout.room_after(f, old))
+        if parts is not None:
+            if not at_end: return [(old.offset, parts, None)]
+            new_end = old.offset + size
+            patches = [(old.offset, parts, new_end if new_end < layout.file_size else None)]
+            if new_end != old.end: patches.append(segment_patch(new_end))
+            return [p for p in patches if p]
+
+    # 2./3. A new slot: the end of a Void before the first Cluster (the Void shrinks in front of
+    # it, so its header is the last thing written), else the end of the file
+    patches = []
+    for elem in layout.elements:
+        if elem.id != VOID or (layout.first_cluster is not None and elem.offset > layout.first_cluster): continue
+        room = layout.room_after(f, elem)
+        header = _id_bytes(ATTACHMENTS) + _vint(body_size)
+        total = len(header) + body_size
+        if room == total or room == total + 1:
+            parts, _ = element(room)
+            patches = [(elem.offset, parts, None)]
+        elif room >= total + 2:
+            patches = [(elem.offset + room - total, [header] + body, None), (elem.offset, [_void(room - total)], None)]
+        if patches: break
+    if patches:
+        position = patches[0][0]
+    else:
+        if not layout.ends_file(layout.file_size): raise UnsupportedLayout("no room for the attachments")
+        parts, size = element()
+        position = layout.file_size
+        patches = [(position, parts, None), segment_patch(position + size)]
+
+    seek = _seek_update(f, layout, position - layout.segment.data, limit=position)
+    if seek: patches.append((seek[0], [seek[1]], None))
+    elif layout.first_cluster is None or position > layout.first_cluster:
+        # Players find elements behind the clusters only through the SeekHead
+        raise UnsupportedLayout("no room in the SeekHead")
+    if old: patches.append((old.offset, [_void(old.end - old.offset)], None))
+    return [p for p in patches if p]
+
+
+def embed_cover(path, cover, journal=None):
+    """Make `cover` (file path or bytes) the file's cover.jpg attachment, replacing any existing cover."""
+    journal = journal or batch_journal.NULL
+    try:
+        with io_slot(path):
+            with open(path, 'r+b') as f:
+                patches = _plan(f, cover)
+                for offset, parts, truncate in patches:
+                    _patch(f, path, offset, parts, journal, truncate)
+        run_report.add("tags.mkv_in_place")
+    except UnsupportedLayout as e:
+        print(f"    [Cover] {e}: falling back to mkvpropedit.")
+        run_report.add("tags.mkvpropedit_fallback")
+        _mkvpropedit_embed(path, cover)
+
+
+def _mkvpropedit_embed(path, cover):
+    if not shutil.which("mkvpropedit"): raise UnsupportedLayout("mkvpropedit (MKVToolNix) is not installed")
+    temp_dir = None
+    if isinstance(cover, (bytes, bytearray, memoryview)):
+        temp_dir = tempfile.mkdtemp()
+        with open(os.path.join(temp_dir, COVER_NAME), 'wb') as f: f.write(cover)
+        cover = os.path.join(temp_dir, COVER_NAME)
+    try:
+        action = ["--replace-attachment", f"name:{COVER_NAME}:{cover}"] if has_cover(path) else ["--add-attachment", cover]
+        result = job_control.run_process(
+            ["mkvpropedit", path, "--attachment-name", COVER_NAME, "--attachment-mime-type", COVER_MIME] + action,
+            text=True, encoding='utf-8', errors='replace')
+        if result.returncode != 0: raise OSError(f"mkvpropedit failed: {(result.stdout or '').strip()}")
+    finally:
+        if temp_dir: shutil.rmtree(temp_dir, ignore_errors=True)
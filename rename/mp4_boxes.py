@@ -0,0 +1,56 @@
+"""
+Minimal MP4 box (atom) reader.
+
+Only box headers are read (8 or 16 bytes per box), so probing even a
+multi-GB file costs a handful of small reads.
+"""
+
+import os
+import struct
+
+
+def iter_boxes(f, start, end):
+    """
+    Yield (box_type, offset, size, header_size) for boxes in f[start:end].
+    Stops at the first header that is truncated or has an impossible size.
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8: return
+        size, raw_type = struct.unpack('>I4s', header)
+        box_type = raw_type.decode('latin-1')
+        header_size = 8
+        if size == 1:
+            extended = f.read(8)
+            if len(extended) < 8: return
+            size = struct.unpack('>Q', extended)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size: return
+        yield box_type, offset, size, header_size
+        offset += size
+
+
+def top_level_boxes(path):
+    """List of (box_type, offset, size, header_size) for the top level of an MP4 file."""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        return list(iter_boxes(f, 0, file_size))
+
+
+def is_faststart(path):
+    """
+    True if `moov` comes before `mdat` at the top level, i.e. the file is
+    already streamable. The exact offset of `moov` does not matter (a longer
+    `ftyp`, a `free` box or other boxes before it are all fine).
+    """
+    try:
+        for box_type, _, _, _ in top_level_boxes(path):
+            if box_type == 'moov': return True
+            if box_type == 'mdat': return False
+    except OSError:
+        pass
+    return False
@@ -0,0 +1,237 @@
+"""
+In-place faststart: move `moov` in front of `mdat` inside the file itself.
+
+ffmpeg -movflags +faststart writes a complete second copy of the video and
+swaps it in, so a multi-GB file needs its own size in free space (and drops
+the embedded cover). Here the boxes between `ftyp` and `moov` are shifted
+towards the end of the same file in CHUNK_SIZE block moves, back to front,
+and the `moov` (chunk offsets patched by the shift) is written into the gap:
+
+    [ftyp][mdat ........][moov]   ->   [ftyp][moov][free][mdat ........]
+
+The shift is max(moov size, MIN_SHIFT) when there is room (capped at 1% of
+the moved data; the `free` after moov is padding that later tag edits can use
+in place), else exactly what moov and trailing free boxes occupied. Extra disk space is the moov-sized sidecar plus at most
+MIN_SHIFT, whatever the size of the video.
+
+Crash safety: before anything moves, the original moov and the plan are
+written to <video>.faststart.moov and the step is journaled. The sidecar
+header records how far the move has got (at least every `shift` bytes, after
+an fsync of the video), and a chunk never overwrites source bytes that an
+unrecorded chunk still needs, so an interrupted move is finished (rolled
+forward) from the sidecar by batch_journal.recover() or by the next
+faststart of the same file (or sweep_temp_files for a sidecar without a
+journal). The move itself is not cancellable. A moved file that fails
+mp4_verify keeps its sidecar, marked failed, and is left alone from then on.
+
+Layouts this does not handle (no leading ftyp, fragmented files, data after
+moov, sample-aux offsets, 32-bit chunk offsets that would overflow) raise
+UnsupportedLayout; callers fall back to ffmpeg.
+"""
+
+import os
+import io
+import json
+import struct
+import shutil
+
+from mp4_boxes import iter_boxes
+from mp4_tags import UnsupportedLayout
+from io_scheduler import io_slot, temp_path_for
+import batch_journal
+import mp4_verify
+import run_report
+
+SIDECAR_SUFFIX = batch_journal.INPLACE_SIDECAR_SUFFIX
+CHUNK_SIZE = 4 * 1024 * 1024
+# Preferred shift (the moov plus `free` padding up to this size, at most 1/PADDING_RATIO of the data).
+# A larger shift means larger chunks and fewer fsyncs of the progress record.
+MIN_SHIFT = 8 * 1024 * 1024
+PADDING_RATIO = 100
+# Free space kept untouched on the volume (bytes)
+SPACE_MARGIN = 16 * 1024 * 1024
+_SIDECAR_HEADER = 4096
+_CONTAINERS = ('trak', 'mdia', 'minf', 'stbl')
+
+
+def _layout(f, file_size):
+    """(ftyp_end, moov_offset, moov_size) of a file whose moov comes after its media data."""
+    boxes = list(iter_boxes(f, 0, file_size))
+    if not boxes or boxes[-1][1] + boxes[-1][2] != file_size:
+        raise UnsupportedLayout("file does not end on a box boundary")
+    names = [box[0] for box in boxes]
+    if names[0] != 'ftyp': raise UnsupportedLayout("no leading ftyp box")
+    if 'moof' in names: raise UnsupportedLayout("fragmented MP4")
+    if names.count('moov') != 1: raise UnsupportedLayout("expected exactly one moov box")
+    index = names.index('moov')
+    if 'mdat' not in names[:index]: raise UnsupportedLayout("moov is already before mdat")
+    if any(name not in ('free', 'skip') for name in names[index + 1:]):
+        raise UnsupportedLayout("data after moov")
+    moov = boxes[index]
+    if moov[3] != 8: raise UnsupportedLayout("64-bit moov header")
+    return boxes[0][2], moov[1], moov[2]
+
+
+def _patched_moov(moov, threshold, delta):
+    """Copy of the moov bytes with every chunk offset >= threshold shifted by delta."""
+    out = bytearray(moov)
+    f = io.BytesIO(moov)
+
+    def walk(start, end):
+        for name, offset, size, header_size in iter_boxes(f, start, end):
+            if name in _CONTAINERS:
+                walk(offset + header_size, offset + size)
+            elif name == 'saio':
+                raise UnsupportedLayout("sample auxiliary offsets (saio)")
+            elif name in ('stco', 'co64'):
+                width, code = (4, 'I') if name == 'stco' else (8, 'Q')
+                count = struct.unpack_from('>I', moov, offset + header_size + 4)[0]
+                first = offset + header_size + 8
+                if first + count * width > offset + size: raise UnsupportedLayout(f"truncated {name}")
+                values = [v + delta if v >= threshold else v
+                          for v in struct.unpack_from(f'>{count}{code}', moov, first)]
+                if values and width == 4 and max(values) > 0xFFFFFFFF:
+                    raise UnsupportedLayout("chunk offsets would overflow 32 bits")
+                struct.pack_into(f'>{count}{code}', out, first, *values)
+
+    header_size = 8
+    walk(header_size, len(moov))
+    return bytes(out)
+
+
+def _choose_shift(path, file_size, ftyp_end, moov_offset, moov_size):
+    """Shift for the moved region: moov + padding if the volume has room, else just what moov frees."""
+    available = file_size - moov_offset   # moov plus trailing free boxes
+    try:
+        free_space = shutil.disk_usage(os.path.dirname(os.path.abspath(path))).free
+    except OSError:
+        free_space = 0
+    # Padding stays in the file, so small files only get a proportional amount
+    shift = max(moov_size, min(MIN_SHIFT, (moov_offset - ftyp_end) // PADDING_RATIO))
+    if shift - available + moov_size + SPACE_MARGIN > free_space:
+        shift = available if available - moov_size >= 8 else moov_size
+        if moov_size + SPACE_MARGIN > free_space:
+            raise OSError("not enough free space for the moov sidecar")
+    if 0 < shift - moov_size < 8: shift = moov_size + 8
+    return shift
+
+
+def _write_header(side, plan):
+    data = json.dumps(plan).encode('utf-8')
+    if len(data) >= _SIDECAR_HEADER: raise ValueError("sidecar header too large")
+    side.seek(0)
+    side.write(data + b" " * (_SIDECAR_HEADER - 1 - len(data)) + b"\n")
+    side.flush()
+    os.fsync(side.fileno())
+
+
+def _read_sidecar(sidecar):
+    with open(sidecar, 'rb') as side:
+        plan = json.loads(side.read(_SIDECAR_HEADER).decode('utf-8'))
+        moov = side.read()
+    if len(moov) != plan["moov_size"]: raise OSError(f"incomplete sidecar {sidecar}")
+    return plan, moov
+
+
+def _run(f, side, plan, moov):
+    """Move (or keep moving) the region back to front, then write moov + free at the front."""
+    start_limit, shift = plan["ftyp_end"], plan["shift"]
+    chunk = min(CHUNK_SIZE, shift)
+    # Unrecorded progress must stay <= shift, so a redo never reads bytes a moved chunk overwrote
+    record_every = max(1, shift // chunk)
+    pos = plan["moved_to"]
+    moved = 0
+    while pos > start_limit:
+        start = max(start_limit, pos - chunk)
+        f.seek(start)
+        data = f.read(pos - start)
+        if len(data) != pos - start: raise OSError("unexpected end of file while moving")
+        f.seek(start + shift)
+        f.write(data)
+        pos = start
+        moved += 1
+        if moved % record_every == 0 or pos == start_limit:
+            f.flush()
+            os.fsync(f.fileno())
+            plan["moved_to"] = pos
+            _write_header(side, plan)
+
+    f.seek(start_limit)
+    f.write(_patched_moov(moov, start_limit, shift))
+    padding = shift - plan["moov_size"]
+    if padding:
+        f.write(struct.pack('>I4s', padding, b'free'))
+        f.write(bytes(padding - 8))
+    f.truncate(plan["moov_offset"] + shift)
+    f.flush()
+    os.fsync(f.fileno())
+    plan["state"] = "done"
+    _write_header(side, plan)
+
+
+def resume(path, sidecar):
+    """Finish an interrupted in-place faststart from its sidecar, then remove the sidecar."""
+    plan, moov = _read_sidecar(sidecar)
+    if plan.get("state") == "failed":
+        raise OSError(f"{os.path.basename(path)} failed verification after an in-place move; "
+                      f"the original moov is kept in {os.path.basename(sidecar)}")
+    if plan.get("state") != "done":
+        with open(path, 'r+b') as f, open(sidecar, 'r+b') as side:
+            _run(f, side, plan, moov)
+        print(f"    [Faststart] Finished interrupted in-place move of {os.path.basename(path)}")
+    os.remove(sidecar)
+
+
+def faststart_inplace(path, journal=None):
+    """
+    Move moov to the front of `path` without a second copy of the file. Returns True.
+    Raises UnsupportedLayout (nothing changed) when the file needs ffmpeg instead,
+    OSError when the move failed (finished later from the sidecar if it had started).
+    """
+    journal = journal or batch_journal.NULL
+    sidecar = temp_path_for(path, SIDECAR_SUFFIX)
+    with io_slot(path):
+        if os.path.exists(sidecar):
+            # An earlier run was interrupted mid-move: finish it first
+            resume(path, sidecar)
+            return True
+
+        with open(path, 'r+b') as f:
+            file_size = f.seek(0, 2)
+            ftyp_end, moov_offset, moov_size = _layout(f, file_size)
+            f.seek(moov_offset)
+            moov = f.read(moov_size)
+            shift = _choose_shift(path, file_size, ftyp_end, moov_offset, moov_size)
+            # Fails here, before anything is written, for offsets that would not fit
+            _patched_moov(moov, ftyp_end, shift)
+            before = mp4_verify.fingerprint(path)
+
+            plan = {"version": 1, "ftyp_end": ftyp_end, "moov_offset": moov_offset, "moov_size": moov_size,
+                    "shift": shift, "moved_to": moov_offset, "state": "moving"}
+            with open(sidecar, 'w+b') as side:
+                _write_header(side, plan)
+                side.seek(_SIDECAR_HEADER)
+                side.write(moov)
+                side.flush()
+                os.fsync(side.fileno())
+                journal.record(path, "faststart", "intent", inplace=sidecar)
+                try:
+                    _run(f, side, plan, moov)
+                except BaseException as e:
+                    print(f"    [Faststart] In-place move interrupted ({e}); "
+                          f"it is finished from {os.path.basename(sidecar)} on the next run.")
+                    raise
+        problems = mp4_verify.verify(path, source=before)
+        if problems:
+            # Keep the sidecar (the original moov) and stop later runs from treating the move as finished
+            plan["state"] = "failed"
+            with open(sidecar, 'r+b') as side:
+                _write_header(side, plan)
+            journal.record(path, "faststart", "failed", inplace=sidecar)
+            raise OSError(f"moved file failed verification: {'; '.join(problems)} "
+                          f"(original moov kept in {os.path.basename(sidecar)})")
+        os.remove(sidecar)
+        journal.record(path, "faststart", "done")
+    run_report.add("faststart.in_place")
+    run_report.add("faststart.moved_bytes", moov_offset - ftyp_end)
+    return True
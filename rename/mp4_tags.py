@@ -0,0 +1,506 @@
+"""
+Streaming writer for iTunes-style tags (moov/udta/meta/ilst).
+
+mutagen loads the tag atoms and the cover into memory, and when the tags
+grow it moves the rest of the file through Python buffers. Here an item
+such as `covr` is copied into its box straight from a file (or a
+memoryview) in CHUNK_SIZE pieces. Only the sizes of the enclosing boxes
+change, and chunk offsets (stco/co64) are patched while streaming, so each
+job uses about CHUNK_SIZE of memory whatever the size of the video or cover.
+
+How much of the file gets rewritten:
+  * if the size change fits in the `free` padding after ilst (or after moov),
+    only the edited byte range is rewritten, in place;
+  * if moov is the last box (not faststart), the tail from the first edit
+    onwards is rewritten in place and nothing else moves;
+  * otherwise the file is streamed to a temp file next to it. PADDING bytes
+    of `free` are left after ilst so that the next edit fits in place.
+
+In-place rewrites are staged in a sidecar file and journaled first, so
+batch_journal.recover() can finish a copy-back that was interrupted.
+Cancelling the job (job_control) stops the rewrite while the temp/sidecar
+is being written; the copy-back itself is never interrupted.
+Besides `covr`, the title (©nam) and our own freeform tags (code, metadata
+source, fetch time) are written in the same pass, and read_tags() reads
+them back cheaply so the scanner can tell exactly which files are done.
+
+Layouts this writer does not handle (fragmented MP4, 32-bit chunk offsets
+that would overflow) raise UnsupportedLayout; embed_cover() then falls back
+to mutagen.
+"""
+
+import os
+import struct
+import time
+import datetime
+
+from mp4_boxes import iter_boxes
+from io_scheduler import io_slot, temp_path_for
+import batch_journal
+import run_report
+import job_control
+
+CHUNK_SIZE = 1024 * 1024
+# `free` bytes left after ilst whenever the whole file has to be rewritten anyway
+PADDING = 64 * 1024
+TEMP_SUFFIX = ".tags.tmp"
+
+# meta/hdlr payload as written by iTunes (and mutagen)
+_MDIR_HDLR = b"\x00" * 8 + b"mdirappl" + b"\x00" * 9
+_ZEROS = bytes(64 * 1024)
+
+# Freeform ("----") tags: com.apple.iTunes:<NAME>, as mutagen and most taggers write them
+FREEFORM_MEAN = "com.apple.iTunes"
+CODE_TAG = "JAVCOVER_CODE"
+SOURCE_TAG = "JAVCOVER_SOURCE"
+FETCHED_TAG = "JAVCOVER_FETCHED"
+# Text items larger than this are not read back (nothing we write comes close)
+_MAX_TEXT_ITEM = 64 * 1024
+
+
+class UnsupportedLayout(Exception):
+    """The file is valid MP4, but not a layout the streaming writer edits."""
+
+
+def _header(name, size):
+    if size > 0xFFFFFFFF: raise UnsupportedLayout(f"'{name}' box larger than 4 GB")
+    return struct.pack('>I4s', size, name.encode('latin-1'))
+
+
+def _resized_header(box, new_size):
+    name, _, _, header_size = box
+    if header_size == 16: return struct.pack('>I4sQ', 1, name.encode('latin-1'), new_size)
+    return _header(name, new_size)
+
+
+def _children(f, box, skip=0):
+    """Child boxes of `box`; `skip` jumps version/flags of full boxes such as meta."""
+    name, offset, size, header_size = box
+    return iter_boxes(f, offset + header_size + skip, offset + size)
+
+
+def _child(f, box, name, skip=0):
+    for child in _children(f, box, skip):
+        if child[0] == name: return child
+    return None
+
+
+def _free(size):
+    """Parts of a `free` box of `size` bytes."""
+    return [_header("free", size), ("zeros", size - 8)]
+
+
+def item(name, payload_parts, payload_size):
+    """(key, parts, size) of an ilst item box wrapping already-encoded `data` boxes."""
+    size = 8 + payload_size
+    return name, [_header(name, size)] + list(payload_parts), size
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _data_box(type_code, payload):
+    return [struct.pack('>I4sII', 16 + len(payload), b"data", type_code, 0), payload], 16 + len(payload)
+
+
+def text_item(name, text):
+    """UTF-8 text item such as ©nam."""
+    parts, size = _data_box(1, text.encode('utf-8'))
+    return item(name, parts, size)
+
+
+def freeform_item(name, text, mean=FREEFORM_MEAN):
+    """Freeform `----` item; its key is "----:<mean>:<name>" so only that tag is replaced."""
+    parts, size = [], 0
+    for box_name, value in (("mean", mean), ("name", name)):
+        value = value.encode('utf-8')
+        parts += [_header(box_name, 12 + len(value)), b"\x00" * 4, value]
+        size += 12 + len(value)
+    data_parts, data_size = _data_box(1, text.encode('utf-8'))
+    _, parts, size = item("----", parts + data_parts, size + data_size)
+    return f"----:{mean}:{name}", parts, size
+
+
+def metadata_items(title=None, code=None, source=None, fetched=None):
+    """Items for the title and our freeform tags; `fetched` defaults to now (UTC, ISO 8601)."""
+    items = []
+    if title: items.append(text_item("\xa9nam", title))
+    if code: items.append(freeform_item(CODE_TAG, code))
+    if source:
+        items.append(freeform_item(SOURCE_TAG, source))
+        if fetched is None: fetched = _now()
+        items.append(freeform_item(FETCHED_TAG, fetched))
+    return items
+
+
+def cover_item(cover):
+    """ilst `covr` item for a cover given as a file path or bytes/memoryview (never read whole)."""
+    if isinstance(cover, (str, os.PathLike)):
+        length = os.path.getsize(cover)
+        with open(cover, 'rb') as f:
+            magic = f.read(8)
+        source = ("file", os.fspath(cover), length)
+    else:
+        source = memoryview(cover).cast('B')
+        length = source.nbytes
+        magic = bytes(source[:8])
+    image_format = 14 if magic.startswith(b"\x89PNG") else 13  # PNG / JPEG
+    data = struct.pack('>I4sII', 16 + length, b"data", image_format, 0)
+    return item("covr", [data, source], 16 + length)
+
+
+# --- Rendering: source file + edits -> output stream ---
+
+def _copy_range(src, out, start, end):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        job_control.check_cancelled()
+        chunk = src.read(min(CHUNK_SIZE, remaining))
+        if not chunk: raise OSError("unexpected end of file")
+        out.write(chunk)
+        remaining -= len(chunk)
+
+
+def _patch_offsets(src, out, start, length, width, threshold, delta):
+    """Copy a stco/co64 entry table, shifting offsets >= threshold by delta."""
+    code, limit = ('I', 0xFFFFFFFF) if width == 4 else ('Q', 0xFFFFFFFFFFFFFFFF)
+    step = CHUNK_SIZE // width * width
+    src.seek(start)
+    remaining = length
+    while remaining > 0:
+        chunk = src.read(min(step, remaining))
+        if len(chunk) < min(step, remaining) or len(chunk) % width: raise OSError("truncated chunk offset table")
+        values = [v + delta if v >= threshold else v
+                  for v in struct.unpack(f'>{len(chunk) // width}{code}', chunk)]
+        if values and max(values) > limit:
+            raise UnsupportedLayout("chunk offsets would overflow 32 bits")
+        out.write(struct.pack(f'>{len(values)}{code}', *values))
+        remaining -= len(chunk)
+
+
+def _write_part(src, out, part):
+    if not isinstance(part, tuple):
+        out.write(part)
+    elif part[0] == "file":
+        with open(part[1], 'rb') as f:
+            remaining = part[2]
+            while remaining > 0:
+                job_control.check_cancelled()
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk: raise OSError(f"{part[1]} changed while being written")
+                out.write(chunk)
+                remaining -= len(chunk)
+    elif part[0] == "zeros":
+        remaining = part[1]
+        while remaining > 0:
+            out.write(_ZEROS[:min(len(_ZEROS), remaining)])
+            remaining -= len(_ZEROS)
+    elif part[0] == "patch":
+        _patch_offsets(src, out, *part[1:])
+
+
+def _part_size(part):
+    if not isinstance(part, tuple): return memoryview(part).nbytes
+    if part[0] == "zeros": return part[1]
+    return part[2]
+
+
+def _render(src, out, edits, start, end):
+    """Write src[start:end] with `edits` ((start, end, parts), sorted, inside the range) applied."""
+    pos = start
+    for edit_start, edit_end, parts in edits:
+        _copy_range(src, out, pos, edit_start)
+        for part in parts: _write_part(src, out, part)
+        pos = edit_end
+    _copy_range(src, out, pos, end)
+
+
+def _copy_back(sidecar, target, offset, truncate):
+    """Copy a staged sidecar into `target` at `offset` (an open r+b file)."""
+    with open(sidecar, 'rb') as f:
+        target.seek(offset)
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk: break
+            target.write(chunk)
+    if truncate is not None: target.truncate(truncate)
+    target.flush()
+    os.fsync(target.fileno())
+
+
+def finish_copy_back(sidecar, target_path, offset, truncate=None):
+    """Redo an interrupted in-place rewrite (used by batch_journal.recover)."""
+    with open(target_path, 'r+b') as target:
+        _copy_back(sidecar, target, offset, truncate)
+
+
+# --- Planning ---
+
+def _plan(f, file_size, items):
+    """
+    Work out the edits that put `items` into ilst (replacing items with the same names).
+    Returns (edits, file_delta, in_place_end) where in_place_end is the source offset up
+    to which an in-place rewrite must go, or None if the whole file has to be rewritten.
+    """
+    top = list(iter_boxes(f, 0, file_size))
+    if any(box[0] == 'moof' for box in top): raise UnsupportedLayout("fragmented MP4")
+    moov_index = next((i for i, box in enumerate(top) if box[0] == 'moov'), None)
+    if moov_index is None: raise UnsupportedLayout("no moov box")
+    moov = top[moov_index]
+    moov_end = moov[1] + moov[2]
+    if top[-1][1] + top[-1][2] != file_size: raise UnsupportedLayout("trailing data after the last box")
+    after = top[moov_index + 1:]
+    data_after = any(box[0] not in ('free', 'skip') for box in after)
+    top_free = after[0] if after and after[0][0] == 'free' else None
+
+    udta = _child(f, moov, 'udta')
+    meta = udta and _child(f, udta, 'meta')
+    ilst = meta and _child(f, meta, 'ilst', skip=4)
+    if meta and not ilst and not any(True for _ in _children(f, meta, skip=4)):
+        raise UnsupportedLayout("unrecognized meta box")
+
+    keys = {key for key, _, _ in items}
+    item_parts = [part for _, parts, _ in items for part in parts]
+    item_size = sum(size for _, _, size in items)
+
+    edits = []
+    pad_free = None
+    if ilst:
+        ilst_end = ilst[1] + ilst[2]
+        removed = [child for child in _children(f, ilst) if _item_key(f, child) in keys]
+        edits += [(child[1], child[1] + child[2], []) for child in removed]
+        ilst_delta = item_size - sum(child[2] for child in removed)
+        siblings = list(_children(f, meta, skip=4))
+        position = next(i for i, child in enumerate(siblings) if child[1] == ilst[1])
+        if position + 1 < len(siblings) and siblings[position + 1][0] == 'free':
+            pad_free = siblings[position + 1]
+        insert_at, chain = ilst_end, [moov, udta, meta]
+    else:
+        ilst_delta = 0
+        insert_at_box = meta or udta or moov
+        insert_at = insert_at_box[1] + insert_at_box[2]
+        chain = [box for box in (moov, udta, meta) if box]
+
+    def created(pad):
+        """Inserted bytes for the missing containers (ilst + optional free), innermost first."""
+        parts = [_header("ilst", 8 + item_size)] + item_parts
+        size = 8 + item_size
+        if pad:
+            parts += _free(pad)
+            size += pad
+        if not meta:
+            hdlr = [_header("hdlr", 8 + len(_MDIR_HDLR)), _MDIR_HDLR]
+            size += 12 + 8 + len(_MDIR_HDLR)
+            parts = [_header("meta", size), b"\x00" * 4] + hdlr + parts
+        if not udta:
+            size += 8
+            parts = [_header("udta", size)] + parts
+        return parts, size
+
+    inner = ilst_delta if ilst else created(0)[1]
+    pad, resize = 0, None
+    if data_after and inner:
+        # Chunk data follows moov: absorb the size change in padding if possible
+        if pad_free and pad_free[2] - inner >= 8:
+            resize, inner = (pad_free, pad_free[2] - inner), 0
+        elif top_free and top_free[2] - inner >= 8:
+            resize = (top_free, top_free[2] - inner)
+        elif ilst and inner <= -8:
+            pad, inner = -inner, 0
+        elif pad_free:
+            # The whole file moves anyway: reset the existing padding to PADDING
+            resize, inner = (pad_free, PADDING), inner + PADDING - pad_free[2]
+        else:
+            pad = PADDING
+            inner += PADDING
+
+    if ilst:
+        parts = item_parts + (_free(pad) if pad else [])
+        edits.append((insert_at, insert_at, parts))
+        edits.append((ilst[1], ilst[1] + ilst[3], [_resized_header(ilst, ilst[2] + ilst_delta)]))
+        inner_shift = inner
+    else:
+        parts, size = created(pad)
+        edits.append((insert_at, insert_at, parts))
+        inner_shift = size
+    if resize:
+        box, new_size = resize
+        edits.append((box[1], box[1] + box[2], _free(new_size)))
+    if inner_shift:
+        for box in chain:
+            edits.append((box[1], box[1] + box[3], [_resized_header(box, box[2] + inner_shift)]))
+
+    delta = sum(sum(_part_size(p) for p in parts) - (end - start) for start, end, parts in edits)
+    if delta == 0:
+        in_place_end = max(end for _, end, _ in edits)
+    elif not data_after:
+        in_place_end = file_size
+    else:
+        in_place_end = None
+        # Everything after moov moves by delta: patch the chunk offsets that point there
+        for trak in _children(f, moov):
+            if trak[0] != 'trak': continue
+            stbl = trak
+            for name in ('mdia', 'minf', 'stbl'):
+                stbl = stbl and _child(f, stbl, name)
+            if not stbl: continue
+            for table in _children(f, stbl):
+                if table[0] not in ('stco', 'co64'): continue
+                width = 4 if table[0] == 'stco' else 8
+                f.seek(table[1] + table[3] + 4)
+                count = struct.unpack('>I', f.read(4))[0]
+                start = table[1] + table[3] + 8
+                edits.append((start, start + count * width, [("patch", start, count * width, width, moov_end, delta)]))
+
+    edits.sort(key=lambda edit: (edit[0], edit[1]))
+    return edits, delta, in_place_end
+
+
+def write_items(path, items, journal=None):
+    """
+    Put `items` (from cover_item()/text_item()/freeform_item()) into the file's ilst in
+    one pass, replacing existing items with the same keys. Raises UnsupportedLayout for layouts it does not edit.
+    """
+    journal = journal or batch_journal.NULL
+    temp = temp_path_for(path, TEMP_SUFFIX)
+    with io_slot(path):
+        with open(path, 'r+b') as f:
+            file_size = f.seek(0, 2)
+            edits, delta, in_place_end = _plan(f, file_size, items)
+            journal.record(path, "tags", "intent", temp=temp)
+            if in_place_end is not None:
+                start = edits[0][0]
+                try:
+                    with open(temp, 'wb') as out:
+                        _render(f, out, edits, start, in_place_end)
+                        out.flush()
+                        os.fsync(out.fileno())
+                except BaseException:
+                    if os.path.exists(temp): os.remove(temp)
+                    journal.record(path, "tags", "failed", temp=temp)
+                    raise
+                truncate = file_size + delta if delta else None
+                # From here on the sidecar is the only complete copy of the tail: keep it until written back
+                journal.record(path, "tags", "swap", temp=temp, tail_offset=start, truncate=truncate)
+                _copy_back(temp, f, start, truncate)
+                os.remove(temp)
+                journal.record(path, "tags", "done")
+                run_report.add("tags.in_place")
+                run_report.add("tags.rewritten_bytes", in_place_end - start + delta)
+                return
+            try:
+                with open(temp, 'wb') as out:
+                    _render(f, out, edits, 0, file_size)
+                    out.flush()
+                    os.fsync(out.fileno())
+            except BaseException:
+                if os.path.exists(temp): os.remove(temp)
+                journal.record(path, "tags", "failed", temp=temp)
+                raise
+
+        journal.record(path, "tags", "swap", temp=temp)
+        for attempt in range(5):
+            try:
+                os.replace(temp, path)
+                break
+            except PermissionError:
+                if attempt == 4:
+                    os.remove(temp)
+                    journal.record(path, "tags", "failed", temp=temp)
+                    raise
+                time.sleep((attempt + 1) * 2)
+        journal.record(path, "tags", "done")
+        run_report.add("tags.full_rewrite")
+        run_report.add("tags.rewritten_bytes", file_size + delta)
+
+
+# --- Reading ---
+
+def _item_key(f, child):
+    """Key of an ilst child: its box type, or "----:<mean>:<name>" for freeform items."""
+    if child[0] != '----': return child[0]
+    fields = {}
+    for box in _children(f, child):
+        if box[0] in ('mean', 'name') and box[2] <= 1024:
+            f.seek(box[1] + box[3] + 4)
+            fields[box[0]] = f.read(box[2] - box[3] - 4).decode('utf-8', 'replace')
+    return f"----:{fields.get('mean', '')}:{fields.get('name', '')}"
+
+
+def _read_text(f, child):
+    """UTF-8 payload of the first `data` box of an item (None if not a small text item)."""
+    for box in _children(f, child):
+        if box[0] == 'data' and box[2] <= _MAX_TEXT_ITEM:
+            f.seek(box[1] + box[3] + 8)
+            return f.read(box[2] - box[3] - 8).decode('utf-8', 'replace')
+    return None
+
+
+def _ilst_items(f):
+    file_size = f.seek(0, 2)
+    box = next((b for b in iter_boxes(f, 0, file_size) if b[0] == 'moov'), None)
+    for child, skip in (('udta', 0), ('meta', 0), ('ilst', 4)):
+        box = box and _child(f, box, child, skip)
+    return list(_children(f, box)) if box else []
+
+
+def find_item(path, name):
+    """(offset, size) of the ilst item `name`, reading box headers only; None if absent."""
+    try:
+        with open(path, 'rb') as f:
+            found = next((b for b in _ilst_items(f) if b[0] == name), None)
+            return found and (found[1], found[2])
+    except OSError:
+        return None
+
+
+def read_tags(path):
+    """
+    {"title", "code", "source", "fetched", "cover"} from the file's ilst. Only box headers
+    and the small text items are read (never the cover). Missing tags are None / False.
+    """
+    tags = {"title": None, "code": None, "source": None, "fetched": None, "cover": False}
+    fields = {"\xa9nam": "title", f"----:{FREEFORM_MEAN}:{CODE_TAG}": "code",
+              f"----:{FREEFORM_MEAN}:{SOURCE_TAG}": "source", f"----:{FREEFORM_MEAN}:{FETCHED_TAG}": "fetched"}
+    try:
+        with open(path, 'rb') as f:
+            for child in _ilst_items(f):
+                if child[0] == 'covr':
+                    tags["cover"] = True
+                    continue
+                field = fields.get(_item_key(f, child))
+                if field: tags[field] = _read_text(f, child)
+    except OSError:
+        pass
+    return tags
+
+
+def _mutagen_embed(path, cover, title=None, code=None, source=None):
+    from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+    if isinstance(cover, (str, os.PathLike)):
+        with open(cover, 'rb') as f:
+            cover = f.read()
+    with io_slot(path):
+        video = MP4(path)
+        video["covr"] = [MP4Cover(bytes(cover), imageformat=MP4Cover.FORMAT_JPEG)]
+        if title: video["\xa9nam"] = [title]
+        values = {CODE_TAG: code, SOURCE_TAG: source}
+        if source: values[FETCHED_TAG] = _now()
+        for name, value in values.items():
+            if value: video[f"----:{FREEFORM_MEAN}:{name}"] = [MP4FreeForm(value.encode('utf-8'))]
+        video.save()
+
+
+def embed_cover(path, cover, journal=None, title=None, code=None, source=None):
+    """
+    Make `cover` (file path or bytes/memoryview) the file's only cover image and, in the
+    same write, store the title, code and metadata source (with fetch time) if given.
+    """
+    try:
+        write_items(path, [cover_item(cover)] + metadata_items(title, code, source), journal)
+    except UnsupportedLayout as e:
+        print(f"    [Cover] {e}: falling back to mutagen.")
+        run_report.add("tags.mutagen_fallback")
+        _mutagen_embed(path, cover, title, code, source)
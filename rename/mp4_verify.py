@@ -0,0 +1,244 @@
+"""
+Cheap integrity check of a rewritten MP4, without decoding it.
+
+A remux/tag write used to count as successful when the output existed and
+was non-empty. verify() instead checks, reading only the moov and a few
+sampled media bytes:
+
+  * the top-level boxes tile the file exactly (nothing truncated, one moov)
+    and the moov/trak/stbl boxes are well formed;
+  * every stco/co64 chunk offset points into an mdat, and the sample tables
+    agree with each other (stsc sample total == stsz count);
+  * against the source (a path, or a fingerprint() taken before the write):
+    the same audio/video tracks, sample counts and durations, and identical
+    bytes for SAMPLES samples per track, compared by hash.
+
+    problems = mp4_verify.verify(temp_path, source=video_path)
+    if problems: ...keep the original...
+
+The cost is the size of the moov plus SAMPLES * HASH_BYTES per track, not
+the size of the video.
+"""
+
+import io
+import struct
+import hashlib
+
+from mp4_boxes import iter_boxes
+import run_report
+
+# Samples compared per track (evenly spaced, first and last included)
+SAMPLES = 16
+# Bytes hashed from the start of each sampled sample
+HASH_BYTES = 64 * 1024
+# Allowed track duration difference (seconds); remuxers may round edit lists
+DURATION_TOLERANCE = 0.5
+MEDIA_HANDLERS = ('vide', 'soun')
+_CONTAINERS = ('trak', 'mdia', 'minf', 'stbl')
+
+
+class _Track:
+    def __init__(self):
+        self.handler = None
+        self.timescale = None
+        self.duration = None
+        self.chunk_offsets = None
+        self.stsc = None
+        self.sample_size = 0       # uniform size (0: see sizes)
+        self.sizes = None
+        self.sample_count = None
+
+    @property
+    def seconds(self):
+        return self.duration / self.timescale if self.timescale else None
+
+
+def _tiled(f, start, end):
+    """Boxes of f[start:end] and whether they exactly fill it."""
+    boxes = list(iter_boxes(f, start, end))
+    reached = boxes[-1][1] + boxes[-1][2] if boxes else start
+    return boxes, reached == end
+
+
+def _parse_track(moov, f, trak, problems):
+    track = _Track()
+    name_hint = f"track {trak[1]}"
+
+    def walk(start, end):
+        boxes, ok = _tiled(f, start, end)
+        if not ok: problems.append(f"{name_hint}: malformed box inside {start}-{end} of moov")
+        for name, offset, size, header_size in boxes:
+            body = offset + header_size
+            if name in _CONTAINERS:
+                walk(body, offset + size)
+            elif name == 'mdhd':
+                if moov[body] == 1: track.timescale, track.duration = struct.unpack_from('>IQ', moov, body + 20)
+                else: track.timescale, track.duration = struct.unpack_from('>II', moov, body + 12)
+            elif name == 'hdlr':
+                track.handler = moov[body + 8:body + 12].decode('latin-1')
+            elif name in ('stco', 'co64'):
+                code, width = ('I', 4) if name == 'stco' else ('Q', 8)
+                count = struct.unpack_from('>I', moov, body + 4)[0]
+                if body + 8 + count * width > offset + size:
+                    problems.append(f"{name_hint}: truncated {name}")
+                    continue
+                track.chunk_offsets = struct.unpack_from(f'>{count}{code}', moov, body + 8)
+            elif name == 'stsc':
+                count = struct.unpack_from('>I', moov, body + 4)[0]
+                if body + 8 + count * 12 > offset + size:
+                    problems.append(f"{name_hint}: truncated stsc")
+                    continue
+                flat = struct.unpack_from(f'>{count * 3}I', moov, body + 8)
+                track.stsc = [(flat[i], flat[i + 1]) for i in range(0, len(flat), 3)]
+            elif name == 'stsz':
+                track.sample_size, track.sample_count = struct.unpack_from('>II', moov, body + 4)
+                if track.sample_size == 0:
+                    if body + 12 + track.sample_count * 4 > offset + size:
+                        problems.append(f"{name_hint}: truncated stsz")
+                        continue
+                    track.sizes = struct.unpack_from(f'>{track.sample_count}I', moov, body + 12)
+            elif name == 'stz2':
+                # Compact sizes: counted, but not used for sampling
+                track.sample_count = struct.unpack_from('>I', moov, body + 8)[0]
+
+    walk(trak[1] + trak[3], trak[1] + trak[2])
+    if track.handler: name_hint = f"{track.handler} track"
+    if track.chunk_offsets is None or track.stsc is None or track.sample_count is None:
+        problems.append(f"{name_hint}: missing sample tables")
+    elif track.stsc:
+        total, chunks = 0, len(track.chunk_offsets)
+        for i, (first, per_chunk) in enumerate(track.stsc):
+            last = track.stsc[i + 1][0] if i + 1 < len(track.stsc) else chunks + 1
+            total += max(0, last - first) * per_chunk
+        if total != track.sample_count:
+            problems.append(f"{name_hint}: stsc describes {total} samples, stsz {track.sample_count}")
+    return track
+
+
+def _parse(path):
+    """(tracks, mdat payload ranges, problems) of the file at `path`."""
+    problems = []
+    with open(path, 'rb') as f:
+        file_size = f.seek(0, 2)
+        boxes, ok = _tiled(f, 0, file_size)
+        if not ok: problems.append("top-level boxes do not reach the end of the file (truncated?)")
+        mdats = [(offset + header_size, offset + size) for name, offset, size, header_size in boxes if name == 'mdat']
+        moovs = [box for box in boxes if box[0] == 'moov']
+        if not mdats: problems.append("no mdat box")
+        if len(moovs) != 1:
+            problems.append(f"{len(moovs)} moov boxes")
+            return [], mdats, problems
+        _, moov_offset, moov_size, _ = moovs[0]
+        f.seek(moov_offset)
+        moov = f.read(moov_size)
+
+    mf = io.BytesIO(moov)
+    children, ok = _tiled(mf, 8, len(moov))
+    if not ok: problems.append("malformed box inside moov")
+    tracks = []
+    for child in children:
+        if child[0] != 'trak': continue
+        try:
+            tracks.append(_parse_track(moov, mf, child, problems))
+        except struct.error:
+            problems.append(f"track {child[1]}: truncated box")
+
+    for track in tracks:
+        outside = sum(1 for o in track.chunk_offsets or () if not any(s <= o < e for s, e in mdats))
+        if outside: problems.append(f"{track.handler} track: {outside} chunk offset(s) outside mdat")
+    return tracks, mdats, problems
+
+
+def _sample_ranges(track, picks):
+    """{sample index: (file offset, size)} for the sorted sample indices in `picks`."""
+    found = {}
+    wanted = iter(picks)
+    want = next(wanted, None)
+    sample, chunks = 0, track.chunk_offsets
+    for i, (first, per_chunk) in enumerate(track.stsc):
+        last = track.stsc[i + 1][0] if i + 1 < len(track.stsc) else len(chunks) + 1
+        for chunk in range(first, min(last, len(chunks) + 1)):
+            end = sample + per_chunk
+            while want is not None and want < end:
+                if track.sizes is None:
+                    offset = chunks[chunk - 1] + (want - sample) * track.sample_size
+                    size = track.sample_size
+                else:
+                    offset = chunks[chunk - 1] + sum(track.sizes[sample:want])
+                    size = track.sizes[want]
+                found[want] = (offset, size)
+                want = next(wanted, None)
+            if want is None: return found
+            sample = end
+    return found
+
+
+def _media_tracks(tracks):
+    return [t for t in tracks if t.handler in MEDIA_HANDLERS]
+
+
+def fingerprint(path, samples=SAMPLES):
+    """
+    Per media track: handler, sample count, duration and hashes of sampled samples.
+    Taken before an in-place write to compare the result against (see verify()).
+    """
+    tracks, mdats, problems = _parse(path)
+    result = {"problems": problems, "tracks": []}
+    with open(path, 'rb') as f:
+        for track in _media_tracks(tracks):
+            entry = {"handler": track.handler, "samples": track.sample_count,
+                     "seconds": track.seconds, "hashes": {}}
+            result["tracks"].append(entry)
+            if not track.sample_count or track.stsc is None or track.chunk_offsets is None: continue
+            if track.sizes is None and not track.sample_size: continue
+            count = track.sample_count
+            picks = sorted({round(i * (count - 1) / max(1, samples - 1)) for i in range(min(samples, count))})
+            for index, (offset, size) in _sample_ranges(track, picks).items():
+                if not any(s <= offset and offset + size <= e for s, e in mdats):
+                    problems.append(f"{track.handler} track: sample {index} lies outside mdat")
+                    continue
+                f.seek(offset)
+                entry["hashes"][index] = hashlib.sha1(f.read(min(size, HASH_BYTES))).hexdigest()
+    return result
+
+
+def verify(path, source=None):
+    """
+    List of problems found in `path` (empty if it looks intact). `source`: the file it
+    was written from, or a fingerprint() of it, to compare tracks, durations and media bytes.
+    """
+    try:
+        output = fingerprint(path)
+    except (OSError, struct.error, IndexError) as e:
+        return [f"unreadable: {e}"]
+    problems = list(output["problems"])
+    if source is not None:
+        try:
+            reference = source if isinstance(source, dict) else fingerprint(source)
+        except (OSError, struct.error, IndexError) as e:
+            reference = None
+            print(f"    [Verify] Source not comparable ({e}); structure checked only.")
+        if reference is not None:
+            # Only what the write introduced: damage the source already had is not the output's fault
+            problems = [p for p in problems if p not in reference["problems"]]
+            problems.extend(_compare(reference, output))
+    run_report.add("verify.failed" if problems else "verify.passed")
+    return problems
+
+
+def _compare(reference, output):
+    problems = []
+    ref_tracks, out_tracks = reference["tracks"], output["tracks"]
+    if [t["handler"] for t in ref_tracks] != [t["handler"] for t in out_tracks]:
+        return [f"tracks differ: {[t['handler'] for t in ref_tracks]} -> {[t['handler'] for t in out_tracks]}"]
+    for ref, out in zip(ref_tracks, out_tracks):
+        name = f"{ref['handler']} track"
+        if ref["samples"] != out["samples"]:
+            problems.append(f"{name}: {ref['samples']} samples -> {out['samples']}")
+            continue
+        if ref["seconds"] is not None and out["seconds"] is not None and \
+                abs(ref["seconds"] - out["seconds"]) > DURATION_TOLERANCE:
+            problems.append(f"{name}: duration {ref['seconds']:.2f}s -> {out['seconds']:.2f}s")
+        changed = [i for i, digest in ref["hashes"].items() if out["hashes"].get(i, digest) != digest]
+        if changed: problems.append(f"{name}: media bytes differ at sample(s) {changed[:5]}")
+    return problems
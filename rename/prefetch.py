@@ -0,0 +1,110 @@
+"""
+Speculative metadata / cover prefetch.
+
+process_file only reaches the network after the disk work on a file (repair
+check, tag probe, rename). The Prefetcher parses filenames ahead of that and
+starts the lookups (and, for live runs, the cover download) for every code in
+the background, so by the time the batch gets to a file its metadata is
+usually cached already and network latency hides behind the disk work.
+
+Lookups are deduplicated by code: "-C", uncensored and plain copies of one
+code share one request (rename_movies.fetch_metadata / obtain_cover also join
+a lookup that is still running instead of repeating it). Files that are
+already tagged are not looked up.
+
+    prefetcher = Prefetcher(cover_dir, fetch_covers=not dry_run)
+    for entry in prefetcher.scan_ahead(scan_videos(folder)):
+        process_file(...)
+    prefetcher.close()
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rename_movies
+import code_parser
+import run_report
+import metrics
+
+DEFAULT_WORKERS = 4
+_END = object()
+
+
+class Prefetcher:
+    def __init__(self, cover_dir, fetch_covers=True, workers=DEFAULT_WORKERS):
+        self.cover_dir = cover_dir
+        self.fetch_covers = fetch_covers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._waiting = 0
+        metrics.set_gauge("queue_depth", lambda: self._waiting, queue="prefetch")
+
+    def add(self, path):
+        """Queue the lookup for the video at `path` (no-op if its code is queued already or it is done)."""
+        filename = os.path.basename(path)
+        code, _suffix, is_fc2 = code_parser.parse_filename(filename)
+        if not code: return
+        with self._lock:
+            if self._closed or (code, is_fc2) in self._seen: return
+            self._seen.add((code, is_fc2))
+        try:
+            if rename_movies.already_done(path, filename, code, quiet=True): return
+        except Exception:
+            return
+        with self._lock:
+            if self._closed: return
+            self._waiting += 1
+            self._executor.submit(self._fetch, code, is_fc2, code_parser.clean_name(filename))
+        run_report.add("prefetch.queued")
+
+    def add_all(self, paths):
+        """add() every path from a background thread (e.g. the files picked in the GUI)."""
+        def run():
+            for path in paths: self.add(path)
+        threading.Thread(target=run, daemon=True).start()
+        return self
+
+    def _fetch(self, code, is_fc2, clean_name):
+        with self._lock:
+            self._waiting -= 1
+        try:
+            title, cover_url = rename_movies.fetch_metadata(code, is_fc2, clean_name)
+            if title and cover_url and self.fetch_covers:
+                rename_movies.obtain_cover(code, title, cover_url, self.cover_dir)
+        except Exception as e:
+            print(f"  [Prefetch] {code}: {e}")
+
+    def scan_ahead(self, entries):
+        """
+        Yield `entries` (DirEntry objects from scan_videos) unchanged, while a
+        background thread keeps reading the scan and queueing lookups ahead of the consumer.
+        """
+        items = queue.Queue()
+
+        def produce():
+            try:
+                for entry in entries:
+                    self.add(entry.path)
+                    items.put(entry)
+            except Exception as e:
+                items.put(e)
+            finally:
+                items.put(_END)
+
+        threading.Thread(target=produce, daemon=True).start()
+        while True:
+            item = items.get()
+            if item is _END: return
+            if isinstance(item, Exception): raise item
+            yield item
+
+    def close(self):
+        """Drop lookups that have not started (in-flight ones finish in the background)."""
+        with self._lock:
+            self._closed = True
+            self._waiting = 0
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -3,25 +3,57 @@ import re
 import sys
 import argparse
 import time
-import requests
-import io
-import cloudscraper
-
-# Try importing mutagen
-try:
-    from mutagen.mp4 import MP4, MP4Cover
-except ImportError:
-    print("WARNING: 'mutagen' library not found. Cover art embedding will be skipped.")
-    print("To enable cover art, run: pip install mutagen")
-    MP4 = None
-
-# Try importing Pillow
-try:
-    from PIL import Image
-except ImportError:
-    print("WARNING: 'Pillow' library not found. Cover art cropping will be skipped.")
-    print("To enable cropping, run: pip install Pillow")
-    Image = None
+import threading
+import sqlite3
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from library_scan import scan_videos, RENAMABLE_EXTENSIONS
+from cover_index import get_cover_index
+from label_patterns import get_label_patterns
+from mp4_boxes import is_faststart
+import run_report
+import batch_journal
+import code_parser
+import io_scheduler
+import mp4_tags
+import mkv_tags
+import metadata_cache
+import work_leases
+import metrics
+import job_control
+import cover_preview
+import http_client
+import mp4_faststart
+import mp4_verify
+import library_catalog
+from io_scheduler import io_slot, temp_path_for
+
+# Heavy dependencies (cloudscraper/requests, Pillow; mutagen inside mp4_tags) are imported
+# on first use, so --help, drag-and-drop runs and the GUI window do not wait for them.
+_PIL_IMAGE = None
+
+def _pil_image():
+    """PIL.Image, imported on first use; None if Pillow is not installed."""
+    global _PIL_IMAGE
+    if _PIL_IMAGE is None:
+        try:
+            from PIL import Image
+            _PIL_IMAGE = Image
+        except ImportError:
+            print("WARNING: 'Pillow' library not found. Cover art cropping will be skipped.")
+            print("To enable cropping, run: pip install Pillow")
+            _PIL_IMAGE = False
+    return _PIL_IMAGE or None
+
+def _create_scraper():
+    import cloudscraper
+    return cloudscraper.create_scraper()
+
+def preload():
+    """Import the network/image dependencies now, e.g. from a background thread once the GUI is up."""
+    import cloudscraper
+    _pil_image()
 
 # Force UTF-8 for output
 if sys.stdout is not None:
@@ -35,24 +67,33 @@ if sys.stderr is not None:
     except AttributeError:
         pass
 
+# Shared state reused across files (and across batches in long-running modes)
+_SCRAPER = None
+_SCRAPER_LOCK = threading.Lock()
+_METADATA_CACHE = {}
+# Lookups/downloads in progress, by key (see _single_flight)
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
 def clean_filename(title):
     # Remove illegal characters for Windows filenames
     cleaned = re.sub(r'[\\/*?:"<>|]', "", title)
     return cleaned.strip()
 
-def process_and_save_cover(image_data, save_path):
+def process_and_save_cover(download_path, save_path):
     """
-    Crops the image (keeping right side) and saves it to disk.
-    Returns the bytes of the processed image for embedding.
+    Crops the downloaded image (keeping right side) and saves it to save_path.
+    The download is read from disk and only one decoded copy is held; the saved
+    file is what gets embedded (streamed by mp4_tags).
     """
+    Image = _pil_image()
     if Image is None:
-        # Fallback if Pillow not installed: just write raw data
-        with open(save_path, 'wb') as f:
-            f.write(image_data)
-        return image_data
+        # Fallback if Pillow not installed: keep the raw download
+        os.replace(download_path, save_path)
+        return save_path
 
     try:
-        with Image.open(io.BytesIO(image_data)) as img:
+        with Image.open(download_path) as img:
             width, height = img.size
             CROP_RATIO = 378 / 800
             
@@ -68,18 +109,16 @@ def process_and_save_cover(image_data, save_path):
                 img = img.crop((left, top, right, bottom))
                 print(f"    [Cover] Cropped to {new_width}x{height} (Right Side).")
             
-            img.save(save_path, quality=95, subsampling=0)
-            print(f"[COVER_PATH] {save_path}")
-            
-            output = io.BytesIO()
-            img.save(output, format='JPEG', quality=95, subsampling=0)
-            return output.getvalue()
+            img.save(save_path, format='JPEG', quality=95, subsampling=0)
+            # GUI preview from the image already in memory (no re-decode of the saved file)
+            cover_preview.remember(save_path, img)
+        os.remove(download_path)
+        return save_path
             
     except Exception as e:
         print(f"    [Cover] Cropping failed, using original: {e}")
-        with open(save_path, 'wb') as f:
-            f.write(image_data)
-        return image_data
+        os.replace(download_path, save_path)
+        return save_path
 
 def check_file_structure(video_path):
     import struct
@@ -104,138 +143,182 @@ def check_file_structure(video_path):
     except Exception as e:
         return False, f"Error checking structure: {e}"
 
-def apply_faststart(video_path, verify_cover=True):
-    import subprocess
+@metrics.timed("faststart")
+def apply_faststart(video_path, verify_cover=True, journal=None, in_place=True):
     import shutil
-    import struct
     import gc
 
-    if verify_cover and MP4 is not None:
+    # Box-order check: only headers are read, so this is cheap enough to run before anything else
+    file_size = os.path.getsize(video_path)
+    if is_faststart(video_path):
+        print(f"    [Faststart] moov already before mdat. Skipping.")
+        run_report.add("faststart.skipped")
+        run_report.add("faststart.avoided_bytes", file_size)
+        return True
+    print(f"    [Faststart] moov after mdat. Running faststart...")
+
+    journal = journal or batch_journal.NULL
+    if in_place:
+        # No second copy of the file, and the cover stays (see mp4_faststart)
         try:
-            gc.collect()
-            v = MP4(video_path)
-            had_cover = "covr" in v
-            del v
-        except: pass
-    
-    try:
-        gc.collect()
-        with open(video_path, 'rb') as f:
-            offset = 0
-            file_size = os.path.getsize(video_path)
-            while offset < min(file_size, 50000000):
-                f.seek(offset)
-                header = f.read(8)
-                if len(header) < 8: break
-                size = struct.unpack('>I', header[:4])[0]
-                atom_type = header[4:8].decode('latin-1', errors='replace')
-                if size == 1:
-                    extended_header = f.read(8)
-                    if len(extended_header) == 8: size = struct.unpack('>Q', extended_header)[0]
-                elif size == 0: size = file_size - offset
-                
-                if atom_type == 'moov':
-                    if offset == 28:
-                        print(f"    [Faststart] moov already at offset 28. Skipping.")
-                        return True
-                    elif offset < 50000000:
-                        print(f"    [Faststart] moov at offset {offset} (not 28). Re-running faststart to standardize...")
-                        break
-                    else:
-                        print(f"    [Faststart] moov at offset {offset} (END). Running faststart...")
-                        break
-                offset += size
-                if offset <= 0: break
-    except Exception as e:
-        print(f"    [Faststart] Could not check moov position: {e}")
+            mp4_faststart.faststart_inplace(video_path, journal=journal)
+            print(f"    [Faststart] SUCCESS! moov atom moved to the front in place.")
+            return True
+        except mp4_tags.UnsupportedLayout as e:
+            print(f"    [Faststart] In-place move not possible ({e}); using FFmpeg.")
+        except OSError as e:
+            print(f"    [Faststart] ERROR: {e}")
+            return False
+
+    # ffmpeg -c copy does not carry covr over; remember whether there was one (box headers only)
+    had_cover = verify_cover and has_cover(video_path)
     
-    temp_path = video_path + ".faststart.mp4"
-    bak_path = video_path + ".bak"
+    temp_path = temp_path_for(video_path, ".faststart.mp4")
+    bak_path = temp_path_for(video_path, ".bak")
+    journal.record(video_path, "faststart", "intent", temp=temp_path, backup=bak_path)
     
-    try:
-        print(f"    [Faststart] Moving moov atom to beginning (targeting offset 28)...")
-        result = subprocess.run(
-            ["ffmpeg", "-y", "-hide_banner", "-loglevel", "quiet",
-             "-i", video_path, "-c", "copy", "-movflags", "+faststart",
-             temp_path],
-            capture_output=True, text=True, encoding='utf-8', errors='replace'
-        )
+    # One heavy rewrite per volume at a time (see io_scheduler)
+    with io_slot(video_path):
+        try:
+            print(f"    [Faststart] Moving moov atom to beginning...")
+            # Killed if the job is cancelled (see job_control)
+            result = job_control.run_process(
+                ["ffmpeg", "-y", "-hide_banner", "-loglevel", "quiet",
+                 "-i", video_path, "-c", "copy", "-movflags", "+faststart",
+                 temp_path],
+                text=True, encoding='utf-8', errors='replace'
+            )
         
-        if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
-            max_retries = 5
-            for attempt in range(max_retries):
-                try:
-                    gc.collect()
-                    if os.path.exists(bak_path): os.remove(bak_path)
-                    os.rename(video_path, bak_path)
+            if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
+                # Structure, durations and sampled media bytes against the original (see mp4_verify)
+                problems = mp4_verify.verify(temp_path, source=video_path)
+                if problems:
+                    print(f"    [Faststart] Output failed verification, keeping the original: {'; '.join(problems)}")
+                    os.remove(temp_path)
+                    journal.record(video_path, "faststart", "failed", temp=temp_path, backup=bak_path)
+                    return False
+                journal.record(video_path, "faststart", "swap", temp=temp_path, backup=bak_path)
+                max_retries = 5
+                for attempt in range(max_retries):
                     try:
-                        os.rename(temp_path, video_path)
-                        try: os.remove(bak_path)
-                        except: pass
-                        print(f"    [Faststart] SUCCESS! moov atom moved and standardized.")
-                        return True
-                    except Exception as e2:
-                        print(f"    [Faststart] Swap failed, restoring original: {e2}")
-                        if os.path.exists(bak_path): shutil.move(bak_path, video_path)
-                        raise e2
-                except PermissionError as e:
-                    if attempt < max_retries - 1: time.sleep((attempt + 1) * 5)
-                    else:
-                        print(f"    [Faststart] Failed after {max_retries} retries: {e}")
-                        return False
-            return False
-        else:
+                        gc.collect()
+                        if os.path.exists(bak_path): os.remove(bak_path)
+                        os.rename(video_path, bak_path)
+                        try:
+                            os.rename(temp_path, video_path)
+                            try: os.remove(bak_path)
+                            except: pass
+                            print(f"    [Faststart] SUCCESS! moov atom moved to the front.")
+                            if had_cover and not has_cover(video_path):
+                                print(f"    [Faststart] NOTE: The embedded cover was dropped by ffmpeg; re-embed it.")
+                            run_report.add("faststart.rewritten")
+                            run_report.add("faststart.rewritten_bytes", file_size)
+                            journal.record(video_path, "faststart", "done")
+                            return True
+                        except Exception as e2:
+                            print(f"    [Faststart] Swap failed, restoring original: {e2}")
+                            if os.path.exists(bak_path): shutil.move(bak_path, video_path)
+                            raise e2
+                    except PermissionError as e:
+                        if attempt < max_retries - 1: time.sleep((attempt + 1) * 5)
+                        else:
+                            print(f"    [Faststart] Failed after {max_retries} retries: {e}")
+                            journal.record(video_path, "faststart", "failed", temp=temp_path, backup=bak_path)
+                            return False
+                journal.record(video_path, "faststart", "failed", temp=temp_path, backup=bak_path)
+                return False
+            else:
+                if os.path.exists(temp_path): os.remove(temp_path)
+                print(f"    [Faststart] Failed - temp file creation failed.")
+                journal.record(video_path, "faststart", "failed", temp=temp_path, backup=bak_path)
+                return False
+        except job_control.Cancelled:
+            # The original was not touched yet: drop the partial output
             if os.path.exists(temp_path): os.remove(temp_path)
-            print(f"    [Faststart] Failed - temp file creation failed.")
+            journal.record(video_path, "faststart", "failed", temp=temp_path, backup=bak_path)
+            print("    [Faststart] Cancelled.")
+            raise
+        except FileNotFoundError:
+            print("    [Faststart] ERROR: FFmpeg not found! Please install FFmpeg.")
+            journal.record(video_path, "faststart", "failed", temp=temp_path, backup=bak_path)
+            return False
+        except Exception as e:
+            print(f"    [Faststart] ERROR: {e}")
+            journal.record(video_path, "faststart", "failed", temp=temp_path, backup=bak_path)
             return False
-    except FileNotFoundError:
-        print("    [Faststart] ERROR: FFmpeg not found! Please install FFmpeg.")
-        return False
-    except Exception as e:
-        print(f"    [Faststart] ERROR: {e}")
-        return False
 
-def repair_with_ffmpeg(video_path):
-    import subprocess
+def repair_with_ffmpeg(video_path, journal=None):
     import shutil
     print(f"    [Repair] Detected corrupted file structure. Repairing with FFmpeg...")
-    temp_path = video_path + ".repaired.mp4"
-    backup_path = video_path + ".corrupt.bak"
-    try:
-        result = subprocess.run(
-            ["ffmpeg", "-y", "-hide_banner", "-loglevel", "warning",
-            "-i", video_path, "-c", "copy", "-movflags", "+faststart",
-            temp_path],
-            capture_output=True, text=True, encoding='utf-8', errors='replace'
-        )
-        if result.returncode != 0 or not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
-            if os.path.exists(temp_path): os.remove(temp_path)
-            return False, video_path
+    temp_path = temp_path_for(video_path, ".repaired.mp4")
+    backup_path = temp_path_for(video_path, ".corrupt.bak")
+    journal = journal or batch_journal.NULL
+    # The .corrupt.bak is deliberately kept after a successful repair
+    journal.record(video_path, "repair", "intent", temp=temp_path, backup=backup_path, keep_backup=True)
+    with io_slot(video_path):
         try:
-            shutil.move(video_path, backup_path)
-            shutil.move(temp_path, video_path)
-            print(f"    [Repair] ✓ File repaired successfully!")
-            return True, video_path
+            result = job_control.run_process(
+                ["ffmpeg", "-y", "-hide_banner", "-loglevel", "warning",
+                "-i", video_path, "-c", "copy", "-movflags", "+faststart",
+                temp_path],
+                text=True, encoding='utf-8', errors='replace'
+            )
+            if result.returncode != 0 or not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
+                if os.path.exists(temp_path): os.remove(temp_path)
+                journal.record(video_path, "repair", "failed", temp=temp_path, backup=backup_path, keep_backup=True)
+                return False, video_path
+            # The source is known to be damaged, so only the repaired file's own structure is checked
+            problems = mp4_verify.verify(temp_path)
+            if problems:
+                print(f"    [Repair] Repaired file failed verification: {'; '.join(problems)}")
+                os.remove(temp_path)
+                journal.record(video_path, "repair", "failed", temp=temp_path, backup=backup_path, keep_backup=True)
+                return False, video_path
+            journal.record(video_path, "repair", "swap", temp=temp_path, backup=backup_path, keep_backup=True)
+            try:
+                shutil.move(video_path, backup_path)
+                shutil.move(temp_path, video_path)
+                print(f"    [Repair] ✓ File repaired successfully!")
+                journal.record(video_path, "repair", "done")
+                return True, video_path
+            except Exception as e:
+                if os.path.exists(backup_path): shutil.move(backup_path, video_path)
+                journal.record(video_path, "repair", "failed", temp=temp_path, backup=backup_path, keep_backup=True)
+                return False, video_path
+        except job_control.Cancelled:
+            if os.path.exists(temp_path): os.remove(temp_path)
+            journal.record(video_path, "repair", "failed", temp=temp_path, backup=backup_path, keep_backup=True)
+            print("    [Repair] Cancelled.")
+            raise
         except Exception as e:
-            if os.path.exists(backup_path): shutil.move(backup_path, video_path)
+            print(f"    [Repair] ERROR: {e}")
+            journal.record(video_path, "repair", "failed", temp=temp_path, backup=backup_path, keep_backup=True)
             return False, video_path
-    except Exception as e:
-        print(f"    [Repair] ERROR: {e}")
-        return False, video_path
 
-def embed_cover(video_path, image_data):
-    if MP4 is None: return
+def embed_cover(video_path, cover, journal=None, title=None, code=None, source=None):
+    """
+    cover: path of the saved cover (preferred: streamed into the file in chunks) or its bytes.
+    title/code/source are written as tags in the same pass (see mp4_tags).
+    Only the ilst items and the sizes/offsets they affect are rewritten.
+    """
+    if video_path.lower().endswith(mkv_tags.EXTENSIONS):
+        # Matroska: cover attachment only; the clusters are never rewritten (see mkv_tags)
+        try:
+            mkv_tags.embed_cover(video_path, cover, journal=journal)
+            if mkv_tags.has_cover(video_path): print("    [Cover] Successfully embedded and VERIFIED (MKV attachment).")
+            else: print("    [Cover] WARNING: Embedded but cover attachment not found on re-read.")
+        except Exception as e:
+            print(f"    [Cover] Failed to embed cover: {e}")
+        return
     try:
-        video = MP4(video_path)
-        video["covr"] = [MP4Cover(image_data, imageformat=MP4Cover.FORMAT_JPEG)]
-        video.save()
-        
-        video_reread = MP4(video_path)
-        if "covr" in video_reread: print(f"    [Cover] Successfully embedded and VERIFIED (Size: {len(video_reread['covr'][0])} bytes).")
+        before = mp4_verify.fingerprint(video_path)
+        mp4_tags.embed_cover(video_path, cover, journal=journal, title=title, code=code, source=source)
+        # Verify by re-reading box headers, the moov and sampled media bytes only
+        found = mp4_tags.find_item(video_path, "covr")
+        problems = mp4_verify.verify(video_path, source=before)
+        if problems: print(f"    [Cover] WARNING: File failed verification after embedding: {'; '.join(problems)}")
+        elif found: print(f"    [Cover] Successfully embedded and VERIFIED (Size: {found[1] - 24} bytes).")
         else: print("    [Cover] WARNING: Embedded but 'covr' not found on re-read.")
-        del video_reread
-        del video
-        time.sleep(2)
     except Exception as e:
         print(f"    [Cover] Failed to embed cover: {e}")
 
@@ -303,19 +386,125 @@ def _extract_metadata_from_page(detail_html, code, scraper):
     
     return title, cover_url
 
+def _parse_detail_page(detail_html, code):
+    """
+    (title, cover_url) from a JavTrailers detail page reached for `code`
+    (via search or a learned direct URL). (None, None) if the page is for another code.
+    """
+    # Verify Code
+    if code.upper() not in detail_html.upper():
+        print(f"  [JavTrailers] WARNING: Code {code} not found on detail page.")
+        return None, None
+
+    # Extract Title
+    # Priority: og:description > twitter:description > meta description > h1
+    title = None
+
+    # Method 1: og:description (BEST - has correct title)
+    og_desc_match = re.search(r'<meta property="og:description" content="([^"]+)"', detail_html, re.IGNORECASE)
+    if og_desc_match:
+        raw_title = og_desc_match.group(1)
+        clean_t = re.sub(f"^{re.escape(code)}", "", raw_title, flags=re.IGNORECASE)
+        title = clean_t.strip(" -")
+
+    # Method 2: twitter:description
+    if not title:
+        tw_desc_match = re.search(r'<meta name="twitter:description" content="([^"]+)"', detail_html, re.IGNORECASE)
+        if tw_desc_match:
+            raw_title = tw_desc_match.group(1)
+            clean_t = re.sub(f"^{re.escape(code)}", "", raw_title, flags=re.IGNORECASE)
+            title = clean_t.strip(" -")
+
+    # Method 3: meta description (may have wrong suffix like Tsubomi)
+    if not title:
+        desc_match = re.search(r'<meta name="description" content="([^"]+)"', detail_html, re.IGNORECASE)
+        if desc_match:
+            raw_title = desc_match.group(1)
+            clean_t = re.sub(f"^{re.escape(code)}", "", raw_title, flags=re.IGNORECASE)
+            title = clean_t.strip(" -")
+
+    # Method 4: h1 fallback
+    if not title:
+        h1_match = re.search(r'<h1>(.*?)</h1>', detail_html, re.IGNORECASE)
+        if h1_match:
+            raw_title = re.sub(r'<[^>]+>', '', h1_match.group(1)).strip()
+            clean_t = re.sub(f"^{re.escape(code)}", "", raw_title, flags=re.IGNORECASE)
+            title = clean_t.strip(" -")
+
+    if title:
+        # Remove duplicate suffixes/names (handles Japanese names without spaces)
+        def remove_duplicates(text):
+            # Method 1: Check if last two space-separated words are identical
+            parts = text.split()
+            if len(parts) >= 2 and parts[-1] == parts[-2]:
+                text = ' '.join(parts[:-1])
+
+            # Method 2: Check for trailing duplicate substrings (Japanese names)
+            # e.g., "菊乃らん菊乃らん" -> "菊乃らん"
+            for length in range(2, min(20, len(text) // 2 + 1)):
+                suffix = text[-length:]
+                if text[-2*length:-length] == suffix:
+                    text = text[:-length]
+                    break
+
+            # Method 3: Remove trailing romanized names (JavTrailers adds these)
+            # e.g., "つぼみの体内に...Tsubomi" -> "つぼみの体内に..."
+            # Pattern: Title ends with capitalized English word(s) not preceded by space
+            trailing_romaji = re.search(r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)$', text)
+            if trailing_romaji:
+                romaji_name = trailing_romaji.group(1)
+                # Check if it's attached directly to Japanese text (no space before)
+                pos = text.rfind(romaji_name)
+                if pos > 0 and text[pos-1] not in ' \t':
+                    # Remove the trailing romaji
+                    text = text[:pos].strip()
+
+            return text
+
+        title = remove_duplicates(title)
+
+    # Extract Cover: og:image
+    cover_url = None
+    og_img_match = re.search(r'<meta property="og:image" content="([^"]+)"', detail_html, re.IGNORECASE)
+    if og_img_match:
+        cover_url = og_img_match.group(1)
+
+    return title, cover_url
+
 def get_metadata_via_jt_cloudscraper(code):
     """
     Scrape JavTrailers using cloudscraper (JavSP logic replacement).
+    Labels seen in earlier searches go straight to the detail page (see label_patterns);
+    the search is the fallback and teaches new labels.
     Returns: (title, cover_url)
     """
-    scraper = cloudscraper.create_scraper()
-    
-    # Primary: Search
+    scraper = get_scraper()  # Shared session: the Cloudflare clearance is kept across files
+    patterns = get_label_patterns()
+
+    # Known label: one request instead of search + detail
+    direct_url = patterns.direct_url(code)
+    if direct_url:
+        print(f"  [JavTrailers] Known label, trying detail page: {direct_url}")
+        try:
+            resp = http_client.get(scraper, direct_url, timeout=30)
+            if resp.status_code == 200 and code.upper() in resp.text.upper():
+                title, cover_url = _parse_detail_page(resp.text, code)
+                if title:
+                    run_report.add("javtrailers.direct_hit")
+                    return title, cover_url
+            print(f"  [JavTrailers] Direct URL did not match (Status {resp.status_code}), searching instead.")
+            patterns.miss(code)
+            run_report.add("javtrailers.direct_miss")
+        except Exception as e:
+            print(f"  [JavTrailers] Direct URL failed, searching instead: {e}")
+
+    # Search
+    run_report.add("javtrailers.search")
     search_url = f"https://javtrailers.com/ja/search/{code}"
     print(f"  [JavTrailers] Scraping Search: {search_url}")
     
     try:
-        resp = scraper.get(search_url, timeout=30)
+        resp = http_client.get(scraper, search_url, timeout=30)
         if resp.status_code != 200:
             print(f"  [JavTrailers] Search failed (Status {resp.status_code})")
             return None, None
@@ -334,7 +523,7 @@ def get_metadata_via_jt_cloudscraper(code):
                 print(f"  [JavTrailers] Search no results, trying direct URL: {direct_url}")
                 
                 try:
-                    resp = scraper.get(direct_url, timeout=30)
+                    resp = http_client.get(scraper, direct_url, timeout=30)
                     if resp.status_code == 200 and '<h1>' in resp.text:
                         print(f"  [JavTrailers] Direct URL success!")
                         return _extract_metadata_from_page(resp.text, code, scraper)
@@ -349,91 +538,17 @@ def get_metadata_via_jt_cloudscraper(code):
         print(f"  [JavTrailers] Found detail URL: {detail_url}")
         
         # Request Detail Page
-        resp_detail = scraper.get(detail_url, timeout=30)
+        resp_detail = http_client.get(scraper, detail_url, timeout=30)
         if resp_detail.status_code != 200:
              print(f"  [JavTrailers] Detail page failed (Status {resp_detail.status_code})")
              return None, None
         
         detail_html = resp_detail.text
         
-        # Verify Code
-        if code.upper() not in detail_html.upper():
-             print(f"  [JavTrailers] WARNING: Code {code} not found on detail page.")
-             return None, None
-             
-        # Extract Title
-        # Priority: og:description > twitter:description > meta description > h1
-        title = None
-        
-        # Method 1: og:description (BEST - has correct title)
-        og_desc_match = re.search(r'<meta property="og:description" content="([^"]+)"', detail_html, re.IGNORECASE)
-        if og_desc_match:
-            raw_title = og_desc_match.group(1)
-            clean_t = re.sub(f"^{re.escape(code)}", "", raw_title, flags=re.IGNORECASE)
-            title = clean_t.strip(" -")
-        
-        # Method 2: twitter:description
-        if not title:
-            tw_desc_match = re.search(r'<meta name="twitter:description" content="([^"]+)"', detail_html, re.IGNORECASE)
-            if tw_desc_match:
-                raw_title = tw_desc_match.group(1)
-                clean_t = re.sub(f"^{re.escape(code)}", "", raw_title, flags=re.IGNORECASE)
-                title = clean_t.strip(" -")
-        
-        # Method 3: meta description (may have wrong suffix like Tsubomi)
-        if not title:
-            desc_match = re.search(r'<meta name="description" content="([^"]+)"', detail_html, re.IGNORECASE)
-            if desc_match:
-                raw_title = desc_match.group(1)
-                clean_t = re.sub(f"^{re.escape(code)}", "", raw_title, flags=re.IGNORECASE)
-                title = clean_t.strip(" -")
-        
-        # Method 4: h1 fallback
-        if not title:
-            h1_match = re.search(r'<h1>(.*?)</h1>', detail_html, re.IGNORECASE)
-            if h1_match:
-                raw_title = re.sub(r'<[^>]+>', '', h1_match.group(1)).strip()
-                clean_t = re.sub(f"^{re.escape(code)}", "", raw_title, flags=re.IGNORECASE)
-                title = clean_t.strip(" -")
-        
+        title, cover_url = _parse_detail_page(detail_html, code)
         if title:
-            # Remove duplicate suffixes/names (handles Japanese names without spaces)
-            def remove_duplicates(text):
-                # Method 1: Check if last two space-separated words are identical
-                parts = text.split()
-                if len(parts) >= 2 and parts[-1] == parts[-2]:
-                    text = ' '.join(parts[:-1])
-                
-                # Method 2: Check for trailing duplicate substrings (Japanese names)
-                # e.g., "菊乃らん菊乃らん" -> "菊乃らん"
-                for length in range(2, min(20, len(text) // 2 + 1)):
-                    suffix = text[-length:]
-                    if text[-2*length:-length] == suffix:
-                        text = text[:-length]
-                        break
-                
-                # Method 3: Remove trailing romanized names (JavTrailers adds these)
-                # e.g., "つぼみの体内に...Tsubomi" -> "つぼみの体内に..."
-                # Pattern: Title ends with capitalized English word(s) not preceded by space
-                trailing_romaji = re.search(r'([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)$', text)
-                if trailing_romaji:
-                    romaji_name = trailing_romaji.group(1)
-                    # Check if it's attached directly to Japanese text (no space before)
-                    pos = text.rfind(romaji_name)
-                    if pos > 0 and text[pos-1] not in ' \t':
-                        # Remove the trailing romaji
-                        text = text[:pos].strip()
-                
-                return text
-            
-            title = remove_duplicates(title)
-        
-        # Extract Cover: og:image
-        cover_url = None
-        og_img_match = re.search(r'<meta property="og:image" content="([^"]+)"', detail_html, re.IGNORECASE)
-        if og_img_match:
-            cover_url = og_img_match.group(1)
-        
+            # The search found it: remember this label's content-ID pattern for direct lookups
+            get_label_patterns().learn(code, href)
         return title, cover_url
         
     except Exception as e:
@@ -441,224 +556,514 @@ def get_metadata_via_jt_cloudscraper(code):
         return None, None
 
 def has_cover(video_path):
-    if MP4 is None: return False
+    # Box headers only: no need to load moov/ilst through mutagen
+    if video_path.lower().endswith(mkv_tags.EXTENSIONS): return mkv_tags.has_cover(video_path)
+    return mp4_tags.find_item(video_path, "covr") is not None
+
+def already_done(video_path, filename, code, quiet=False):
+    """
+    Reason string if the file needs no lookup, else None. Files we tagged carry their
+    code, title and cover in the tags, so this holds even after the user renames them.
+    quiet: no output or counters (used by the prefetcher's look-ahead).
+    """
+    tags = (mkv_tags if video_path.lower().endswith(mkv_tags.EXTENSIONS) else mp4_tags).read_tags(video_path)
+    if tags["code"] == code and tags["title"] and tags["cover"]:
+        if not quiet: run_report.add("scan.already_tagged")
+        return f"Already tagged ({tags['source'] or 'unknown source'}, fetched {tags['fetched'] or '?'})."
+    if tags["code"] is None and re.search(r'[\u3040-\u30ff]', filename):
+        # Processed before tags were written: fall back to the filename
+        if tags["cover"]: return "File has Japanese title AND cover art."
+        if not quiet: print(f"  [INFO] File has title but NO cover. Proceeding to fetch...")
+    return None
+
+def metadata_source(is_fc2):
+    """Name of the site fetch_metadata() uses for a code (stored in the file's source tag)."""
+    return "fc2" if is_fc2 else "javtrailers"
+
+def get_scraper():
+    """
+    Returns the shared cloudscraper session.
+    Created on first use and reused across files so long-running modes
+    (watch, GUI batches) keep the Cloudflare clearance and connection pool warm.
+    """
+    global _SCRAPER
+    with _SCRAPER_LOCK:
+        if _SCRAPER is None:
+            _SCRAPER = _create_scraper()
+        return _SCRAPER
+
+def _single_flight(key, func):
+    """
+    func() for `key`, run by one caller at a time: callers arriving while it runs
+    (e.g. the file reaching a lookup its prefetch already started) wait for and
+    share that result instead of repeating the request.
+    """
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        owner = future is None
+        if owner: future = _INFLIGHT[key] = Future()
+    if not owner:
+        run_report.add("lookup.shared")
+        while True:
+            job_control.check_cancelled()
+            try:
+                return future.result(timeout=job_control.POLL_INTERVAL)
+            except FutureTimeout:
+                continue
+            except Exception:
+                # The other caller failed: try once more ourselves
+                return func()
+    try:
+        result = func()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(key, None)
+
+def _lookup_metadata(code, is_fc2):
+    """Network lookup of (title, cover_url); (None, None) if not found."""
+    result = _scrape_metadata(code, is_fc2)
+    metrics.inc("scrape_total", source=metadata_source(is_fc2), result="found" if result[0] else "not_found")
+    return result
+
+def _scrape_metadata(code, is_fc2):
+    if is_fc2:
+        # FC2 Scraping
+        code_num = code.split('-')[-1]
+        try:
+            from fc2_scraper import get_fc2_metadata
+            print(f"  [FC2] Scraping metadata for {code_num}...")
+            # Network lookups are abandoned when the job is cancelled (job_control.call)
+            return job_control.call(get_fc2_metadata, code_num)
+        except Exception as e:
+            print(f"  [FC2] Error: {e}")
+            return None, None
+    # JavTrailers Scraping via Cloudscraper
+    return job_control.call(get_metadata_via_jt_cloudscraper, code)
+
+def fetch_metadata(code, is_fc2=False, clean_name=None):
+    """
+    Fetch (title, cover_url) for a code, using the in-process and on-disk caches.
+    Only successful lookups are cached so transient failures are retried.
+    Concurrent lookups of one code (a prefetch, -C/uncensored variants) share one request.
+    """
+    cache_key = (code, is_fc2)
+    cached = _METADATA_CACHE.get(cache_key)
+    if cached:
+        print(f"  [Cache] Using cached metadata for {code}")
+        return cached
+    # Earlier runs / other machines sharing the data dir (see metadata_cache)
+    cached = metadata_cache.get(code, is_fc2)
+    if cached:
+        print(f"  [Cache] Using stored metadata for {code}")
+        run_report.add("lookup.disk_cache")
+        _METADATA_CACHE[cache_key] = cached
+        return cached
+
+    jp_title, cover_url = _single_flight(("metadata",) + cache_key, lambda: _lookup_metadata(code, is_fc2))
+    if jp_title:
+        if cache_key not in _METADATA_CACHE: metadata_cache.put(code, is_fc2, jp_title, cover_url)
+        _METADATA_CACHE[cache_key] = (jp_title, cover_url)
+        return jp_title, cover_url
+
+    if is_fc2:
+        print("  [FC2] Web scraping failed.")
+        # Fallback (not cached: derived from this particular filename)
+        if clean_name:
+            temp_name = clean_name
+            temp_name = re.sub(r'FC2(?:PPV)?-?\d+', '', temp_name, flags=re.IGNORECASE)
+            temp_name = re.sub(r'-[A-Z0-9]+(\.(?:mp4|mkv))', r'\1', temp_name, flags=re.IGNORECASE)
+            temp_name = os.path.splitext(temp_name)[0].strip()
+            if len(temp_name) > 5:
+                print(f"  [FC2] Fallback: Extracted title from filename: {temp_name}")
+                return temp_name, cover_url
+        return None, None
+    return jp_title, cover_url
+
+def obtain_cover(code, jp_title, cover_url, cover_dir):
+    """
+    Return the cover path for a code: the cover already saved in cover_dir if
+    there is one, otherwise download (streamed to disk), crop and save it.
+    A download already running for the code (e.g. its prefetch) is waited for, not repeated.
+    """
+    return _single_flight(("cover", code, os.path.abspath(cover_dir)),
+                          lambda: _obtain_cover(code, jp_title, cover_url, cover_dir))
+
+def _obtain_cover(code, jp_title, cover_url, cover_dir):
+    os.makedirs(cover_dir, exist_ok=True)
+    cover_index = get_cover_index(cover_dir)
+    existing_cover = cover_index.find(code)
+    if existing_cover:
+        # Already downloaded and cropped in an earlier run
+        print(f"    [Cover] Reusing saved cover: {os.path.basename(existing_cover)}")
+        return existing_cover
+
+    clean_cover_name = clean_filename(f"{code} {jp_title}")
+    cover_save_path = os.path.join(cover_dir, f"{clean_cover_name}.jpg")
+    if os.path.exists(cover_save_path):
+        # Saved since the index was loaded (another machine sharing the cover folder)
+        cover_index.add(os.path.basename(cover_save_path))
+        print(f"    [Cover] Reusing saved cover: {os.path.basename(cover_save_path)}")
+        return cover_save_path
+
+    print(f"    [Cover] Downloading: {cover_url}")
+    # Unique per download: workers on other machines may fetch the same cover at the same time
+    download_path = f"{cover_save_path}.{uuid.uuid4().hex[:8]}.part"
+
+    c_scraper = get_scraper() # reuse scraper
     try:
-        video = MP4(video_path)
-        has = "covr" in video
-        del video
-        return has
-    except: return False
+        with job_control.call(http_client.get, c_scraper, cover_url, timeout=15, stream=True) as resp:
+            resp.raise_for_status()
+            with open(download_path, 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=64 * 1024):
+                    job_control.check_cancelled()
+                    f.write(chunk)
+    except BaseException:
+        # Also on cancel: no half-written .part is left behind
+        if os.path.exists(download_path): os.remove(download_path)
+        raise
+
+    process_and_save_cover(download_path, cover_save_path)
+    cover_index.add(os.path.basename(cover_save_path))
+    print(f"    [Cover] Saved to: {os.path.basename(cover_save_path)}")
+    return cover_save_path
+
+def build_new_filename(code, jp_title, suffix, ext=".mp4"):
+    return clean_filename(f"{code} {jp_title}{suffix}{ext}")
+
+def should_rename(filename, new_filename, jp_title, target_file=None):
+    """Decide whether a rename is needed, printing the reason when it is not."""
+    if new_filename == filename:
+        print("  [SKIP] New filename is identical to old.")
+        return False
+    if jp_title in filename and not target_file:
+        print("  [SKIP] Filename already contains title.")
+        return False
+    print(f"  [RENAME] '{filename}'\n        -> '{new_filename}'")
+    return True
 
-def process_directory(directory, dry_run=True, target_file=None, progress_callback=None, custom_cover_dir=None):
+def find_duplicate(file_path, code, suffix):
+    """Catalogued file with the same content as `file_path` (the copy to keep), else None."""
+    try:
+        return library_catalog.get_catalog().find_duplicate(file_path, code, suffix)
+    except (OSError, sqlite3.Error) as e:
+        print(f"  [Catalog] Duplicate check skipped: {e}")
+        return None
+
+def catalog_moved(old_path, new_path):
+    try:
+        library_catalog.get_catalog().moved(old_path, new_path)
+    except sqlite3.Error as e:
+        print(f"  [Catalog] Could not record rename: {e}")
+
+def get_cover_dir(custom_cover_dir=None):
+    """Cover output directory: custom dir if given, else label/cover."""
+    if custom_cover_dir: return custom_cover_dir
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    label_dir = os.path.dirname(script_dir)  # Parent of rename/
+    return os.path.join(label_dir, "cover")
+
+@metrics.timed("file")
+def process_file(directory, filename, dry_run=True, target_file=None, progress_callback=None, cover_dir=None, index=0,
+                 journal=None, dedupe=True, leases=None):
+    """
+    Run the full pipeline (extract code -> repair -> fetch -> rename -> cover) on one file.
+    Returns the final filename on disk, or None if the file was skipped.
+    Each disk-changing step is recorded in `journal` (see batch_journal) when given.
+    Pauses/cancels of the current job (job_control) are honoured between stages.
+    dedupe: skip files whose content is already in the library under another name (library_catalog).
+    leases: a work_leases.LeaseManager (distributed mode); the new name is leased before the rename
+    so other workers do not pick up the renamed file while its cover is being written.
+    """
+    i = index
+    if cover_dir is None: cover_dir = get_cover_dir()
+    journal = journal or batch_journal.NULL
+
+    job_control.checkpoint()
+    # Progress: Start of file (Analyze) - 10%
+    if progress_callback: progress_callback(i, 10, f"Analyzing: {filename}")
+    print(f"\nAnalyzing: {filename}")
+    
+    clean_name = code_parser.clean_name(filename)
+    
+    # 1. Extraction Logic (code, suffix and FC2 detection live in code_parser)
+    # Examples: ABW-009, IPTD-764, iptd00764 -> IPTD-764, FC2-PPV-3482842
+    code, suffix, is_fc2 = code_parser.parse_filename(filename)
+    if not code:
+        print(f"  Skipping: Could not extract code from {filename}")
+        return None
+    if is_fc2: print(f"  Identified FC2: {code}")
+    else: print(f"  Code: {code}")
+    
+    file_path = os.path.join(directory, filename)
+    ext = os.path.splitext(filename)[1].lower()
+
+    # 1.2. Duplicate Check: before any network or remux work (partial content hash, see library_catalog)
+    if dedupe and not target_file:
+        with metrics.stage("dedupe"): duplicate = find_duplicate(file_path, code, suffix)
+        if duplicate:
+            print(f"  [Duplicate] Same content as {duplicate}. Skipping.")
+            run_report.add("catalog.duplicates")
+            return None
+
+    # 1.5. Corruption Check (MP4 only)
+    is_corrupted, error_msg = (False, None) if ext == ".mkv" else check_file_structure(file_path)
+    if is_corrupted:
+        print(f"  [WARNING] {error_msg}")
+        with metrics.stage("repair"): success, repaired_path = repair_with_ffmpeg(file_path, journal=journal)
+        if success: file_path = repaired_path
+        else: return None
+    
+    # 2. Check Labeled (tags written with the cover first, filename heuristic for older files)
+    done = already_done(file_path, filename, code)
+    if done:
+        print(f"  [INFO] {done} Skipping.")
+        if not target_file:
+            if not dry_run: journal.file_done(file_path)
+            return filename
+
+    print(f"  Code: {code}")
+
+    # 4. Fetch Title & Cover
+    job_control.checkpoint()
+    if progress_callback: progress_callback(i, 50, "Fetching metadata...")
+    with metrics.stage("metadata"): jp_title, cover_url = fetch_metadata(code, is_fc2, clean_name)
+    
+    if not jp_title:
+         print("  FAILED to fetch title. Skipping.")
+         return None
+         
+    print(f"  Fetched Title: {jp_title}")
+    if cover_url: print(f"  Fetched Cover URL: {cover_url}")
+    else: print("  [WARN] No cover URL found.")
+
+    # 5. Construct New Name
+    new_filename = build_new_filename(code, jp_title, suffix, ext=ext)
+    
+    if progress_callback: progress_callback(i, 70, "Renaming...")
+    
+    do_rename = should_rename(filename, new_filename, jp_title, target_file)
+    
+    final_name = filename
+    if not dry_run:
+        job_control.checkpoint()
+        final_path = os.path.join(directory, filename)
+        if do_rename and leases and not leases.claim(os.path.join(directory, new_filename)):
+            print("    [Lease] Target name is being processed by another worker. Not renaming.")
+            do_rename = False
+        if do_rename:
+            try:
+                old_path = os.path.join(directory, filename)
+                new_path = os.path.join(directory, new_filename)
+                journal.record(old_path, "rename", "intent", new=new_path)
+                with metrics.stage("rename"): os.rename(old_path, new_path)
+                journal.record(old_path, "rename", "done", new=new_path)
+                if dedupe: catalog_moved(old_path, new_path)
+                print("    Success Rename.")
+                final_path = new_path
+                final_name = new_filename
+            except OSError as e:
+                print(f"    Error renaming: {e}")
+                final_path = old_path
+
+        # PROCESS & EMBED COVER
+        if cover_url:
+            job_control.checkpoint()
+            if progress_callback: progress_callback(i, 90, "Downloading & Embedding Cover...")
+            try:
+                # Use cover_dir calculated at start of run
+                with metrics.stage("cover_download"): cover_path = obtain_cover(code, jp_title, cover_url, cover_dir)
+                # GUI preview of the file being processed (prefetched covers are not announced)
+                print(f"[COVER_PATH] {cover_path}")
+                journal.record(final_path, "cover", "intent")
+                with metrics.stage("cover_embed"):
+                    embed_cover(final_path, cover_path, journal=journal, title=jp_title, code=code,
+                                source=metadata_source(is_fc2))
+                journal.record(final_path, "cover", "done")
+                
+            except Exception as e:
+                 print(f"    [Cover] Error handling cover: {e}")
+    
+        journal.file_done(os.path.join(directory, filename), final=final_path)
+    
+    if progress_callback: progress_callback(i, 100, "Done.")
+    return final_name
+
+def _process_leased(path, leases, **kwargs):
+    """process_file() on `path`, whose lease (if any) is held; all leases are released afterwards."""
+    try:
+        if leases and not os.path.exists(path):
+            return None  # Renamed by the worker that held it
+        return process_file(os.path.dirname(path), os.path.basename(path), leases=leases, **kwargs)
+    finally:
+        if leases: leases.release_all()
+
+def process_directory(directory, dry_run=True, target_file=None, progress_callback=None, custom_cover_dir=None,
+                      recursive=False, include=None, exclude=None, scan_workers=1, resume=False, journal=None,
+                      control=None, prefetch=True, dedupe=True, leases=None):
+    """
+    journal: an open BatchJournal to record into (the GUI shares one across its per-file calls).
+    Otherwise a journal is opened for this run; resume=True continues the last unfinished one.
+    control: a job_control.JobControl to pause/cancel the run from another thread. A cancel
+    raises job_control.Cancelled once the interrupted stage has rolled back.
+    prefetch: start metadata/cover lookups for later files while earlier ones are processed.
+    dedupe: skip files whose content is already in the library under another name.
+    leases: a work_leases.LeaseManager to share the directory with other workers (distributed
+    mode): files leased by another worker are skipped, then revisited once the rest is done.
+    """
     if progress_callback: progress_callback(0, 0, "Scanning directory...")
-    print(f"Scanning directory: {directory}")
+    print(f"Scanning directory: {directory}{' (recursive)' if recursive else ''}")
     print(f"Mode: {'DRY RUN (No changes)' if dry_run else 'LIVE (Renaming files)'}")
     if target_file: print(f"Target: Single file '{target_file}'")
     
     # Setup Cover Directory once
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    label_dir = os.path.dirname(script_dir)  # Parent of rename/
-    # If custom dir provided, use that. Else default to label/cover.
-    cover_dir = custom_cover_dir if custom_cover_dir else os.path.join(label_dir, "cover")
+    cover_dir = get_cover_dir(custom_cover_dir)
     print(f"Cover Output Directory: {cover_dir}")
     print("-" * 50)
     
+    own_journal = journal is None and not dry_run
+    if own_journal:
+        batch_journal.sweep_temp_files(directory)
+        journal = batch_journal.BatchJournal.open("rename", resume=resume, dir=os.path.abspath(directory))
+    
+    prefetcher = None
     try:
-        files = sorted(os.listdir(directory))
-        for i, filename in enumerate(files):
-            if target_file and filename != target_file: continue
-            if not filename.lower().endswith(".mp4"): continue
-            
-            # Progress: Start of file (Analyze) - 10%
-            if progress_callback: progress_callback(i, 10, f"Analyzing: {filename}")
-            print(f"\nAnalyzing: {filename}")
-            
-            clean_name = re.sub(r'^[^@]+@', '', filename)
-            
-            # Check for FC2
-            is_fc2 = False
-            fc2_match = re.search(r'(FC2(?:PPV)?)-?(\d+)', clean_name, re.IGNORECASE)
-            if fc2_match:
-                is_fc2 = True
-                code_prefix = fc2_match.group(1).upper()
-                if code_prefix == "FC2": code_prefix = "FC2-PPV"
-                code_num = fc2_match.group(2)
-                code = f"{code_prefix}-{code_num}"
-                print(f"  Identified FC2: {code}")
-
-            # 1. Extraction Logic
-            if not is_fc2:
-                # Pattern: LETTERS + DASH + DIGITS or LETTERS + PADDED_DIGITS
-                # Examples: ABW-009, IPTD-764, iptd00764, WANZ00684
-                
-                # First try: standard format with hyphen (ABW-009)
-                match = re.search(r'^([A-Z]+)-(\d+)', clean_name, re.IGNORECASE)
-                if match:
-                    code = f"{match.group(1).upper()}-{match.group(2)}"
-                else:
-                    # Second try: no hyphen format (iptd00764, WANZ00684)
-                    # Convert to standard: LETTERS-DIGITS
-                    match = re.search(r'^([A-Z]+)(\d+)', clean_name, re.IGNORECASE)
-                    if not match:
-                        print(f"  Skipping: Could not extract code from {filename}")
-                        continue
-                    prefix = match.group(1).upper()
-                    num_str = match.group(2)
-                    num_int = int(num_str)
-                    
-                    # DV uses 4 digits, most others use 3 digits
-                    if prefix == "DV":
-                        code = f"{prefix}-{num_int:04d}"
-                    else:
-                        code = f"{prefix}-{num_int:03d}"
-                print(f"  Code: {code}")
-            
-            # 1.5. Corruption Check
-            file_path = os.path.join(directory, filename)
-            is_corrupted, error_msg = check_file_structure(file_path)
-            if is_corrupted:
-                print(f"  [WARNING] {error_msg}")
-                success, repaired_path = repair_with_ffmpeg(file_path)
-                if success: file_path = repaired_path
-                else: continue
-            
-            # 2. Check Labeled
-            already_labeled = bool(re.search(r'[\u3040-\u30ff]', filename))
-            if already_labeled:
-                if has_cover(file_path):
-                    print(f"  [INFO] File has Japanese title AND cover art. Skipping.")
-                    if not target_file: continue
-                else:
-                    print(f"  [INFO] File has title but NO cover. Proceeding to fetch...")
-
-            # 3. Handle Suffixes
-            name_without_ext = os.path.splitext(filename)[0]
-            rest = name_without_ext[len(code):]
-            rest_upper_raw = rest.upper()
-            has_restored = bool(re.search(r'\.?RESTOR(ED?)?($|[^A-Z])', rest_upper_raw))
-            rest = re.sub(r'-\d{2}\.\d{2}\.\d{2}\.\d{3}-\d{2}\.\d{2}\.\d{2}\.\d{3}', '', rest)
-            rest = re.sub(r'-cut-merged-\d+', '', rest)
-            rest = re.sub(r'\.restored.*', '', rest, flags=re.IGNORECASE)
-            
-            suffix = ""
-            rest_upper = rest.upper()
-            if has_restored and "无码" not in rest_upper: suffix = " 无码-lada"
-            elif "无码-LADA-C" in rest_upper: suffix = " 无码-lada-C"
-            elif "-C 无码-LADA" in rest_upper or "-C无码-LADA" in rest_upper: suffix = "-C 无码-lada"
-            elif "无码-LADA" in rest_upper: suffix = " 无码-lada"
-            elif rest_upper.endswith('-UC'): suffix = " 无码-lada-C"
-            elif rest_upper.endswith('-U'): suffix = " 无码-lada"
-            elif rest_upper.endswith('-C'): suffix = "-C" 
-            else:
-                suffix_match = re.search(r'(-[0-9A-Z]+)$', rest, re.IGNORECASE)
-                if suffix_match: suffix = suffix_match.group(1).upper()
-
-            print(f"  Code: {code}")
-
-            # 4. Fetch Title & Cover
-            if progress_callback: progress_callback(i, 50, "Fetching metadata...")
-            if is_fc2:
-                # FC2 Scraping
-                try:
-                    from fc2_scraper import get_fc2_metadata
-                    print(f"  [FC2] Scraping metadata for {code_num}...")
-                    jp_title, cover_url = get_fc2_metadata(code_num)
-                    if not jp_title:
-                        print("  [FC2] Web scraping failed.")
-                        # Fallback
-                        temp_name = clean_name
-                        temp_name = re.sub(r'FC2(?:PPV)?-?\d+', '', temp_name, flags=re.IGNORECASE)
-                        temp_name = re.sub(r'-[A-Z0-9]+(\.mp4)', r'\1', temp_name, flags=re.IGNORECASE)
-                        temp_name = os.path.splitext(temp_name)[0].strip()
-                        if len(temp_name) > 5:
-                            jp_title = temp_name
-                            print(f"  [FC2] Fallback: Extracted title from filename: {jp_title}")
-                except Exception as e:
-                    print(f"  [FC2] Error: {e}")
-                    jp_title, cover_url = None, None
-            else:
-                # JavTrailers Scraping via Cloudscraper
-                jp_title, cover_url = get_metadata_via_jt_cloudscraper(code)
-            
-            if not jp_title:
-                 print("  FAILED to fetch title. Skipping.")
-                 continue
-                 
-            print(f"  Fetched Title: {jp_title}")
-            if cover_url: print(f"  Fetched Cover URL: {cover_url}")
-            else: print("  [WARN] No cover URL found.")
-
-            # 5. Construct New Name
-            new_filename = f"{code} {jp_title}{suffix}.mp4"
-            new_filename = clean_filename(new_filename)
-            
-            if progress_callback: progress_callback(i, 70, "Renaming...")
-            
-            do_rename = True
-            if new_filename == filename:
-                print("  [SKIP] New filename is identical to old.")
-                do_rename = False
-            elif jp_title in filename and not target_file:
-                 print("  [SKIP] Filename already contains title.")
-                 do_rename = False
-            
-            if do_rename:
-                print(f"  [RENAME] '{filename}'\n        -> '{new_filename}'")
-            
-            if not dry_run:
-                final_path = os.path.join(directory, filename)
-                if do_rename:
-                    try:
-                        old_path = os.path.join(directory, filename)
-                        new_path = os.path.join(directory, new_filename)
-                        os.rename(old_path, new_path)
-                        print("    Success Rename.")
-                        final_path = new_path
-                    except OSError as e:
-                        print(f"    Error renaming: {e}")
-                        final_path = old_path
-
-                # PROCESS & EMBED COVER
-                if cover_url:
-                    if progress_callback: progress_callback(i, 90, "Downloading & Embedding Cover...")
-                    try:
-                        print(f"    [Cover] Downloading: {cover_url}")
-                        c_scraper = cloudscraper.create_scraper() # reuse scraper
-                        resp = c_scraper.get(cover_url, timeout=15)
-                        resp.raise_for_status()
-                        raw_data = resp.content
-                        
-                        clean_cover_name = clean_filename(f"{code} {jp_title}")
-                        clean_cover_name = clean_filename(f"{code} {jp_title}")
-                        
-                        # Use cover_dir calculated at start of function
-                        os.makedirs(cover_dir, exist_ok=True)
-                        cover_save_path = os.path.join(cover_dir, f"{clean_cover_name}.jpg")
-                        
-                        processed_data = process_and_save_cover(raw_data, cover_save_path)
-                        print(f"    [Cover] Saved to: {os.path.basename(cover_save_path)}")
-                        embed_cover(final_path, processed_data)
-                        
-                    except Exception as e:
-                         print(f"    [Cover] Error handling cover: {e}")
-            
-            if progress_callback: progress_callback(i, 100, "Done.")
+        with job_control.active(control):
+            # Streaming scan: the first files are processed while deeper folders are still being listed
+            files = scan_videos(directory, recursive=recursive, include=include, exclude=exclude, workers=scan_workers,
+                                extensions=RENAMABLE_EXTENSIONS)
+            if prefetch and not target_file:
+                # Lookups for later files run in the background while earlier files are on disk
+                import prefetch as prefetch_module
+                prefetcher = prefetch_module.Prefetcher(cover_dir, fetch_covers=not dry_run)
+                files = prefetcher.scan_ahead(files)
+            busy = []
+            for i, entry in enumerate(files):
+                if target_file and entry.name != target_file: continue
+                if journal and journal.is_done(entry.path):
+                    print(f"\n[Resume] Already done in previous run: {entry.name}")
+                    continue
+                if leases and not leases.claim(entry.path):
+                    print(f"\n[Lease] Held by another worker, later: {entry.name}")
+                    run_report.add("lease.busy")
+                    busy.append(entry.path)
+                    continue
+                _process_leased(entry.path, leases, dry_run=dry_run, target_file=target_file,
+                                progress_callback=progress_callback, cover_dir=cover_dir, index=i, journal=journal,
+                                dedupe=dedupe)
+            if busy:
+                # Released when their worker finished them (then usually renamed away), or expired
+                for path in leases.revisit(busy):
+                    _process_leased(path, leases, dry_run=dry_run, cover_dir=cover_dir, journal=journal,
+                                    dedupe=dedupe)
+        if own_journal: journal.close()
 
+    except job_control.Cancelled:
+        print("\n[Cancelled] Stopped by user. Finished files are kept; run again for the rest.")
+        if own_journal: journal.close()
+        raise
     except Exception as e:
         print(f"Unhandled error: {e}")
+    finally:
+        if prefetcher: prefetcher.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Rename MP4 files and embed cover art (Using Cloudscraper/JavTrailers).")
     # Use relative path for cross-platform compatibility
     script_dir = os.path.dirname(os.path.abspath(__file__))
     default_dir = os.path.dirname(script_dir)  # Parent of rename/ = label/
+    parser.add_argument("paths", nargs="*", help="Files or folders to process (e.g. dropped onto _drag_to_rename.bat); overrides --dir")
     parser.add_argument("--dir", default=default_dir, help="Directory to scan")
     parser.add_argument("--dry-run", action="store_true", help="Dry run mode (no changes)")
     parser.add_argument("--target", help="Process specific file only")
     parser.add_argument("--yes", action="store_true", help="Skip confirmation for live mode")
+    parser.add_argument("--recursive", "-r", action="store_true", help="Also scan subdirectories")
+    parser.add_argument("--include", action="append", help="Glob of files to include (repeatable, e.g. 'S1/*')")
+    parser.add_argument("--exclude", action="append", help="Glob of files/folders to skip (repeatable)")
+    parser.add_argument("--scan-workers", type=int, default=1, help="Parallel directory listings for --recursive (helps on NAS)")
+    parser.add_argument("--resume", action="store_true", help="Continue the last interrupted batch, skipping files it finished")
+    parser.add_argument("--no-prefetch", action="store_true", help="Look up each file only when the batch reaches it")
+    parser.add_argument("--allow-duplicates", action="store_true", help="Process files even if the same content is already in the library")
+    parser.add_argument("--plan", metavar="PLAN", help="Resolve metadata/covers concurrently and write a JSON/CSV plan (videos untouched)")
+    parser.add_argument("--plan-workers", type=int, default=8, help="Concurrent lookups for --plan / files for --apply-plan")
+    parser.add_argument("--apply-plan", metavar="PLAN", help="Execute a plan written by --plan (no network access)")
+    parser.add_argument("--io-per-volume", type=int, default=1, help="Concurrent heavy rewrites (ffmpeg/cover save) per physical volume")
+    parser.add_argument("--service", action="store_true", help="Queue the work on the local worker service (started if needed) and follow it")
+    parser.add_argument("--watch", action="store_true", help="Keep running and process new MP4 files as they arrive in --dir")
+    parser.add_argument("--settle", type=float, default=10.0, help="Watch mode: seconds a file must stay unchanged before processing")
+    parser.add_argument("--initial-scan", action="store_true", help="Watch mode: also queue MP4 files already present in --dir")
+    parser.add_argument("--cover-dir", help="Cover folder (default: label/cover); point all machines at one shared folder")
+    parser.add_argument("--distributed", action="store_true", help="Share --dir with workers on other machines/processes (lease files)")
+    parser.add_argument("--lease-ttl", type=float, default=work_leases.DEFAULT_TTL, help="Distributed: seconds without heartbeat before a worker's lease is taken over")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", help="Write the metrics to this file on exit")
     args = parser.parse_args()
+    metrics.start(args.metrics_port, args.metrics_file)
     
-    if not args.dry_run and not args.yes:
+    if not args.dry_run and not args.yes and not args.plan:
         print("WARNING: You are running in LIVE mode. Files will be renamed.")
     
-    process_directory(args.dir, dry_run=args.dry_run, target_file=args.target)
+    if args.service:
+        # The long-lived worker keeps sessions and caches warm; it also does the journal recovery
+        import worker_service
+        client = worker_service.connect(start=True)
+        if not client:
+            print("Could not start the worker service.")
+            sys.exit(1)
+        job_id = client.submit("rename", args.paths or [args.dir], dry_run=args.dry_run, recursive=args.recursive)
+        print(f"Queued job {job_id} on the worker service.")
+        job = worker_service.wait_for_job(client, job_id)
+        sys.exit(0 if job and job["state"] == "done" else 1)
+
+    # Roll back temp files / half-swapped videos left by an interrupted run
+    batch_journal.recover()
+    io_scheduler.configure(default_limit=args.io_per_volume)
+    
+    if args.plan:
+        import rename_plan
+        entries = rename_plan.build_plan(args.dir, custom_cover_dir=args.cover_dir, workers=args.plan_workers,
+                                         recursive=args.recursive, include=args.include, exclude=args.exclude,
+                                         scan_workers=args.scan_workers)
+        rename_plan.write_plan(entries, args.plan)
+    elif args.apply_plan:
+        import rename_plan
+        rename_plan.apply_plan(args.apply_plan, resume=args.resume, workers=args.plan_workers)
+        run_report.print_summary()
+    elif args.watch:
+        from watch_folder import watch_directory
+        watch_directory(args.dir, dry_run=args.dry_run, settle_seconds=args.settle, initial_scan=args.initial_scan,
+                        custom_cover_dir=args.cover_dir)
+    elif args.paths:
+        # Several dropped files/folders in one process: imports and the scraper session are paid once
+        files = [os.path.abspath(p) for p in args.paths if not os.path.isdir(p)]
+        leases = work_leases.LeaseManager(ttl=args.lease_ttl) if args.distributed else None
+        prefetcher = None
+        if len(files) > 1 and not args.no_prefetch:
+            import prefetch
+            prefetcher = prefetch.Prefetcher(get_cover_dir(args.cover_dir), fetch_covers=not args.dry_run).add_all(files)
+        for path in args.paths:
+            path = os.path.abspath(path)
+            print(f"Processing: {path}")
+            if os.path.isdir(path):
+                process_directory(path, dry_run=args.dry_run, custom_cover_dir=args.cover_dir, recursive=args.recursive,
+                                  include=args.include, exclude=args.exclude, scan_workers=args.scan_workers,
+                                  resume=args.resume, prefetch=not args.no_prefetch, dedupe=not args.allow_duplicates,
+                                  leases=leases)
+            else:
+                process_directory(os.path.dirname(path), dry_run=args.dry_run, target_file=os.path.basename(path),
+                                  custom_cover_dir=args.cover_dir, resume=args.resume, leases=leases)
+        if prefetcher: prefetcher.close()
+        if leases: leases.close()
+        run_report.print_summary()
+    else:
+        leases = work_leases.LeaseManager(ttl=args.lease_ttl) if args.distributed else None
+        process_directory(args.dir, dry_run=args.dry_run, target_file=args.target, custom_cover_dir=args.cover_dir,
+                          recursive=args.recursive, include=args.include, exclude=args.exclude,
+                          scan_workers=args.scan_workers, resume=args.resume, prefetch=not args.no_prefetch,
+                          dedupe=not args.allow_duplicates, leases=leases)
+        if leases: leases.close()
+        run_report.print_summary()
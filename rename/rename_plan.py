@@ -0,0 +1,217 @@
+"""
+Plan / apply-plan mode.
+
+Planning resolves everything that needs the network (metadata lookup and
+cover download/crop into the cover folder) for all files concurrently and
+writes the result to a JSON or CSV plan. Applying a plan later only touches
+the local disk: repair, rename and cover embedding, with zero network calls.
+
+Usage:
+    python rename_movies.py --dir "H:\\Videos" --plan plan.json [--plan-workers 8]
+    python rename_movies.py --apply-plan plan.json
+"""
+
+import os
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import rename_movies
+import code_parser
+import batch_journal
+import run_report
+from library_scan import scan_videos, RENAMABLE_EXTENSIONS
+
+PLAN_VERSION = 1
+FIELDS = ["status", "old_path", "new_name", "code", "suffix", "is_fc2", "title",
+          "cover_url", "cover_path", "actions", "size", "mtime"]
+
+
+def plan_file(entry, cover_dir):
+    """Resolve one file into a plan entry (no changes to the video itself)."""
+    filename = entry.name
+    path = os.path.abspath(entry.path)
+    st = entry.stat()
+    item = {"status": "ok", "old_path": path, "new_name": filename, "code": None, "suffix": "",
+            "is_fc2": False, "title": None, "cover_url": None, "cover_path": None, "actions": [],
+            "size": st.st_size, "mtime": st.st_mtime}
+
+    code, suffix, is_fc2 = code_parser.parse_filename(filename)
+    if not code:
+        item["status"] = "no_code"
+        return item
+    item.update(code=code, suffix=suffix, is_fc2=is_fc2)
+
+    ext = os.path.splitext(filename)[1].lower()
+    is_corrupted = ext != ".mkv" and rename_movies.check_file_structure(path)[0]
+    if is_corrupted:
+        item["actions"].append("repair")
+    elif rename_movies.already_done(path, filename, code):
+        item["status"] = "done"
+        return item
+
+    title, cover_url = rename_movies.fetch_metadata(code, is_fc2, code_parser.clean_name(filename))
+    if not title:
+        item["status"] = "no_title"
+        return item
+    item.update(title=title, cover_url=cover_url)
+
+    new_name = rename_movies.build_new_filename(code, title, suffix, ext=ext)
+    if rename_movies.should_rename(filename, new_name, title):
+        item["new_name"] = new_name
+        item["actions"].append("rename")
+
+    if cover_url:
+        try:
+            cover_path = rename_movies.obtain_cover(code, title, cover_url, cover_dir)
+            item["cover_path"] = os.path.abspath(cover_path)
+            item["actions"].append("embed_cover")
+        except Exception as e:
+            print(f"    [Cover] Error handling cover for {code}: {e}")
+    return item
+
+
+def build_plan(directory, custom_cover_dir=None, workers=8, recursive=False, include=None, exclude=None,
+               scan_workers=1):
+    """Resolve all files under `directory` concurrently. Returns plan entries in scan order."""
+    cover_dir = rename_movies.get_cover_dir(custom_cover_dir)
+    print(f"Planning: {directory} ({workers} concurrent lookups)")
+    print(f"Cover Output Directory: {cover_dir}")
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Submit while scanning, so lookups start before the tree is fully listed
+        futures = [executor.submit(plan_file, entry, cover_dir)
+                   for entry in scan_videos(directory, recursive=recursive, include=include,
+                                            exclude=exclude, workers=scan_workers, extensions=RENAMABLE_EXTENSIONS)]
+        entries = []
+        for future in futures:
+            try:
+                entries.append(future.result())
+            except Exception as e:
+                print(f"  [Plan] Error: {e}")
+
+    print(f"\n{'-' * 50}\nPlan ({len(entries)} files, {time.time() - start:.1f}s):")
+    for item in entries:
+        name = os.path.basename(item["old_path"])
+        if item["status"] != "ok":
+            print(f"  [{item['status'].upper()}] {name}")
+        elif item["actions"]:
+            print(f"  [{'+'.join(item['actions'])}] {name} -> {item['new_name']}")
+    return entries
+
+
+def write_plan(entries, path):
+    if path.lower().endswith(".csv"):
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            for item in entries:
+                writer.writerow({**item, "actions": "|".join(item["actions"])})
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"version": PLAN_VERSION, "created": time.time(), "entries": entries},
+                      f, ensure_ascii=False, indent=1)
+    print(f"Plan written to: {path}")
+
+
+def load_plan(path):
+    if path.lower().endswith(".csv"):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            entries = []
+            for row in csv.DictReader(f):
+                row["actions"] = [a for a in row["actions"].split("|") if a]
+                row["is_fc2"] = row["is_fc2"] == "True"
+                row["size"] = int(row["size"])
+                row["mtime"] = float(row["mtime"])
+                entries.append(row)
+            return entries
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version: {data.get('version')}")
+    return data["entries"]
+
+
+def apply_entry(item, journal, progress_callback=None, index=0):
+    """Execute one plan entry using only local files. Returns the final path or None."""
+    path = item["old_path"]
+    actions = item["actions"]
+    if item["status"] != "ok" or not actions: return None
+
+    print(f"\nApplying: {os.path.basename(path)}")
+    try:
+        st = os.stat(path)
+    except OSError:
+        print("  [SKIP] File no longer exists.")
+        run_report.add("plan.missing")
+        return None
+    if st.st_size != item["size"] or abs(st.st_mtime - item["mtime"]) > 1:
+        print("  [SKIP] File changed since the plan was made. Re-plan it.")
+        run_report.add("plan.changed")
+        return None
+
+    if "repair" in actions:
+        if progress_callback: progress_callback(index, 30, "Repairing...")
+        ok, path = rename_movies.repair_with_ffmpeg(path, journal=journal)
+        if not ok: return None
+
+    final_path = path
+    if "rename" in actions:
+        if progress_callback: progress_callback(index, 60, "Renaming...")
+        new_path = os.path.join(os.path.dirname(path), item["new_name"])
+        if os.path.exists(new_path):
+            print(f"  [SKIP] Target already exists: {item['new_name']}")
+        else:
+            journal.record(path, "rename", "intent", new=new_path)
+            os.rename(path, new_path)
+            journal.record(path, "rename", "done", new=new_path)
+            rename_movies.catalog_moved(path, new_path)
+            print(f"  [RENAME] -> '{item['new_name']}'")
+            final_path = new_path
+
+    if "embed_cover" in actions:
+        if progress_callback: progress_callback(index, 90, "Embedding Cover...")
+        cover_path = item.get("cover_path")
+        if cover_path and os.path.exists(cover_path):
+            print(f"[COVER_PATH] {cover_path}")
+            journal.record(final_path, "cover", "intent")
+            rename_movies.embed_cover(final_path, cover_path, journal=journal, title=item["title"],
+                                      code=item["code"], source=rename_movies.metadata_source(item["is_fc2"]))
+            journal.record(final_path, "cover", "done")
+        else:
+            print(f"  [Cover] Planned cover is missing: {cover_path}")
+
+    journal.file_done(item["old_path"], final=final_path)
+    run_report.add("plan.applied")
+    if progress_callback: progress_callback(index, 100, "Done.")
+    return final_path
+
+
+def apply_plan(path, resume=False, progress_callback=None, workers=4):
+    """
+    Execute a plan. Entries run concurrently; the heavy steps (repair, cover
+    embedding) take io_scheduler slots, so each volume still sees at most its
+    configured number of rewrites while different volumes proceed in parallel.
+    """
+    entries = load_plan(path)
+    todo = [item for item in entries if item["status"] == "ok" and item["actions"]]
+    print(f"Applying plan: {path} ({len(todo)} of {len(entries)} entries need changes)")
+
+    for directory in sorted({os.path.dirname(item["old_path"]) for item in todo}):
+        batch_journal.sweep_temp_files(directory)
+    journal = batch_journal.BatchJournal.open("apply-plan", resume=resume, plan=os.path.abspath(path))
+
+    def run(i, item):
+        if journal.is_done(item["old_path"]):
+            print(f"\n[Resume] Already applied: {os.path.basename(item['old_path'])}")
+            return
+        try:
+            apply_entry(item, journal, progress_callback, i)
+        except Exception as e:
+            print(f"  [ERROR] {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(run, range(len(todo)), todo))
+    journal.close()
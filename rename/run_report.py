@@ -0,0 +1,64 @@
+"""
+Per-run counters, printed as a summary at the end of a batch.
+
+Counter names are dotted ("faststart.skipped"); names ending in "bytes"
+are printed as sizes. set() stores a current value instead of a count
+(e.g. a latency). Safe to update from worker threads.
+
+totals() keeps the add() counts since the process started (reset() starts
+a new run, not new totals); metrics exports them.
+"""
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_totals = {}
+
+
+def add(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+        _totals[name] = _totals.get(name, 0) + amount
+
+
+def set(name, value):
+    with _lock:
+        _counters[name] = value
+
+
+def get(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+def totals():
+    with _lock:
+        return dict(_totals)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def print_summary(title="Run report"):
+    counters = snapshot()
+    if not counters: return
+    print(f"\n{'-' * 50}\n{title}:")
+    for name in sorted(counters):
+        value = counters[name]
+        shown = format_bytes(value) if name.endswith("bytes") else value
+        print(f"  {name:<32} {shown}")
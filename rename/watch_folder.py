@@ -0,0 +1,250 @@
+"""
+Watch-folder mode: keep running and feed new MP4 files into the rename pipeline.
+
+Files are only processed once they are stable (size/mtime unchanged for
+`settle_seconds` and no other process holds them open for writing).
+Pending files are kept in a small JSON queue inside the watched directory,
+so a restart picks up where the previous run stopped.
+
+Uses `watchdog` for filesystem events when installed, otherwise polls.
+
+Usage:
+    python rename_movies.py --dir "D:\\Downloads" --watch
+    python watch_folder.py "D:\\Downloads" [--dry-run] [--settle 10]
+"""
+
+import os
+import json
+import time
+import threading
+import argparse
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+import rename_movies
+import batch_journal
+import metrics
+from library_scan import RENAMABLE_EXTENSIONS
+
+QUEUE_FILENAME = ".javcover_watch_queue.json"
+POLL_INTERVAL = 5.0
+
+
+def _has_open_writer(path):
+    """Best-effort check whether another process still has the file open for writing."""
+    if os.name == 'nt':
+        # Windows refuses to rename a file that a downloader keeps open without FILE_SHARE_DELETE
+        try:
+            os.rename(path, path)
+            return False
+        except OSError:
+            return True
+
+    proc_dir = "/proc"
+    if not os.path.isdir(proc_dir):
+        return False
+    real = os.path.realpath(path)
+    try:
+        pids = [p for p in os.listdir(proc_dir) if p.isdigit()]
+    except OSError:
+        return False
+    for pid in pids:
+        fd_dir = os.path.join(proc_dir, pid, "fd")
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                if os.readlink(os.path.join(fd_dir, fd)) != real: continue
+                with open(os.path.join(proc_dir, pid, "fdinfo", fd)) as info:
+                    for line in info:
+                        if line.startswith("flags:"):
+                            # O_WRONLY = 1, O_RDWR = 2
+                            if int(line.split()[1], 8) & 0o3:
+                                return True
+            except (OSError, ValueError):
+                continue
+    return False
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory: self.watcher.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory: self.watcher.notify(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory: self.watcher.notify(event.dest_path)
+
+
+class FolderWatcher:
+    """
+    Debounces filesystem events per file and hands stable files to the pipeline.
+    The scraper session and metadata cache in rename_movies stay alive for the
+    whole run, so only the first file pays the cold-start cost.
+    """
+
+    def __init__(self, directory, dry_run=False, settle_seconds=10.0, custom_cover_dir=None):
+        self.directory = os.path.abspath(directory)
+        self.dry_run = dry_run
+        self.settle_seconds = settle_seconds
+        self.cover_dir = rename_movies.get_cover_dir(custom_cover_dir)
+        self.queue_path = os.path.join(self.directory, QUEUE_FILENAME)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}    # filename -> (size, mtime, last_change_time)
+        self._produced = set()  # names we already processed (renames/cover writes fire events too)
+        self._seen = set()
+        self._journal = None
+        metrics.set_gauge("queue_depth", lambda: len(self._pending), queue="watch")
+        self._load_queue()
+
+    # --- Persistent queue ---
+    def _load_queue(self):
+        try:
+            with open(self.queue_path, 'r', encoding='utf-8') as f:
+                names = json.load(f)
+        except (OSError, ValueError):
+            return
+        for name in names:
+            self._pending[name] = (-1, -1, time.time())
+        if names:
+            print(f"[Watch] Restored {len(names)} queued file(s) from previous run.")
+
+    def _save_queue(self):
+        tmp_path = self.queue_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(sorted(self._pending), f, ensure_ascii=False)
+            os.replace(tmp_path, self.queue_path)
+        except OSError as e:
+            print(f"[Watch] Could not save queue: {e}")
+
+    # --- Events ---
+    def notify(self, path):
+        filename = os.path.basename(path)
+        if os.path.dirname(os.path.abspath(path)) != self.directory: return
+        if not filename.lower().endswith(RENAMABLE_EXTENSIONS): return
+        with self._lock:
+            if filename in self._produced: return
+            is_new = filename not in self._pending
+            self._pending[filename] = (-1, -1, time.time())
+            if is_new: self._save_queue()
+        self._wake.set()
+
+    def scan(self):
+        """Queue every video currently in the directory (initial scan / polling fallback)."""
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.lower().endswith(RENAMABLE_EXTENSIONS):
+                        with self._lock:
+                            known = entry.name in self._pending or entry.name in self._seen
+                        if not known: self.notify(entry.path)
+        except OSError as e:
+            print(f"[Watch] Scan failed: {e}")
+
+    # --- Stability ---
+    def _take_ready(self):
+        """Return filenames whose size/mtime have been unchanged for settle_seconds."""
+        now = time.time()
+        ready = []
+        with self._lock:
+            for filename, (size, mtime, since) in list(self._pending.items()):
+                path = os.path.join(self.directory, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # Vanished (moved away or renamed by someone else)
+                    del self._pending[filename]
+                    continue
+                if (st.st_size, st.st_mtime) != (size, mtime):
+                    self._pending[filename] = (st.st_size, st.st_mtime, now)
+                    continue
+                if st.st_size > 0 and now - since >= self.settle_seconds:
+                    ready.append(filename)
+        return [f for f in ready if not _has_open_writer(os.path.join(self.directory, f))]
+
+    def _process(self, filename):
+        print(f"\n[Watch] Processing: {filename}")
+        try:
+            final_name = rename_movies.process_file(
+                self.directory, filename, dry_run=self.dry_run,
+                cover_dir=self.cover_dir, journal=self._journal
+            )
+        except Exception as e:
+            print(f"[Watch] Error processing {filename}: {e}")
+            final_name = None
+        with self._lock:
+            self._pending.pop(filename, None)
+            self._seen.add(filename)
+            if final_name:
+                self._produced.add(final_name)
+                self._seen.add(final_name)
+            self._save_queue()
+
+    def run(self, initial_scan=False):
+        batch_journal.recover()
+        if not self.dry_run:
+            batch_journal.sweep_temp_files(self.directory)
+            self._journal = batch_journal.BatchJournal.open("watch", dir=self.directory)
+        observer = None
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(_EventHandler(self), self.directory, recursive=False)
+            observer.start()
+            print(f"[Watch] Watching {self.directory} (watchdog events)")
+        else:
+            print(f"[Watch] Watching {self.directory} (polling every {POLL_INTERVAL:.0f}s; pip install watchdog for events)")
+        print(f"[Watch] Mode: {'DRY RUN' if self.dry_run else 'LIVE'}, settle time {self.settle_seconds:.0f}s. Ctrl+C to stop.")
+
+        if initial_scan:
+            self.scan()
+
+        try:
+            while True:
+                self._wake.wait(timeout=min(POLL_INTERVAL, max(self.settle_seconds / 2, 1.0)))
+                self._wake.clear()
+                if observer is None:
+                    self.scan()
+                for filename in self._take_ready():
+                    self._process(filename)
+        except KeyboardInterrupt:
+            print("\n[Watch] Stopping...")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            with self._lock:
+                self._save_queue()
+            if self._journal: self._journal.close()
+            rename_movies.run_report.print_summary()
+
+
+def watch_directory(directory, dry_run=False, settle_seconds=10.0, initial_scan=False, custom_cover_dir=None):
+    """Block forever, processing new MP4 files in `directory` as they become stable."""
+    FolderWatcher(directory, dry_run=dry_run, settle_seconds=settle_seconds,
+                  custom_cover_dir=custom_cover_dir).run(initial_scan=initial_scan)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch a folder and rename/cover new MP4 files as they arrive.")
+    parser.add_argument("dir", help="Directory to watch")
+    parser.add_argument("--dry-run", action="store_true", help="Dry run mode (no changes)")
+    parser.add_argument("--settle", type=float, default=10.0, help="Seconds a file must stay unchanged before processing")
+    parser.add_argument("--initial-scan", action="store_true", help="Also queue MP4 files already present")
+    parser.add_argument("--cover-dir", help="Cover output directory")
+    args = parser.parse_args()
+    metrics.start()
+    watch_directory(args.dir, dry_run=args.dry_run, settle_seconds=args.settle,
+                    initial_scan=args.initial_scan, custom_cover_dir=args.cover_dir)
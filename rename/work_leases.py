@@ -0,0 +1,230 @@
+"""
+Lease files that let several machines work through one shared library.
+
+Each worker (any number of processes on any number of hosts) claims a file
+before touching it by creating a lease next to it:
+
+    <video folder>/.javcover_leases/<hash of the file name>.lease
+
+The lease is created with O_CREAT | O_EXCL, which is atomic on local disks
+and SMB/NFS shares alike, so exactly one worker wins. Files leased by
+someone else are skipped and revisited at the end of the run.
+
+Holders rewrite their leases every TTL/4 seconds (heartbeat). A lease whose
+content has not changed for TTL seconds, as seen by the worker looking at
+it, belongs to a dead or disconnected worker and is taken over. Expiry is
+judged on the observer's own clock, so hosts need not agree on the time.
+A takeover renames the stale lease away first: of two workers breaking it at
+once, only one rename succeeds.
+
+    leases = work_leases.LeaseManager()
+    if leases.claim(path):
+        try: ...process...
+        finally: leases.release(path)
+    leases.close()
+
+The lease is keyed on the file name only, so nodes that mount the share at
+different paths (H:\\Videos, \\\\nas\\videos, /mnt/videos) still see each other.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+
+import run_report
+import job_control
+
+LEASE_DIRNAME = ".javcover_leases"
+LEASE_SUFFIX = ".lease"
+# Seconds without a heartbeat after which a lease is taken over
+DEFAULT_TTL = 120.0
+# How often the skipped files are looked at again at the end of a run
+REVISIT_INTERVAL = 5.0
+
+
+def lease_path(path):
+    """Lease file for `path` (case-insensitive: Windows and Linux nodes share one lease)."""
+    name = hashlib.sha1(os.path.basename(path).lower().encode('utf-8')).hexdigest()[:24]
+    return os.path.join(os.path.dirname(os.path.abspath(path)), LEASE_DIRNAME, name + LEASE_SUFFIX)
+
+
+def _read(lease):
+    try:
+        with open(lease, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class LeaseManager:
+    def __init__(self, ttl=DEFAULT_TTL, node=None):
+        self.ttl = ttl
+        self.node = node or f"{socket.gethostname()}:{os.getpid()}"
+        self.token = uuid.uuid4().hex
+        self._held = {}          # lease path -> (file path, beat)
+        self._observed = {}      # lease path -> (content, local time first seen)
+        self._lost = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Claiming ---
+    def _payload(self, path, beat):
+        return json.dumps({"file": os.path.basename(path), "node": self.node, "token": self.token,
+                           "beat": beat, "time": time.time()}).encode('utf-8')
+
+    def claim(self, path):
+        """Take the lease on `path`. False if another live worker holds it."""
+        lease = lease_path(path)
+        with self._lock:
+            if lease in self._held: return True
+        for _ in range(3):
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._expired(lease) or not self._break(lease): return False
+                continue
+            except FileNotFoundError:
+                # No lease folder yet (or another worker just removed it when it emptied)
+                os.makedirs(os.path.dirname(lease), exist_ok=True)
+                continue
+            try:
+                os.write(fd, self._payload(path, 0))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            with self._lock:
+                self._held[lease] = (path, 0)
+                self._lost.discard(lease)
+                self._observed.pop(lease, None)
+            self._start()
+            run_report.add("lease.claimed")
+            return True
+        return False
+
+    def _expired(self, lease):
+        """True once the lease content has stayed the same for `ttl` seconds of our own clock."""
+        content = _read(lease)
+        if content is None: return True
+        now = time.monotonic()
+        seen = self._observed.get(lease)
+        if seen is None or seen[0] != content:
+            self._observed[lease] = (content, now)
+            return False
+        return now - seen[1] >= self.ttl
+
+    def _break(self, lease):
+        """Remove a stale lease. False if another worker broke it first or its owner came back."""
+        stale = self._observed.pop(lease, (None,))[0]
+        broken = f"{lease}.{self.token}.broken"
+        try:
+            os.rename(lease, broken)
+        except FileNotFoundError:
+            return True   # Released or broken by someone else meanwhile: just try to create it
+        except OSError:
+            return False
+        if _read(broken) != stale:
+            # The owner wrote a heartbeat just now: put its lease back
+            try:
+                os.rename(broken, lease)
+                return False
+            except OSError:
+                pass
+        try:
+            os.remove(broken)
+        except OSError:
+            pass
+        try:
+            info = json.loads(stale)
+        except (TypeError, ValueError):
+            info = {}
+        print(f"  [Lease] Took over expired lease of {info.get('node', 'unknown worker')} on {info.get('file', lease)}")
+        run_report.add("lease.expired_taken")
+        return True
+
+    def holds(self, path):
+        """Still ours (False if it expired while we were stalled and another worker took it)."""
+        lease = lease_path(path)
+        with self._lock:
+            return lease in self._held and lease not in self._lost
+
+    # --- Releasing ---
+    def release(self, path):
+        lease = lease_path(path)
+        with self._lock:
+            held = self._held.pop(lease, None)
+            self._lost.discard(lease)
+        if held is None: return
+        content = _read(lease)
+        try:
+            if content and json.loads(content).get("token") == self.token: os.remove(lease)
+        except (OSError, ValueError):
+            pass
+        try:
+            os.rmdir(os.path.dirname(lease))   # Only succeeds once no worker holds a lease there
+        except OSError:
+            pass
+
+    def release_all(self):
+        with self._lock:
+            paths = [path for path, _ in self._held.values()]
+        for path in paths: self.release(path)
+
+    def close(self):
+        self.release_all()
+        self._stop.set()
+        if self._thread: self._thread.join(timeout=5)
+
+    # --- Heartbeat ---
+    def _start(self):
+        with self._lock:
+            if self._thread is not None: return
+            self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 4):
+            with self._lock:
+                held = list(self._held.items())
+            for lease, (path, beat) in held:
+                try:
+                    content = _read(lease)
+                    if not content or json.loads(content).get("token") != self.token:
+                        raise FileNotFoundError(lease)
+                    with open(lease, 'r+b') as f:
+                        f.write(self._payload(path, beat + 1))
+                        f.truncate()
+                    with self._lock:
+                        if lease in self._held: self._held[lease] = (path, beat + 1)
+                except (OSError, ValueError):
+                    with self._lock:
+                        if lease not in self._held or lease in self._lost: continue
+                        self._lost.add(lease)
+                    print(f"  [Lease] WARNING: lost the lease on {os.path.basename(path)} (taken over by another worker)")
+                    run_report.add("lease.lost")
+
+    # --- Skipped files ---
+    def revisit(self, paths):
+        """
+        Yield the paths (held by other workers when first seen) as they become claimable:
+        released by a worker that finished them, or expired. Paths that no longer exist
+        (renamed by the worker that processed them) are dropped.
+        """
+        pending = list(paths)
+        while pending:
+            still = []
+            for path in pending:
+                if not os.path.exists(path): continue
+                if self.claim(path): yield path
+                else: still.append(path)
+            pending = still
+            if pending:
+                print(f"  [Lease] Waiting for {len(pending)} file(s) held by other workers...")
+                deadline = time.monotonic() + REVISIT_INTERVAL
+                while time.monotonic() < deadline:
+                    job_control.checkpoint()
+                    time.sleep(job_control.POLL_INTERVAL)
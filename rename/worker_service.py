@@ -0,0 +1,615 @@
+#!/usr/bin/env python
+"""
+Local worker service: one long-lived process with one job queue.
+
+The GUI, the CLI (--service) and the drag-and-drop scripts submit jobs here
+instead of each starting its own pipeline. Jobs run one after another, so
+two clicks queue instead of overlapping, and the scraper session, metadata
+cache and cover index stay warm between jobs.
+
+The API is JSON over HTTP on 127.0.0.1 (an ephemeral port). The port and an
+access token are written to <data dir>/worker.json; every request must send
+the token in the X-JavCover-Token header.
+
+    POST /jobs              {"kind": "rename"|"manual"|"faststart", "paths": [...], "options": {...}}
+    GET  /jobs              all jobs (newest last)
+    GET  /jobs/<id>         one job: state, progress, results, run report, last cover
+                            (?since=N adds "log": its output lines from N on, and "log_next")
+    POST /jobs/<id>/cancel  cancel a queued job / stop a running one now (the current step is rolled back)
+    POST /jobs/<id>/pause   hold a running job at its next checkpoint (see job_control)
+    POST /jobs/<id>/resume
+    GET  /health
+    POST /shutdown
+
+Usage:
+    python worker_service.py serve [--idle-exit 600]
+    python worker_service.py submit rename "H:\\Videos\\a.mp4" "E:\\More" [--dry-run] [--wait]
+    python worker_service.py status [JOB]
+    python worker_service.py cancel JOB
+    python worker_service.py pause|resume JOB
+    python worker_service.py stop
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import secrets
+import argparse
+import threading
+import subprocess
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app_paths import data_dir
+import job_control
+import metrics
+
+if sys.stdout is not None:
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+    except AttributeError:
+        pass
+
+JOB_KINDS = ("rename", "manual", "faststart")
+# Finished jobs kept for status queries
+KEEP_FINISHED_JOBS = 100
+INFO_FILENAME = "worker.json"
+TOKEN_HEADER = "X-JavCover-Token"
+# A service started on demand by a client exits after this long without jobs
+DEFAULT_IDLE_EXIT = 600
+# Output lines kept per job for clients (their own console / log pane)
+JOB_LOG_LINES = 1000
+COVER_PATH_TAG = "[COVER_PATH]"
+
+
+def _info_path():
+    return os.path.join(data_dir(), INFO_FILENAME)
+
+
+class JobLog:
+    """
+    Stands in for sys.stdout while a job runs: output still goes to `stream` (the
+    console or worker.log), and the last JOB_LOG_LINES lines are kept for
+    GET /jobs/<id>?since=N. [COVER_PATH] lines set job["cover"] instead.
+    """
+
+    def __init__(self, job, stream, max_lines=JOB_LOG_LINES):
+        self.job = job
+        self.stream = stream
+        self.lines = deque(maxlen=max_lines)
+        self.total = 0
+        self._partial = ""
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if self.stream is not None:
+            try:
+                self.stream.write(text)
+            except Exception:
+                pass
+        with self._lock:
+            *lines, self._partial = (self._partial + text).split("\n")
+            for line in lines: self._add(line)
+        return len(text)
+
+    def _add(self, line):
+        line = line.rstrip("\r")
+        if line.startswith(COVER_PATH_TAG):
+            self.job["cover"] = line[len(COVER_PATH_TAG):].strip()
+            return
+        self.lines.append(line)
+        self.total += 1
+
+    def flush(self):
+        if self.stream is not None:
+            try:
+                self.stream.flush()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._partial: self._add(self._partial)
+            self._partial = ""
+
+    def since(self, index):
+        """(lines from `index` on that are still kept, index of the next line)."""
+        with self._lock:
+            first = self.total - len(self.lines)
+            return list(self.lines)[max(index - first, 0):], self.total
+
+
+class WorkerService:
+    """The job queue and its worker thread; serve_http() exposes it on localhost."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._controls = {}
+        self._logs = {}
+        self._order = []
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._server = None
+        self._last_activity = time.time()
+        self._stopped = threading.Event()
+
+    # --- Job queue ---
+    def submit(self, kind, paths, **options):
+        if kind not in JOB_KINDS: raise ValueError(f"Unknown job kind: {kind}")
+        job = {"id": uuid.uuid4().hex[:12], "kind": kind, "paths": [os.path.abspath(p) for p in paths],
+               "options": options, "state": "queued", "created": time.time(), "started": None,
+               "finished": None, "total": len(paths), "completed": 0,
+               "current": {"index": 0, "file": None, "pct": 0, "msg": "Queued"},
+               "results": [], "unresolved": [], "report": {}, "cover": None, "error": None, "cancel": False,
+               "paused": False}
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._controls[job["id"]] = job_control.JobControl()
+            self._order.append(job["id"])
+            self._prune()
+        self._queue.put(job["id"])
+        print(f"[Service] Queued {kind} job {job['id']} ({len(paths)} path(s))")
+        return job["id"]
+
+    def status(self, job_id=None, since=None):
+        """
+        One job as a dict, or all jobs as a list when job_id is None. With `since`, the
+        job also carries "log" (its output lines from that index on) and "log_next".
+        """
+        with self._lock:
+            if job_id is None:
+                return [self._public(self._jobs[i]) for i in self._order]
+            job = self._jobs.get(job_id)
+            if not job: return None
+            job, log = self._public(job), self._logs.get(job_id)
+        if since is not None:
+            job["log"], job["log_next"] = log.since(since) if log else ([], since)
+        return job
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job["state"] not in ("queued", "running"): return False
+            job["cancel"], job["paused"] = True, False
+            if job["state"] == "queued":
+                job["state"], job["finished"] = "cancelled", time.time()
+            control = self._controls[job_id]
+        # Kills a running ffmpeg and abandons network waits; the job stops at its next checkpoint
+        control.cancel()
+        print(f"[Service] Cancel requested for job {job_id}")
+        return True
+
+    def pause(self, job_id):
+        return self._set_paused(job_id, True)
+
+    def resume(self, job_id):
+        return self._set_paused(job_id, False)
+
+    def _set_paused(self, job_id, paused):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job["state"] not in ("queued", "running") or job["cancel"]: return False
+            job["paused"] = paused
+            control = self._controls[job_id]
+        if paused: control.pause()
+        else: control.resume()
+        print(f"[Service] Job {job_id} {'paused' if paused else 'resumed'}")
+        return True
+
+    def _public(self, job):
+        return json.loads(json.dumps(job))
+
+    def _prune(self):
+        finished = [i for i in self._order if self._jobs[i]["state"] in ("done", "failed", "cancelled")]
+        for job_id in finished[:-KEEP_FINISHED_JOBS]:
+            self._order.remove(job_id)
+            del self._jobs[job_id]
+            del self._controls[job_id]
+            self._logs.pop(job_id, None)
+
+    def _update(self, job, **fields):
+        with self._lock:
+            job.update(fields)
+
+    def start(self):
+        # Optional /metrics endpoint and exit dump (JAVCOVER_METRICS_PORT / JAVCOVER_METRICS_FILE)
+        metrics.start()
+        metrics.set_gauge("queue_depth", lambda: sum(1 for job in list(self._jobs.values()) if job["state"] == "queued"),
+                          queue="service")
+        threading.Thread(target=self._worker, daemon=True).start()
+        return self
+
+    def _worker(self):
+        while not self._stopped.is_set():
+            try:
+                job_id = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if not job or job["state"] != "queued": continue
+                job["state"], job["started"] = "running", time.time()
+                log = self._logs[job_id] = JobLog(job, sys.stdout)
+            # Clients in other processes read the job's output from the log (see status)
+            sys.stdout = log
+            try:
+                self._run_job(job)
+            except Exception as e:
+                print(f"[Service] Job {job['id']} failed: {e}")
+                self._update(job, state="failed", error=str(e), finished=time.time())
+            finally:
+                sys.stdout = log.stream
+                log.close()
+            self._last_activity = time.time()
+
+    # --- Running jobs (pipeline modules are imported on first use) ---
+    def _run_job(self, job):
+        import run_report
+        import batch_journal
+
+        run_report.reset()
+        batch_journal.recover()
+        options = job["options"]
+        dry_run = bool(options.get("dry_run"))
+        journal = batch_journal.NULL if dry_run else \
+            batch_journal.BatchJournal.open(f"service-{job['kind']}", files=job["paths"])
+        prefetcher = None
+        try:
+            items = job["paths"]
+            if not dry_run:
+                for directory in sorted({p if os.path.isdir(p) else os.path.dirname(p) for p in items}):
+                    batch_journal.sweep_temp_files(directory)
+            if job["kind"] != "rename":
+                from faststart import expand_paths
+                items = expand_paths(items)
+                self._update(job, total=len(items))
+            print(f"\n[Service] Running {job['kind']} job {job['id']} ({len(items)} item(s))")
+
+            control = self._controls[job["id"]]
+            files = [p for p in items if not os.path.isdir(p)]
+            if job["kind"] == "rename" and len(files) > 1:
+                # Look up every picked file now; the sequential disk work then rarely waits on the network
+                import prefetch
+                import rename_movies
+                prefetcher = prefetch.Prefetcher(rename_movies.get_cover_dir(options.get("cover_dir")),
+                                                 fetch_covers=not dry_run).add_all(files)
+            with job_control.active(control):
+                for index, path in enumerate(items):
+                    name = os.path.basename(path)
+
+                    def progress(pct, msg, index=index, name=name):
+                        self._update(job, current={"index": index, "file": name, "pct": pct, "msg": msg})
+
+                    try:
+                        if control.paused: progress(job["current"]["pct"], "Paused")
+                        control.checkpoint()
+                        progress(0, f"Processing {name}")
+                        result = self._run_item(job, path, progress, journal)
+                    except job_control.Cancelled:
+                        break
+                    except Exception as e:
+                        print(f"  [Service] Error on {name}: {e}")
+                        result = False
+                    with self._lock:
+                        job["results"].append({"path": path, "ok": bool(result)})
+                        job["completed"] = index + 1
+        finally:
+            # Also when the sweep, expand_paths or the prefetcher raise
+            if prefetcher: prefetcher.close()
+            journal.close()
+
+        run_report.print_summary(f"Job {job['id']} report")
+        state = "cancelled" if job["cancel"] else "done"
+        print(f"[Service] Job {job['id']} {state}")
+        self._update(job, state=state, finished=time.time(), report=run_report.snapshot(),
+                     current={**job["current"], "pct": 100, "msg": "Cancelled." if job["cancel"] else "All Done."})
+
+    def _run_item(self, job, path, progress, journal):
+        kind, options = job["kind"], job["options"]
+        if kind == "rename":
+            import rename_movies
+            callback = lambda _index, pct, msg: progress(pct, msg)
+            control = self._controls[job["id"]]
+            if os.path.isdir(path):
+                rename_movies.process_directory(path, dry_run=options.get("dry_run", False), progress_callback=callback,
+                                                custom_cover_dir=options.get("cover_dir"),
+                                                recursive=options.get("recursive", False), journal=journal,
+                                                control=control)
+            else:
+                rename_movies.process_directory(os.path.dirname(path), dry_run=options.get("dry_run", False),
+                                                target_file=os.path.basename(path), progress_callback=callback,
+                                                custom_cover_dir=options.get("cover_dir"), journal=journal,
+                                                control=control)
+            return True
+        if kind == "manual":
+            import manual_fix
+            unresolved = []
+            result = manual_fix.process_file(path, progress_callback=progress, unresolved=unresolved, journal=journal,
+                                             control=self._controls[job["id"]])
+            with self._lock:
+                job["unresolved"].extend(unresolved)
+            return result
+        import faststart
+        return faststart.faststart(path, journal=journal)
+
+    # --- HTTP ---
+    def serve_http(self, port=0, token=None):
+        """Serve the API on 127.0.0.1 in a background thread and publish worker.json. Returns the port."""
+        service = self
+        token = token or secrets.token_hex(16)
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, body):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _authorized(self):
+                if secrets.compare_digest(self.headers.get(TOKEN_HEADER, ""), token): return True
+                self._reply(403, {"error": "bad token"})
+                return False
+
+            def do_GET(self):
+                if not self._authorized(): return
+                url = urlsplit(self.path)
+                parts = url.path.strip("/").split("/")
+                try:
+                    since = parse_qs(url.query).get("since")
+                    since = max(int(since[0]), 0) if since else None
+                except ValueError:
+                    return self._reply(400, {"error": "invalid since"})
+                if parts == ["health"]:
+                    self._reply(200, {"ok": True, "pid": os.getpid()})
+                elif parts == ["jobs"]:
+                    self._reply(200, service.status())
+                elif len(parts) == 2 and parts[0] == "jobs":
+                    job = service.status(parts[1], since=since)
+                    self._reply(200 if job else 404, job or {"error": "no such job"})
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                if not self._authorized(): return
+                parts = self.path.strip("/").split("/")
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return self._reply(400, {"error": "invalid JSON"})
+                if parts == ["jobs"]:
+                    try:
+                        job_id = service.submit(body.get("kind"), body.get("paths") or [], **(body.get("options") or {}))
+                    except (ValueError, TypeError) as e:
+                        return self._reply(400, {"error": str(e)})
+                    self._reply(200, {"id": job_id})
+                elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+                    self._reply(200, {"cancelled": service.cancel(parts[1])})
+                elif len(parts) == 3 and parts[0] == "jobs" and parts[2] in ("pause", "resume"):
+                    action = service.pause if parts[2] == "pause" else service.resume
+                    self._reply(200, {"ok": action(parts[1])})
+                elif parts == ["shutdown"]:
+                    self._reply(200, {"ok": True})
+                    threading.Thread(target=service.stop, daemon=True).start()
+                else:
+                    self._reply(404, {"error": "not found"})
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        port = self._server.server_address[1]
+        info = {"pid": os.getpid(), "port": port, "token": token, "started": time.time()}
+        temp = _info_path() + ".tmp"
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(temp, _info_path())
+        print(f"[Service] Listening on 127.0.0.1:{port}")
+        return port
+
+    def idle(self):
+        with self._lock:
+            busy = any(job["state"] in ("queued", "running") for job in self._jobs.values())
+        return not busy and self._queue.empty()
+
+    def stop(self):
+        self._stopped.set()
+        if self._server:
+            self._server.shutdown()
+            try:
+                with open(_info_path(), 'r', encoding='utf-8') as f:
+                    if json.load(f).get("pid") == os.getpid(): os.remove(_info_path())
+            except (OSError, ValueError):
+                pass
+
+    def wait(self, idle_exit=None):
+        """Block until stopped (or idle for `idle_exit` seconds)."""
+        while not self._stopped.wait(1):
+            if idle_exit and self.idle() and time.time() - self._last_activity > idle_exit:
+                print(f"[Service] Idle for {idle_exit:.0f}s, exiting.")
+                self.stop()
+
+
+# --- Client ---
+
+class ServiceClient:
+    """Talks to a running service; same submit/status/cancel/pause/resume interface as WorkerService."""
+
+    def __init__(self, port, token):
+        self.port = port
+        self.token = token
+
+    def _request(self, method, path, body=None, timeout=10):
+        import urllib.request
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(f"http://127.0.0.1:{self.port}{path}", data=data, method=method,
+                                         headers={TOKEN_HEADER: self.token, "Content-Type": "application/json"})
+        # Never route loopback traffic through a configured proxy
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        with opener.open(request, timeout=timeout) as resp:
+            return json.loads(resp.read())
+
+    def health(self):
+        try:
+            return self._request("GET", "/health", timeout=1).get("ok", False)
+        except Exception:
+            return False
+
+    def submit(self, kind, paths, **options):
+        return self._request("POST", "/jobs", {"kind": kind, "paths": [os.path.abspath(p) for p in paths],
+                                               "options": options})["id"]
+
+    def status(self, job_id=None, since=None):
+        if job_id is None: return self._request("GET", "/jobs")
+        try:
+            return self._request("GET", f"/jobs/{job_id}" + (f"?since={since}" if since is not None else ""))
+        except Exception:
+            return None
+
+    def cancel(self, job_id):
+        return self._request("POST", f"/jobs/{job_id}/cancel", {}).get("cancelled", False)
+
+    def pause(self, job_id):
+        return self._request("POST", f"/jobs/{job_id}/pause", {}).get("ok", False)
+
+    def resume(self, job_id):
+        return self._request("POST", f"/jobs/{job_id}/resume", {}).get("ok", False)
+
+    def shutdown(self):
+        return self._request("POST", "/shutdown", {})
+
+
+def connect(start=False, timeout=15):
+    """
+    ServiceClient for the running service, or None. With start=True a service is
+    launched in the background first if none answers (not possible from the frozen exe).
+    """
+    def running():
+        try:
+            with open(_info_path(), 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        client = ServiceClient(info["port"], info["token"])
+        return client if client.health() else None
+
+    client = running()
+    if client or not start or getattr(sys, 'frozen', False): return client
+
+    log = open(os.path.join(data_dir(), "worker.log"), 'ab')
+    kwargs = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP} \
+        if os.name == 'nt' else {"start_new_session": True}
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--idle-exit", str(DEFAULT_IDLE_EXIT)],
+                     stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                     cwd=os.path.dirname(os.path.abspath(__file__)), **kwargs)
+    log.close()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(0.2)
+        client = running()
+        if client: return client
+    return None
+
+
+def wait_for_job(client, job_id, poll=0.5):
+    """Print the output and progress of a job until it finishes (Ctrl+C cancels it). Returns the final job dict."""
+    last, since = None, 0
+    while True:
+        job = client.status(job_id, since=since)
+        if not job: return None
+        for line in job.get("log", []): print(line)
+        since = job.get("log_next", since)
+        current = job["current"]
+        state = "paused" if job.get("paused") and job["state"] == "running" else job["state"]
+        line = f"[{state}] {job['completed']}/{job['total']} {current.get('file') or ''}: {current['msg']}"
+        if line != last:
+            print(line)
+            last = line
+        if job["state"] not in ("queued", "running"):
+            for row in job.get("unresolved", []):
+                print(f"  [Unresolved] {os.path.basename(row['file'])}: {row['reason']} {row.get('related', '')}")
+            failed = sum(1 for r in job["results"] if not r["ok"])
+            print(f"Job {job['state']}: {len(job['results']) - failed} ok, {failed} failed")
+            return job
+        try:
+            time.sleep(poll)
+        except KeyboardInterrupt:
+            # Ctrl+C in the waiting console stops the job too, not just the follower
+            print("Cancelling job...")
+            client.cancel(job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local JavCover worker service and client.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve", help="Run the service in the foreground")
+    p_serve.add_argument("--port", type=int, default=0)
+    p_serve.add_argument("--idle-exit", type=float, default=None, help="Exit after this many idle seconds")
+    p_submit = sub.add_parser("submit", help="Queue a job (starts the service if needed)")
+    p_submit.add_argument("kind", choices=JOB_KINDS)
+    p_submit.add_argument("paths", nargs="+")
+    p_submit.add_argument("--dry-run", action="store_true")
+    p_submit.add_argument("--recursive", "-r", action="store_true")
+    p_submit.add_argument("--cover-dir")
+    p_submit.add_argument("--wait", action="store_true", help="Follow the job until it finishes")
+    p_status = sub.add_parser("status", help="Show one job or all jobs")
+    p_status.add_argument("job", nargs="?")
+    p_cancel = sub.add_parser("cancel", help="Cancel a job")
+    p_cancel.add_argument("job")
+    p_pause = sub.add_parser("pause", help="Pause a running job at its next checkpoint")
+    p_pause.add_argument("job")
+    p_resume = sub.add_parser("resume", help="Resume a paused job")
+    p_resume.add_argument("job")
+    sub.add_parser("stop", help="Stop the running service")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if connect():
+            print("[Service] Already running.")
+            return
+        service = WorkerService().start()
+        service.serve_http(args.port)
+        try:
+            service.wait(args.idle_exit)
+        except KeyboardInterrupt:
+            service.stop()
+        return
+
+    client = connect(start=args.command == "submit")
+    if not client:
+        print("Worker service is not running." if args.command != "submit" else "Could not start the worker service.")
+        sys.exit(1)
+    if args.command == "submit":
+        options = {"dry_run": args.dry_run, "recursive": args.recursive}
+        if args.cover_dir: options["cover_dir"] = os.path.abspath(args.cover_dir)
+        job_id = client.submit(args.kind, args.paths, **options)
+        print(f"Job {job_id} queued.")
+        if args.wait:
+            job = wait_for_job(client, job_id)
+            sys.exit(0 if job and job["state"] == "done" else 1)
+    elif args.command == "status":
+        jobs = [client.status(args.job)] if args.job else client.status()
+        for job in jobs:
+            if not job: continue
+            state = "paused" if job.get("paused") and job["state"] == "running" else job["state"]
+            print(f"{job['id']}  {job['kind']:9} {state:9} {job['completed']}/{job['total']}  "
+                  f"{job['current'].get('file') or ''} {job['current']['msg']}")
+    elif args.command == "cancel":
+        print("Cancelled." if client.cancel(args.job) else "Job is not queued or running.")
+    elif args.command in ("pause", "resume"):
+        ok = client.pause(args.job) if args.command == "pause" else client.resume(args.job)
+        print(f"{args.command.capitalize()}d." if ok else "Job is not queued or running.")
+    elif args.command == "stop":
+        client.shutdown()
+        print("Service stopped.")
+
+
+if __name__ == "__main__":
+    main()